@@ -0,0 +1 @@
+"""Offline performance benchmarks for EduMirror (see run_benchmarks.py)."""
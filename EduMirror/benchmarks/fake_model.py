@@ -0,0 +1,114 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deterministic stand-in language model for offline benchmarks.
+
+`NoLanguageModel` returns empty strings, which short-circuits much of the
+prompt-parsing code in the agents and game masters. `FakeLanguageModel`
+instead returns cheap, deterministic answers in the formats EduMirror prompts
+ask for, so the framework exercises the same code paths it would with a real
+provider, without network access or API cost.
+"""
+
+import re
+import time
+import zlib
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any
+
+from concordia.language_model import language_model
+
+
+_UTTERANCES = (
+    'I think we should talk about this a bit more before deciding.',
+    'That sounds reasonable to me, but I have a few concerns.',
+    'I understand how you feel, and I want to help.',
+    'Let us try to find a solution that works for everyone.',
+    'I am not sure yet; can you tell me more about it?',
+)
+_NUMBERED_LIST = re.compile(r'(Activity|Response) 1:')
+_FORMAT_LINE = re.compile(r'^\s*([A-Za-z][\w ]{0,40}):\s*<[^>]*>\s*$', re.MULTILINE)
+_COUNT = re.compile(r'generate (\d+) ')
+
+
+def _pick(prompt: str, options: Sequence[str]) -> str:
+    return options[zlib.crc32(prompt.encode('utf-8')) % len(options)]
+
+
+def fake_completion(prompt: str) -> str:
+    """Return a deterministic completion in the format requested by `prompt`.
+
+    Args:
+        prompt: The full prompt text
+
+    Returns:
+        A short answer that satisfies EduMirror's common output formats:
+        bracketed yes/no letters, "Activity i:" lists, "Reaction:" lines,
+        "key: <value>" templates and free "Name: utterance" dialogue
+    """
+    tail = prompt[-2000:]
+    if '(a) Yes' in tail:
+        return '(a) Yes.'
+    if _NUMBERED_LIST.search(tail):
+        match = _COUNT.search(tail)
+        count = int(match.group(1)) if match else 3
+        return '\n'.join(
+            f'Activity {i + 1}: {_UTTERANCES[i % len(_UTTERANCES)]}' for i in range(count)
+        )
+    if "'Reaction:" in tail:
+        return f'Reaction: {_pick(prompt, _UTTERANCES)}'
+    keys = _FORMAT_LINE.findall(tail)
+    if keys:
+        return '\n'.join(f'{key}: 5' for key in dict.fromkeys(keys))
+    return _pick(prompt, _UTTERANCES)
+
+
+class FakeLanguageModel(language_model.LanguageModel):
+    """Language model that answers from `fake_completion` without I/O."""
+
+    def __init__(self, latency_s: float = 0.0):
+        """Initialize the fake model.
+
+        Args:
+            latency_s: Artificial delay added to every call
+        """
+        self._latency_s = latency_s
+
+    def sample_text(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = language_model.DEFAULT_MAX_TOKENS,
+        terminators: Collection[str] = language_model.DEFAULT_TERMINATORS,
+        temperature: float = language_model.DEFAULT_TEMPERATURE,
+        timeout: float = language_model.DEFAULT_TIMEOUT_SECONDS,
+        seed: int | None = None,
+    ) -> str:
+        del max_tokens, terminators, temperature, timeout, seed
+        if self._latency_s:
+            time.sleep(self._latency_s)
+        return fake_completion(prompt)
+
+    def sample_choice(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        *,
+        seed: int | None = None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        del seed
+        if self._latency_s:
+            time.sleep(self._latency_s)
+        idx = zlib.crc32(prompt.encode('utf-8')) % len(responses)
+        return idx, responses[idx], {}
@@ -0,0 +1,427 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-in for an OpenAI-compatible provider.
+
+The server implements the endpoints EduMirror uses through the `openai`
+client (`/v1/chat/completions`, `/v1/completions`, `/v1/embeddings`,
+`/v1/models`) with the standard library only. Completions come from a
+scripted table of regex rules, falling back to `fake_completion`, which
+produces EduMirror's usual answer formats. Chat completions also honor
+`logprobs`/`top_logprobs` (the lettered options of the prompt are offered as
+alternatives for the first token), `max_tokens` and `json_schema` response
+formats with an `enum`, as used by choice scoring. Provider behavior is reproduced
+with configurable latency (log-normal around a median), HTTP 429 and 500
+errors, hung requests that trip client timeouts, and SSE streaming.
+
+Point a model at it with:
+    ModelConfig(api_type='openai', model_name='fake', api_key='sk-local',
+                base_url='http://127.0.0.1:8000/v1')
+
+Run standalone:
+    python -m benchmarks.fake_openai_server --port 8000 --latency-ms 300 --rate-429 0.05
+"""
+
+import argparse
+import dataclasses
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.fake_model import fake_completion
+
+
+@dataclasses.dataclass
+class FakeProviderConfig:
+    """Behavior of the fake provider.
+
+    Attributes:
+        latency_ms: Median time to first token
+        latency_sigma: Log-normal spread of the latency; 0 makes it fixed
+        stream_chunk_ms: Delay between streamed chunks
+        rate_429: Fraction of requests answered with HTTP 429
+        rate_500: Fraction of requests answered with HTTP 500
+        timeout_rate: Fraction of requests that hang for `timeout_s`
+        timeout_s: How long a hung request blocks before closing
+        embedding_dim: Dimension of returned embeddings
+        seed: Seed for latency and error sampling
+        script: (regex, completion) rules checked before the default formats
+    """
+    latency_ms: float = 200.0
+    latency_sigma: float = 0.5
+    stream_chunk_ms: float = 5.0
+    rate_429: float = 0.0
+    rate_500: float = 0.0
+    timeout_rate: float = 0.0
+    timeout_s: float = 120.0
+    embedding_dim: int = 384
+    seed: int = 0
+    script: List[Tuple[str, str]] = dataclasses.field(default_factory=list)
+
+
+def _count_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _tokenize(text: str) -> List[str]:
+    return re.findall(r'\w+|[^\w\s]|\s+', text) or ['']
+
+
+def _token_logprobs(prompt: str, text: str, top: int) -> Dict[str, Any]:
+    """Fake `logprobs.content` for `text`, with the prompt's option letters as alternatives."""
+    options = list(dict.fromkeys(re.findall(r'^\s*\(([a-z])\)', prompt, re.MULTILINE)))
+    content = []
+    for i, token in enumerate(_tokenize(text)):
+        alternatives = [o for o in options if o != token] if i == 0 else []
+        weights = [1 + zlib.crc32(f'{prompt}{o}'.encode('utf-8')) % 7 for o in alternatives]
+        top_logprobs = [{'token': token, 'logprob': math.log(0.6), 'bytes': None}]
+        for option, weight in zip(alternatives, weights):
+            top_logprobs.append({'token': option, 'logprob': math.log(0.4 * weight / sum(weights)), 'bytes': None})
+        top_logprobs = sorted(top_logprobs, key=lambda t: t['logprob'], reverse=True)[:max(top, 1)]
+        content.append({'token': token, 'logprob': math.log(0.6), 'bytes': None, 'top_logprobs': top_logprobs})
+    return {'content': content}
+
+
+def _schema_enum(response_format: Any) -> Optional[List[str]]:
+    if not isinstance(response_format, dict) or response_format.get('type') != 'json_schema':
+        return None
+    schema = response_format.get('json_schema', {}).get('schema', {})
+    for prop in schema.get('properties', {}).values():
+        if isinstance(prop, dict) and prop.get('enum'):
+            return [str(v) for v in prop['enum']]
+    return None
+
+
+def _embed(text: str, dim: int) -> List[float]:
+    rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+    vector = rng.standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: '_ProviderHTTPServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        del format, args
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str, error_type: str, headers=None) -> None:
+        self._send_json(status, {'error': {'message': message, 'type': error_type, 'code': status}}, headers)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'fake', 'object': 'model', 'owned_by': 'edumirror'}]})
+        elif self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, self.server.provider.stats())
+        else:
+            self._send_error(404, f'Unknown path {self.path}', 'invalid_request_error')
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_error(400, 'Invalid JSON body', 'invalid_request_error')
+            return
+        provider = self.server.provider
+        path = self.path.rstrip('/')
+        start = time.perf_counter()
+
+        fault, latency_s = provider.sample_behavior()
+        if fault == 'timeout':
+            time.sleep(provider.config.timeout_s)
+            provider.record(path, 'timeout', time.perf_counter() - start)
+            self.close_connection = True
+            return
+        time.sleep(latency_s)
+        if fault == '429':
+            provider.record(path, '429', time.perf_counter() - start)
+            self._send_error(429, 'Rate limit reached (injected).', 'rate_limit_error', {'Retry-After': '1'})
+            return
+        if fault == '500':
+            provider.record(path, '500', time.perf_counter() - start)
+            self._send_error(500, 'Internal server error (injected).', 'server_error')
+            return
+
+        if path.endswith('/embeddings'):
+            inputs = body.get('input', '')
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+            data = [
+                {'object': 'embedding', 'index': i, 'embedding': _embed(text, provider.config.embedding_dim)}
+                for i, text in enumerate(inputs)
+            ]
+            tokens = sum(_count_tokens(t) for t in inputs)
+            self._send_json(200, {
+                'object': 'list', 'data': data, 'model': body.get('model', 'fake'),
+                'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+            })
+        elif path.endswith('/chat/completions') or path.endswith('/completions'):
+            chat = path.endswith('/chat/completions')
+            if chat:
+                prompt = '\n'.join(str(m.get('content', '')) for m in body.get('messages', []))
+            else:
+                prompt = str(body.get('prompt', ''))
+            text = provider.complete(prompt, body.get('stop'))
+            enum = _schema_enum(body.get('response_format'))
+            if enum:
+                text = json.dumps({'answer': enum[zlib.crc32(prompt.encode('utf-8')) % len(enum)]})
+            elif body.get('max_tokens'):
+                text = ''.join(_tokenize(text)[:int(body['max_tokens'])])
+            if body.get('stream'):
+                self._stream(body, text, chat)
+            else:
+                self._send_json(200, self._completion_body(body, prompt, text, chat))
+        else:
+            self._send_error(404, f'Unknown path {self.path}', 'invalid_request_error')
+            return
+        provider.record(path, '200', time.perf_counter() - start)
+
+    def _completion_body(self, body: Dict[str, Any], prompt: str, text: str, chat: bool) -> Dict[str, Any]:
+        choice: Dict[str, Any] = {'index': 0, 'finish_reason': 'stop', 'logprobs': None}
+        if chat and body.get('logprobs'):
+            choice['logprobs'] = _token_logprobs(prompt, text, int(body.get('top_logprobs') or 0))
+        if chat:
+            choice['message'] = {'role': 'assistant', 'content': text}
+        else:
+            choice['text'] = text
+        prompt_tokens, completion_tokens = _count_tokens(prompt), _count_tokens(text)
+        return {
+            'id': f'fake-{uuid.uuid4().hex[:12]}',
+            'object': 'chat.completion' if chat else 'text_completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [choice],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _stream(self, body: Dict[str, Any], text: str, chat: bool) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        completion_id = f'fake-{uuid.uuid4().hex[:12]}'
+        pieces = re.findall(r'\S+\s*', text) or ['']
+        for i, piece in enumerate(pieces + [None]):
+            if chat:
+                delta = {} if piece is None else ({'role': 'assistant', 'content': piece} if i == 0 else {'content': piece})
+                choice = {'index': 0, 'delta': delta, 'finish_reason': 'stop' if piece is None else None}
+            else:
+                choice = {'index': 0, 'text': piece or '', 'finish_reason': 'stop' if piece is None else None}
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk' if chat else 'text_completion',
+                'created': int(time.time()),
+                'model': body.get('model', 'fake'),
+                'choices': [choice],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.provider.config.stream_chunk_ms / 1000.0)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+
+class _ProviderHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, provider: 'FakeOpenAIServer'):
+        super().__init__(address, _Handler)
+        self.provider = provider
+
+
+class FakeOpenAIServer:
+    """Threaded fake provider; usable as a context manager."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: Optional[FakeProviderConfig] = None):
+        """Create the server (port 0 picks a free port).
+
+        Args:
+            host: Interface to bind
+            port: Port to bind; 0 chooses a free one
+            config: Latency, error injection and scripted completions
+        """
+        self.config = config or FakeProviderConfig()
+        self._script = [(re.compile(pattern, re.DOTALL), text) for pattern, text in self.config.script]
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._requests: List[Tuple[str, str, float]] = []
+        self._httpd = _ProviderHTTPServer((host, port), self)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """OpenAI-style base URL, e.g. http://127.0.0.1:8000/v1."""
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def sample_behavior(self) -> Tuple[Optional[str], float]:
+        """Draw the fault (None, '429', '500', 'timeout') and latency for a request."""
+        with self._lock:
+            u = self._rng.random()
+            if self.config.latency_sigma > 0:
+                latency_ms = self._rng.lognormvariate(math.log(max(self.config.latency_ms, 1e-3)), self.config.latency_sigma)
+            else:
+                latency_ms = self.config.latency_ms
+        fault = None
+        if u < self.config.rate_429:
+            fault = '429'
+        elif u < self.config.rate_429 + self.config.rate_500:
+            fault = '500'
+        elif u < self.config.rate_429 + self.config.rate_500 + self.config.timeout_rate:
+            fault = 'timeout'
+        return fault, latency_ms / 1000.0
+
+    def complete(self, prompt: str, stop: Any = None) -> str:
+        """Return the scripted or default completion for `prompt`."""
+        text = next((t for pattern, t in self._script if pattern.search(prompt)), None)
+        if text is None:
+            text = fake_completion(prompt)
+        for terminator in ([stop] if isinstance(stop, str) else stop or []):
+            if terminator and terminator in text:
+                text = text.split(terminator, 1)[0]
+        return text
+
+    def record(self, path: str, status: str, latency_s: float) -> None:
+        with self._lock:
+            self._requests.append((path, status, latency_s))
+
+    def stats(self) -> Dict[str, Any]:
+        """Request counts by status and latency percentiles of answered requests."""
+        with self._lock:
+            requests = list(self._requests)
+        by_status: Dict[str, int] = {}
+        for _, status, _ in requests:
+            by_status[status] = by_status.get(status, 0) + 1
+        latencies = [lat for _, status, lat in requests if status == '200']
+        return {
+            'requests': len(requests),
+            'by_status': by_status,
+            'latency_s': latency_percentiles(latencies),
+        }
+
+    def start(self) -> 'FakeOpenAIServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'FakeOpenAIServer':
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def latency_percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    """Return mean, p50, p90, p99 and max of `latencies` (None when empty)."""
+    if not latencies:
+        return {'mean': None, 'p50': None, 'p90': None, 'p99': None, 'max': None}
+    values = np.asarray(latencies, dtype=float)
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+
+def load_script(path: str) -> List[Tuple[str, str]]:
+    """Load scripted completions from a JSONL file of {"match": regex, "response": text}."""
+    rules = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                rule = json.loads(line)
+                rules.append((rule['match'], rule['response']))
+    return rules
+
+
+def add_provider_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the FakeProviderConfig options to `parser`."""
+    defaults = FakeProviderConfig()
+    parser.add_argument('--latency-ms', type=float, default=defaults.latency_ms, help='Median latency')
+    parser.add_argument('--latency-sigma', type=float, default=defaults.latency_sigma, help='Log-normal latency spread')
+    parser.add_argument('--stream-chunk-ms', type=float, default=defaults.stream_chunk_ms, help='Delay between streamed chunks')
+    parser.add_argument('--rate-429', type=float, default=defaults.rate_429, help='Fraction of requests answered with 429')
+    parser.add_argument('--rate-500', type=float, default=defaults.rate_500, help='Fraction of requests answered with 500')
+    parser.add_argument('--timeout-rate', type=float, default=defaults.timeout_rate, help='Fraction of requests that hang')
+    parser.add_argument('--timeout-s', type=float, default=defaults.timeout_s, help='How long hung requests block')
+    parser.add_argument('--embedding-dim', type=int, default=defaults.embedding_dim)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--script', default=None, help='JSONL file of scripted completions')
+
+
+def provider_config_from_args(args: argparse.Namespace) -> FakeProviderConfig:
+    return FakeProviderConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        stream_chunk_ms=args.stream_chunk_ms,
+        rate_429=args.rate_429,
+        rate_500=args.rate_500,
+        timeout_rate=args.timeout_rate,
+        timeout_s=args.timeout_s,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+        script=load_script(args.script) if args.script else [],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fake OpenAI-compatible server for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    add_provider_arguments(parser)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.host, args.port, provider_config_from_args(args))
+    print(f'[Fake Provider] Serving on {server.base_url}')
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load-test driver on top of the fake OpenAI-compatible server.
+
+Starts a `FakeOpenAIServer` in-process and drives it through the real model
+stack (`create_language_model` with `api_type='openai'` and the server's
+`base_url`), so client-side concurrency, retries and timeouts behave as they
+would against a provider. Two modes:
+
+- scenarios (default): run `--parallel-runs` copies of each selected scenario
+  entry point concurrently
+- synthetic: issue `--requests` calls with `--concurrency` worker threads
+
+The report contains requests per second, client-side latency percentiles
+(from `LLMTelemetry`), error and retry counts, and server-side statistics.
+
+Usage (from the `EduMirror` directory):
+    python -m benchmarks.load_test --scenarios the_spread_of_gossip --parallel-runs 4 --latency-ms 400
+    python -m benchmarks.load_test --synthetic --requests 500 --concurrency 32 --rate-429 0.05
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent import futures
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+EDUMIRROR_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if EDUMIRROR_ROOT not in sys.path:
+    sys.path.insert(0, EDUMIRROR_ROOT)
+
+from benchmarks.fake_openai_server import (  # noqa: E402
+    FakeOpenAIServer, add_provider_arguments, latency_percentiles, provider_config_from_args,
+)
+from common.simulation_utils.llm_telemetry import LLMTelemetry  # noqa: E402
+from common.simulation_utils.model_setup import ModelConfig, create_language_model  # noqa: E402
+
+SYNTHETIC_PROMPTS = (
+    "Format strictly 'Name: utterance'. Respond to your classmate's question about the weekend trip.",
+    'Is this behavior more beneficial to Alex? Please answer in the format of the letter with brackets : (a) Yes. (b) No.',
+    "Please generate 3 emotional and behavioral responses in the following format:\n'Response 1: <first>\nResponse 2: <second>",
+    'Please output the psychological state observations in the following format: \nJoy: <Joy state> \nComfort: <Comfort state> \n',
+)
+
+
+def _run_scenarios(model, names: List[str], parallel_runs: int, entry: str) -> Dict[str, Any]:
+    scenarios_dir = os.path.join(EDUMIRROR_ROOT, 'scenarios')
+
+    def _run_one(run_id: int, name: str) -> Optional[str]:
+        path = os.path.join(scenarios_dir, name, 'main.py')
+        module_name = f'load_test_{name.replace("-", "_")}_{run_id}'
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.create_language_model = lambda *args, **kwargs: model
+        try:
+            getattr(module, entry)()
+        except Exception as e:
+            return f'{name}#{run_id}: {e!r}'
+        return None
+
+    jobs = [(i, name) for name in names for i in range(parallel_runs)]
+    with futures.ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        errors = [e for e in pool.map(lambda job: _run_one(*job), jobs) if e]
+    return {'scenario_runs': len(jobs), 'failed_runs': errors}
+
+
+def _run_synthetic(model, num_requests: int, concurrency: int) -> Dict[str, Any]:
+    def _call(i: int) -> Optional[str]:
+        try:
+            model.sample_text(SYNTHETIC_PROMPTS[i % len(SYNTHETIC_PROMPTS)], max_tokens=256)
+        except Exception as e:
+            return repr(e)
+        return None
+
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        errors = [e for e in pool.map(_call, range(num_requests)) if e]
+    return {'requests_issued': num_requests, 'concurrency': concurrency, 'failed_requests': len(errors)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test against the fake OpenAI-compatible server')
+    parser.add_argument('--scenarios', default='', help='Comma-separated scenario names (scenario mode)')
+    parser.add_argument('--entry', default='run_baseline', help='Scenario entry point')
+    parser.add_argument('--parallel-runs', type=int, default=1, help='Concurrent runs per scenario')
+    parser.add_argument('--synthetic', action='store_true', help='Issue synthetic requests instead of scenario runs')
+    parser.add_argument('--requests', type=int, default=200, help='Synthetic requests')
+    parser.add_argument('--concurrency', type=int, default=16, help='Synthetic worker threads')
+    parser.add_argument('--max-retries', type=int, default=3, help='Client retries per call (telemetry wrapper)')
+    parser.add_argument('--output', default=None, help='Report JSON path')
+    add_provider_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.synthetic and not args.scenarios:
+        parser.error('pass --scenarios NAME[,NAME...] or --synthetic')
+
+    telemetry = LLMTelemetry(run_name='load_test')
+    with FakeOpenAIServer(config=provider_config_from_args(args)) as server:
+        model = create_language_model(
+            ModelConfig(api_type='openai', model_name='fake', api_key='sk-local', base_url=server.base_url),
+            telemetry=telemetry,
+            max_retries=args.max_retries,
+        )
+        start = time.perf_counter()
+        if args.synthetic:
+            outcome = _run_synthetic(model, args.requests, args.concurrency)
+        else:
+            names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+            previous_cwd = os.getcwd()
+            with tempfile.TemporaryDirectory(prefix='edumirror_load_') as workdir:
+                os.chdir(workdir)
+                try:
+                    outcome = _run_scenarios(model, names, args.parallel_runs, args.entry)
+                finally:
+                    os.chdir(previous_cwd)
+        wall_s = time.perf_counter() - start
+        server_stats = server.stats()
+
+    calls = telemetry.get_records('call')
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'provider': vars(provider_config_from_args(args)),
+        'wall_time_s': wall_s,
+        'model_calls': len(calls),
+        'failed_calls': sum(1 for c in calls if c['error'] is not None),
+        'retries': sum(c['retries'] for c in calls),
+        'requests_per_s': server_stats['requests'] / wall_s if wall_s else None,
+        'completed_calls_per_s': len(calls) / wall_s if wall_s else None,
+        'client_latency_s': latency_percentiles([c['latency_s'] for c in calls if c['error'] is None]),
+        'server': server_stats,
+        **outcome,
+    }
+    print(json.dumps(report, indent=2, default=str))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=str)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
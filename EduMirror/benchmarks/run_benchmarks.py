@@ -0,0 +1,375 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline benchmarks for EduMirror framework overhead.
+
+Every benchmark runs in its own subprocess (so peak RSS is per benchmark) with
+`FakeLanguageModel` in place of the provider model. Benchmarks:
+
+- `scenario:<name>`: `run_baseline()` (or `--entry`) of `scenarios/<name>/main.py`
+- `agent_construction`: `AgentFactory.create_student` for `--agents` agents
+- `rubric_rating`: every rubric in `common.measurement.rubrics` over a synthetic transcript
+- `survey_scoring`: every questionnaire in `common.measurement.questionnaire`
+
+Each result records wall time, Python CPU time, peak RSS and model calls
+(scenario results also record steps and wall time per step). Results are
+written as JSON; `--compare` checks them against an earlier results file.
+
+Usage (from the `EduMirror` directory):
+    python -m benchmarks.run_benchmarks --output bench_results/latest.json
+    python -m benchmarks.run_benchmarks --only scenario:the_spread_of_gossip
+    python -m benchmarks.run_benchmarks --compare bench_results/main.json
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+EDUMIRROR_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SCENARIOS_DIR = os.path.join(EDUMIRROR_ROOT, 'scenarios')
+if EDUMIRROR_ROOT not in sys.path:
+    sys.path.insert(0, EDUMIRROR_ROOT)
+
+from benchmarks.fake_model import FakeLanguageModel  # noqa: E402
+
+STATIC_BENCHMARKS = ('agent_construction', 'rubric_rating', 'survey_scoring')
+COMPARED_METRICS = ('wall_time_s', 'cpu_time_s', 'peak_rss_mb', 'model_calls')
+
+
+def list_scenarios() -> List[str]:
+    """Return the scenario directories that contain a main.py."""
+    return sorted(
+        d for d in os.listdir(SCENARIOS_DIR)
+        if os.path.isfile(os.path.join(SCENARIOS_DIR, d, 'main.py'))
+    )
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure(fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    gc.collect()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    metrics = fn()
+    metrics['wall_time_s'] = time.perf_counter() - wall_start
+    metrics['cpu_time_s'] = time.process_time() - cpu_start
+    metrics['peak_rss_mb'] = _peak_rss_mb()
+    return metrics
+
+
+def _instrumented_fake_model(run_name: str):
+    from common.simulation_utils.llm_telemetry import (
+        InstrumentedLanguageModel, LLMTelemetry, set_active_telemetry,
+    )
+    telemetry = LLMTelemetry(run_name=run_name)
+    set_active_telemetry(telemetry)
+    return InstrumentedLanguageModel(FakeLanguageModel(), telemetry, model_name='fake'), telemetry
+
+
+def _call_metrics(telemetry) -> Dict[str, Any]:
+    calls = telemetry.get_records('call')
+    return {
+        'model_calls': len(calls),
+        'prompt_tokens': sum(c['prompt_tokens'] for c in calls),
+        'cached_prefix_tokens': sum(c.get('cached_prefix_tokens', 0) for c in calls),
+        'completion_tokens': sum(c['completion_tokens'] for c in calls),
+    }
+
+
+def bench_scenario(name: str, entry: str = 'run_baseline') -> Dict[str, Any]:
+    """Run one scenario entry point against the fake model."""
+    model, telemetry = _instrumented_fake_model(name)
+    path = os.path.join(SCENARIOS_DIR, name, 'main.py')
+    spec = importlib.util.spec_from_file_location(f'benchmark_scenario_{name.replace("-", "_")}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Scenario mains build their model through this module-level name.
+    module.create_language_model = lambda *args, **kwargs: model
+
+    metrics = _measure(lambda: getattr(module, entry)() or {})
+    metrics.update(_call_metrics(telemetry))
+    metrics['steps'] = telemetry.step
+    metrics['wall_time_per_step_s'] = (
+        metrics['wall_time_s'] / telemetry.step if telemetry.step else None
+    )
+    return metrics
+
+
+def bench_agent_construction(num_agents: int = 10) -> Dict[str, Any]:
+    """Build `num_agents` student agents through AgentFactory."""
+    from common.agent.agent_factory import AgentFactory
+    from common.simulation_utils.model_setup import create_simple_embedder
+
+    model, telemetry = _instrumented_fake_model('agent_construction')
+    factory = AgentFactory(model=model, embedder_model=create_simple_embedder())
+
+    def _run() -> Dict[str, Any]:
+        for i in range(num_agents):
+            factory.create_student(
+                name=f'Student{i}',
+                goal='Do well at school and keep good friendships.',
+                traits=['curious', 'friendly'],
+                formative_memories=[f'Student{i} remembers day {d} at school.' for d in range(5)],
+            )
+        return {'agents': num_agents}
+
+    metrics = _measure(_run)
+    metrics.update(_call_metrics(telemetry))
+    metrics['wall_time_per_agent_s'] = metrics['wall_time_s'] / num_agents
+    return metrics
+
+
+def bench_rubric_rating(num_events: int = 2000) -> Dict[str, Any]:
+    """Apply every packaged rubric to a synthetic transcript."""
+    from common.measurement import rubrics as rubric_lib
+    from common.measurement.rater import EduMirrorRater, Rubric
+
+    all_rubrics: List[Rubric] = []
+    for name in rubric_lib.__all__:
+        factory = getattr(rubric_lib, name)
+        if not callable(factory):
+            continue
+        built = factory()
+        all_rubrics.extend(built if isinstance(built, list) else [built])
+    keywords = [k for r in all_rubrics for item in r.items for k in item.criteria.get('keywords', [])]
+    names = ('Leo', 'Alex', 'Maya', 'Sam')
+    transcript = [
+        {
+            'Step': i,
+            'Scene': 'benchmark',
+            'Event': f'{names[i % len(names)]}: I think {keywords[i % len(keywords)] if keywords else ""} today.',
+        }
+        for i in range(num_events)
+    ]
+    rater = EduMirrorRater(model=None)
+
+    def _run() -> Dict[str, Any]:
+        results = rater.apply_rubrics(transcript, all_rubrics)
+        return {
+            'rubrics': len(all_rubrics),
+            'events': num_events,
+            'matches': sum(len(df) for df in results.values()),
+        }
+
+    metrics = _measure(_run)
+    metrics['model_calls'] = 0
+    return metrics
+
+
+def bench_survey_scoring(num_players: int = 5) -> Dict[str, Any]:
+    """Score every packaged questionnaire for `num_players` respondents."""
+    from common.measurement import questionnaire as questionnaire_lib
+    from common.measurement.surveyor import EduMirrorSurveyor
+
+    questionnaires = []
+    for name in getattr(questionnaire_lib, '__all__', dir(questionnaire_lib)):
+        cls = getattr(questionnaire_lib, name)
+        if isinstance(cls, type) and name.endswith(('Questionnaire', 'QuestionnaireBrief')):
+            questionnaires.append(cls())
+    players = [f'Student{i}' for i in range(num_players)]
+
+    def _responder(player_name: str, action_spec_str: str) -> str:
+        del player_name
+        for part in action_spec_str.split(';;'):
+            if part.strip().startswith('options:'):
+                options = [x.strip() for x in part.split(':', 1)[1].split(',') if x.strip()]
+                return options[len(options) // 2] if options else ''
+        return ''
+
+    def _run() -> Dict[str, Any]:
+        surveyor = EduMirrorSurveyor(questionnaires, players)
+        df = surveyor.run_once(_responder)
+        return {
+            'questionnaires': len(questionnaires),
+            'players': num_players,
+            'result_rows': 0 if df is None else len(df),
+        }
+
+    metrics = _measure(_run)
+    metrics['model_calls'] = 0
+    return metrics
+
+
+def run_worker(benchmark_id: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Run a single benchmark in the current process."""
+    if benchmark_id.startswith('scenario:'):
+        return bench_scenario(benchmark_id.split(':', 1)[1], entry=args.entry)
+    if benchmark_id == 'agent_construction':
+        return bench_agent_construction(args.agents)
+    if benchmark_id == 'rubric_rating':
+        return bench_rubric_rating(args.events)
+    if benchmark_id == 'survey_scoring':
+        return bench_survey_scoring(args.players)
+    raise ValueError(f'Unknown benchmark: {benchmark_id}')
+
+
+def _run_in_subprocess(benchmark_id: str, args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    result_file = os.path.join(workdir, 'result.json')
+    if os.path.exists(result_file):
+        os.remove(result_file)
+    cmd = [
+        sys.executable, '-m', 'benchmarks.run_benchmarks',
+        '--worker', benchmark_id,
+        '--result-file', result_file,
+        '--entry', args.entry,
+        '--agents', str(args.agents),
+        '--events', str(args.events),
+        '--players', str(args.players),
+    ]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        p for p in (EDUMIRROR_ROOT, os.environ.get('PYTHONPATH')) if p
+    ))
+    output = None if args.verbose else subprocess.DEVNULL
+    try:
+        proc = subprocess.run(
+            cmd, cwd=workdir, env=env, stdout=output, stderr=subprocess.PIPE,
+            text=True, timeout=args.timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {'error': f'timed out after {args.timeout}s'}
+    if proc.returncode != 0 or not os.path.exists(result_file):
+        lines = (proc.stderr or '').strip().splitlines()
+        return {'error': lines[-1] if lines else f'exit code {proc.returncode}'}
+    with open(result_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(
+    current: Dict[str, Any],
+    previous: Dict[str, Any],
+    threshold: float = 1.2,
+) -> List[Dict[str, Any]]:
+    """Compare two results files metric by metric.
+
+    Args:
+        current: Results produced by this run
+        previous: Results loaded from an earlier run
+        threshold: Ratio above which a metric counts as a regression
+
+    Returns:
+        One row per (benchmark, metric) present in both runs
+    """
+    rows = []
+    for bench_id, result in current['results'].items():
+        before = previous.get('results', {}).get(bench_id)
+        if not before or 'error' in result or 'error' in before:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            ratio = new / old
+            rows.append({
+                'benchmark': bench_id,
+                'metric': metric,
+                'previous': old,
+                'current': new,
+                'ratio': ratio,
+                'regression': ratio > threshold,
+            })
+    return rows
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--only', default='', help='Comma-separated benchmark ids or prefixes (e.g. scenario:,rubric_rating)')
+    parser.add_argument('--entry', default='run_baseline', help='Scenario entry point to benchmark')
+    parser.add_argument('--agents', type=int, default=10, help='Agents built by agent_construction')
+    parser.add_argument('--events', type=int, default=2000, help='Transcript events for rubric_rating')
+    parser.add_argument('--players', type=int, default=5, help='Respondents for survey_scoring')
+    parser.add_argument('--timeout', type=float, default=1800.0, help='Per-benchmark timeout in seconds')
+    parser.add_argument('--output', default=None, help='Results JSON path (default: bench_results/benchmarks_<ts>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Regression ratio for --compare')
+    parser.add_argument('--verbose', action='store_true', help='Show benchmark stdout')
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _build_parser().parse_args(argv)
+
+    if args.worker:
+        result = run_worker(args.worker, args)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+
+    benchmark_ids = [f'scenario:{name}' for name in list_scenarios()] + list(STATIC_BENCHMARKS)
+    if args.only:
+        wanted = [w.strip() for w in args.only.split(',') if w.strip()]
+        benchmark_ids = [b for b in benchmark_ids if any(b == w or b.startswith(w) for w in wanted)]
+
+    results: Dict[str, Any] = {}
+    for bench_id in benchmark_ids:
+        # Scenario outputs (results/...) go to a throwaway working directory.
+        with tempfile.TemporaryDirectory(prefix='edumirror_bench_') as workdir:
+            results[bench_id] = _run_in_subprocess(bench_id, args, workdir)
+        r = results[bench_id]
+        if 'error' in r:
+            print(f'[Benchmark] {bench_id}: ERROR {r["error"]}')
+        else:
+            print(f'[Benchmark] {bench_id}: wall={r["wall_time_s"]:.2f}s cpu={r["cpu_time_s"]:.2f}s '
+                  f'rss={r["peak_rss_mb"]}MB calls={r["model_calls"]}')
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        'bench_results', f'benchmarks_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'[Benchmark] Results written to {output}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        rows = compare_results(report, previous, args.threshold)
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else 'ok'
+            print(f'{row["benchmark"]:<60} {row["metric"]:<12} {row["previous"]:>10.3f} -> '
+                  f'{row["current"]:>10.3f} ({row["ratio"]:.2f}x) {flag}')
+        if any(row['regression'] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,6 +20,7 @@ from ..value_components import value_comp
 
 import NullObservation
 from .Value_ActComp import MCTSActComponent
+from .context_assembler import ContextAssembler
 def _get_class_name(object_: object) -> str:
   return object_.__class__.__name__
 
@@ -47,6 +48,10 @@ def build_individual_value_agent(
         entity_component.ComponentName,
         entity_component.ContextComponent,
     ] = types.MappingProxyType({}),
+    context_token_budget: int | None = None,
+    desire_store=None,
+    history_window: int | None = None,
+    history_dir: str | None = None,
 ) -> entity_agent_with_logging.EntityAgentWithLogging:
     del update_time_interval
     if not config.extras.get('main_character', False):
@@ -140,6 +145,10 @@ def build_individual_value_agent(
         logging_channel=measurements.get_channel('ValueTracker').on_next,
         init_value = predefined_setting,
         expected_value_dict=expected_values,
+        desire_store=desire_store,
+        agent_name=agent_name,
+        history_window=history_window,
+        history_dir=history_dir,
     )
 
     null_observation = NullObservation.NULLObservation(
@@ -179,6 +188,10 @@ def build_individual_value_agent(
         # Place goal after the instructions.
         component_order.insert(1, goal_label)
 
+    # Extra components (e.g. memory consolidation) run alongside the built-in
+    # ones but are not part of the ordered acting context.
+    components_of_agent.update(additional_components)
+
     act_component = MCTSActComponent(
         model=model,
         clock=clock,
@@ -186,6 +199,10 @@ def build_individual_value_agent(
         desire_component_dict = all_desire_components,
         component_order=component_order,
         logging_channel=measurements.get_channel('ActComponent').on_next,
+        context_assembler=(
+            None if context_token_budget is None
+            else ContextAssembler(budget_tokens=context_token_budget, model=model)
+        ),
     )
 
     agent = entity_agent_with_logging.EntityAgentWithLogging(
@@ -13,6 +13,17 @@ from typing_extensions import override
 DEFAULT_PRE_ACT_KEY = 'Act'
 from collections.abc import Mapping
 from concordia.components import agent as agent_components
+from .context_assembler import ContextAssembler
+
+try:
+    from common.simulation_utils.model_router import model_route
+except ImportError:
+    import contextlib
+
+    def model_route(tag, validate=None):
+        del tag, validate
+        return contextlib.nullcontext()
+
 def _get_class_name(object_: object) -> str:
   return object_.__class__.__name__
 
@@ -26,6 +37,7 @@ class MCTSActComponent(entity_component.ActingComponent):
             component_order: Sequence[str] | None = None,
             pre_act_key: str = DEFAULT_PRE_ACT_KEY,
             logging_channel: logging.LoggingChannel = logging.NoOpLoggingChannel,
+            context_assembler: ContextAssembler | None = None,
     ):
 
       self._model = model
@@ -47,6 +59,9 @@ class MCTSActComponent(entity_component.ActingComponent):
       self._desire_component_dict = desire_component_dict
       self._desire_component_names = tuple(_get_class_name(compo) for compo in self._desire_component_dict.values())
       self._desire_name = tuple(self._desire_component_dict.keys())
+      # Without an assembler the context is joined unbounded, as before.
+      self._context_assembler = context_assembler
+      self._last_context_stats = None
 
     def _get_desire_status(self):
         desire_status = ''
@@ -63,17 +78,19 @@ class MCTSActComponent(entity_component.ActingComponent):
         contexts: entity_component.ComponentContextMapping,
     ) -> str:
         if self._component_order is None:
-            return '\n'.join(
-                context for context in contexts.values() if context
-        )
-
-        desire_set = set(self._desire_component_names)
-        filtered_component_order = tuple(item for item in self._component_order if item not in desire_set)
-        filtered_context_keys = tuple(sorted(set(contexts.keys()) - set(self._component_order) - desire_set))
+            order = tuple(contexts.keys())
+        else:
+            desire_set = set(self._desire_component_names)
+            filtered_component_order = tuple(item for item in self._component_order if item not in desire_set)
+            filtered_context_keys = tuple(sorted(set(contexts.keys()) - set(self._component_order) - desire_set))
+            order = filtered_component_order + filtered_context_keys + self._desire_component_names
 
-        order = filtered_component_order + filtered_context_keys + self._desire_component_names
+        if self._context_assembler is None:
+            return '\n'.join(contexts[name] for name in order if contexts[name])
 
-        desire_context = '\n'.join(contexts[name] for name in order if contexts[name])
+        desire_context, self._last_context_stats = self._context_assembler.assemble(
+            [(name, contexts[name]) for name in order]
+        )
         return desire_context
 
     def _preprocess_imagined_action(self, imagined_actions: str) -> list:
@@ -105,13 +122,16 @@ class MCTSActComponent(entity_component.ActingComponent):
         output_format = (f"Please output the psychological state observations in the following format: \n")
         for desire in self._desire_name:
             output_format += f"{desire}: <{desire} state> \n"
-        total_prompt = imagine_prompt + desire_status + action_context + output_format
-        imagined_states = prompt.open_question(
-            total_prompt,
-            max_tokens=2200,
-            terminators=(),
-            question_label='Exercise',
-        )
+        # Fixed instructions first, per-step states and reaction last, so the
+        # prompt prefix is shared across calls and steps.
+        total_prompt = imagine_prompt + output_format + desire_status + action_context
+        with model_route('imagine'):
+            imagined_states = prompt.open_question(
+                total_prompt,
+                max_tokens=2200,
+                terminators=(),
+                question_label='Exercise',
+            )
         return {"status": imagined_states, "prompt": prompt.view().text()}
     @override
     def get_action_attempt(
@@ -121,11 +141,12 @@ class MCTSActComponent(entity_component.ActingComponent):
     ) -> str:
         prompt = interactive_document.InteractiveDocument(self._model)
         context = self._context_for_action(contexts)
-        prompt.statement(context + '\n')
         agent_name = self.get_entity().name
 
         MCTS_log = dict()
         MCTS_log['component context'] = context
+        if self._context_assembler is not None:
+            MCTS_log['context_tokens'] = self._last_context_stats
 
         tree_thinking_prompt = (f"{agent_name} is a human-like agent, "
                                 f"{agent_name} will observe the current states over "
@@ -153,14 +174,18 @@ class MCTSActComponent(entity_component.ActingComponent):
             ),
         )
 
-        tree_thinking_prompt = tree_thinking_prompt + '\n' + call_to_action
+        # The agent's fixed instructions lead the prompt and the step's
+        # component context follows, so providers can cache the prefix.
+        prompt.statement(tree_thinking_prompt + '\n')
+        prompt.statement(context + '\n')
 
-        tree_thinking_answer = prompt.open_question(
-            tree_thinking_prompt,
-            max_tokens=1200,
-            terminators=(),
-            question_label='Exercise',
-        )
+        with model_route('act'):
+            tree_thinking_answer = prompt.open_question(
+                call_to_action,
+                max_tokens=1200,
+                terminators=(),
+                question_label='Exercise',
+            )
         MCTS_log['tree_thinking_prompt'] = prompt.view().text()
         MCTS_log['tree_thinking_answer'] = tree_thinking_answer
         imagined_actions = self._preprocess_imagined_action(tree_thinking_answer)
@@ -190,10 +215,15 @@ class MCTSActComponent(entity_component.ActingComponent):
                             f"{agent_name} should focus on current events and psychological states "
                             "and reflect expressions and feelings that align with them. "
                            )
+        action_selection_prompt += (f'Please output the specific best reaction instead without explanation of <Reaction 1> or <Reaction 2> and so on. '
+                                    'If there is only one reaction provided, output the reaction content directly. \n')
+        action_selection_prompt += (f"Please output the best reaction in the following format: \n"
+                                    f"'Reaction: <{agent_name}'s best reaction>' \n"
+                                    f"Example: Reaction: {agent_name} observes the surroundings.\n")
         action_selection_prompt += (
                             f"The observations of the surrounding environment: \n"
                             f"{observation_status} \n"
-                            f"Alice's current psychological state: \n"
+                            f"{agent_name}'s current psychological state: \n"
                             f"{desire_status} \n"
         )
         action_and_result = f"Following are the psychological state after each reaction: \n"
@@ -206,13 +236,8 @@ class MCTSActComponent(entity_component.ActingComponent):
 
         action_selection_prompt += action_and_result
 
-        action_selection_prompt += (f'Please output the specific best reaction instead without explanation of <Reaction 1> or <Reaction 2> and so on. '
-                                    'If there is only one reaction provided, output the reaction content directly. \n')
-        action_selection_prompt += (f"Please output the best reaction in the following format: \n"
-                                    f"'Reaction: <{agent_name}'s best reaction>' \n"
-                                    f"Example: Reaction: {agent_name} observes the surroundings.\n")
-
-        o = prompt.open_question(action_selection_prompt, max_tokens=2200,terminators=())
+        with model_route('act'):
+            o = prompt.open_question(action_selection_prompt, max_tokens=2200,terminators=())
 
         if o.startswith('Reaction'):
             o = o.split('Reaction', 1)[1].strip(' :')
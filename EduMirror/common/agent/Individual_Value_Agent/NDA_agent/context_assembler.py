@@ -0,0 +1,214 @@
+"""Token-budgeted assembly of the acting context for value agents.
+
+`MCTSActComponent` concatenates the pre-act text of every context component
+before each act. `ContextAssembler` counts the tokens contributed by each
+component and, when a budget is configured, shrinks the lowest-priority
+components first (truncation, summarization or dropping) until the assembled
+context fits. Per-component token counts are returned so they can be logged
+with every act.
+"""
+
+import dataclasses
+from collections.abc import Callable, Mapping, Sequence
+from typing import Any
+
+from concordia.document import interactive_document
+from concordia.language_model import language_model
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    _ENCODING = None
+
+TRUNCATE_HEAD = 'truncate_head'  # keep the most recent (trailing) text
+TRUNCATE_TAIL = 'truncate_tail'  # keep the leading text
+SUMMARIZE = 'summarize'
+DROP = 'drop'
+_POLICIES = (TRUNCATE_HEAD, TRUNCATE_TAIL, SUMMARIZE, DROP)
+_ELLIPSIS = ' ... '
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, else ~4 characters per token."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+@dataclasses.dataclass(frozen=True)
+class ComponentBudgetPolicy:
+    """How one component's context may be shrunk.
+
+    Attributes:
+        priority: Components with lower priority are shrunk first.
+        policy: One of 'truncate_head', 'truncate_tail', 'summarize', 'drop'.
+        max_tokens: Hard cap applied even when the total is within budget.
+        min_tokens: The component is not shrunk below this many tokens
+            (ignored by the 'drop' policy). When the floors of the present
+            components add up to more than the budget, they are scaled down
+            proportionally.
+    """
+    priority: int = 0
+    policy: str = TRUNCATE_HEAD
+    max_tokens: int | None = None
+    min_tokens: int = 0
+
+    def __post_init__(self):
+        if self.policy not in _POLICIES:
+            raise ValueError(f'Unknown context policy: {self.policy}')
+
+
+# Component class names used by `build_individual_value_agent`. Desire
+# components are not listed and use the assembler's default policy. Budgets
+# below the sum of the `min_tokens` floors scale the floors down to fit.
+DEFAULT_COMPONENT_POLICIES = {
+    'Instructions': ComponentBudgetPolicy(priority=100, policy=TRUNCATE_TAIL, min_tokens=256),
+    'ConstantProfile': ComponentBudgetPolicy(priority=90, policy=TRUNCATE_TAIL, min_tokens=64),
+    '\nGoal': ComponentBudgetPolicy(priority=90, policy=TRUNCATE_TAIL, min_tokens=128),
+    'ReportFunction': ComponentBudgetPolicy(priority=90, policy=TRUNCATE_TAIL, min_tokens=32),
+    'Observation': ComponentBudgetPolicy(priority=80, policy=TRUNCATE_HEAD, min_tokens=128),
+    'ObservationSummary': ComponentBudgetPolicy(priority=50, policy=SUMMARIZE, min_tokens=64),
+    'Identity': ComponentBudgetPolicy(priority=40, policy=SUMMARIZE, min_tokens=48),
+    'BackgroundKnowledge': ComponentBudgetPolicy(priority=30, policy=TRUNCATE_TAIL, min_tokens=32),
+}
+
+
+class ContextAssembler:
+    """Assembles component contexts under a token budget."""
+
+    def __init__(
+        self,
+        budget_tokens: int | None = None,
+        component_policies: Mapping[str, ComponentBudgetPolicy] = DEFAULT_COMPONENT_POLICIES,
+        default_policy: ComponentBudgetPolicy = ComponentBudgetPolicy(
+            priority=70, policy=TRUNCATE_TAIL, min_tokens=64),
+        model: language_model.LanguageModel | None = None,
+        token_counter: Callable[[str], int] = count_tokens,
+    ):
+        """Initializes the assembler.
+
+        Args:
+            budget_tokens: Total token budget for the assembled context; None
+                only applies per-component caps and records counts.
+            component_policies: Policy per component name.
+            default_policy: Policy for components not in `component_policies`.
+            model: Language model used by the 'summarize' policy; without one
+                summarization falls back to truncation.
+            token_counter: Function that counts tokens in a string.
+        """
+        self._budget_tokens = budget_tokens
+        self._component_policies = dict(component_policies)
+        self._default_policy = default_policy
+        self._model = model
+        self._count = token_counter
+
+    def _policy_for(self, name: str) -> ComponentBudgetPolicy:
+        return self._component_policies.get(name, self._default_policy)
+
+    def _truncate(self, text: str, max_tokens: int, keep_tail: bool) -> str:
+        tokens = self._count(text)
+        if tokens <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ''
+        keep_chars = max(0, int(len(text) * max_tokens / tokens) - len(_ELLIPSIS))
+        # The character ratio is an estimate; tighten until it fits.
+        while keep_chars > 0:
+            if keep_tail:
+                candidate = _ELLIPSIS.lstrip() + text[len(text) - keep_chars:]
+            else:
+                candidate = text[:keep_chars] + _ELLIPSIS.rstrip()
+            if self._count(candidate) <= max_tokens:
+                return candidate
+            keep_chars = int(keep_chars * 0.9)
+        return ''
+
+    def _summarize(self, name: str, text: str, max_tokens: int) -> str:
+        if self._model is None or max_tokens <= 0:
+            return self._truncate(text, max_tokens, keep_tail=True)
+        prompt = interactive_document.InteractiveDocument(self._model)
+        summary = prompt.open_question(
+            f'Condense the following agent context section ({name.strip()}) '
+            f'to at most {max_tokens} tokens, keeping names, recent events and '
+            f'feelings:\n{text}',
+            max_tokens=max_tokens,
+            terminators=(),
+        ).strip()
+        if not summary:
+            return self._truncate(text, max_tokens, keep_tail=True)
+        return self._truncate(summary, max_tokens, keep_tail=False)
+
+    def _shrink(self, name: str, text: str, max_tokens: int, min_tokens: int | None = None) -> str:
+        policy = self._policy_for(name)
+        if policy.policy == DROP:
+            return ''
+        max_tokens = max(max_tokens, policy.min_tokens if min_tokens is None else min_tokens)
+        if self._count(text) <= max_tokens:
+            return text
+        if policy.policy == SUMMARIZE:
+            return self._summarize(name, text, max_tokens)
+        return self._truncate(text, max_tokens, keep_tail=policy.policy == TRUNCATE_HEAD)
+
+    def assemble(
+        self,
+        contexts: Sequence[tuple[str, str]],
+    ) -> tuple[str, dict[str, Any]]:
+        """Joins component contexts in order, enforcing the token budget.
+
+        Args:
+            contexts: (component name, pre-act text) pairs in prompt order.
+
+        Returns:
+            The assembled context and a stats dict with per-component token
+            counts before and after budgeting, and `over_budget_tokens` when
+            the result still exceeds the budget.
+        """
+        texts = {name: text for name, text in contexts if text}
+        tokens_before = {name: self._count(text) for name, text in texts.items()}
+
+        for name, text in list(texts.items()):
+            cap = self._policy_for(name).max_tokens
+            if cap is not None:
+                texts[name] = self._shrink(name, text, cap)
+
+        def total() -> int:
+            return sum(self._count(text) for text in texts.values())
+
+        if self._budget_tokens is not None and total() > self._budget_tokens:
+            # A floor only protects what the component has; if the floors
+            # still exceed the budget, scale them down so the budget holds.
+            floors = {
+                name: min(self._policy_for(name).min_tokens, self._count(text))
+                for name, text in texts.items()
+                if self._policy_for(name).policy != DROP
+            }
+            floor_total = sum(floors.values())
+            if floor_total > self._budget_tokens:
+                scale = self._budget_tokens / floor_total
+                floors = {name: int(floor * scale) for name, floor in floors.items()}
+            # Shrink lower-priority components first; the largest one goes
+            # first among components sharing a priority.
+            for name in sorted(
+                texts, key=lambda n: (self._policy_for(n).priority, -self._count(texts[n]))
+            ):
+                overflow = total() - self._budget_tokens
+                if overflow <= 0:
+                    break
+                current = self._count(texts[name])
+                texts[name] = self._shrink(name, texts[name], current - overflow, floors.get(name))
+
+        tokens_after = {name: self._count(text) for name, text in texts.items()}
+        stats = {
+            'budget_tokens': self._budget_tokens,
+            'total_tokens_before': sum(tokens_before.values()),
+            'total_tokens_after': sum(tokens_after.values()),
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+        }
+        if self._budget_tokens is not None and stats['total_tokens_after'] > self._budget_tokens:
+            stats['over_budget_tokens'] = stats['total_tokens_after'] - self._budget_tokens
+        assembled = '\n'.join(texts[name] for name, _ in contexts if texts.get(name))
+        return assembled, stats
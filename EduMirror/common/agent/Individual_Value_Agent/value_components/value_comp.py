@@ -19,11 +19,34 @@ from concordia.typing import logging
 from concordia.document import interactive_document
 from concordia.typing.entity import ActionSpec
 from .hardcoded_value_state import hardcode_state
+try:
+    from common.agent.bounded_history import bounded_like, history_log_path
+    from common.agent.desire_store import StoreBackedValue
+except ImportError:
+    class StoreBackedValue:
+        """Fallback without the desire store: values stay on the component."""
+
+    def bounded_like(existing, window, log_path=None):
+        del window, log_path
+        return existing
+
+    def history_log_path(log_dir, agent_name, name):
+        del log_dir, agent_name, name
+        return None
+
+try:
+    from common.simulation_utils.model_router import model_route
+except ImportError:
+    import contextlib
+
+    def model_route(tag, validate=None):
+        del tag, validate
+        return contextlib.nullcontext()
 DEFAULT_VALUE_SCALE = tuple(range(11))
 def _get_class_name(object_: object) -> str:
   return object_.__class__.__name__
 
-class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
+class desire(StoreBackedValue, agent_components.action_spec_ignored.ActionSpecIgnored):
     def __init__(self,
                  *,
                  model: language_model.LanguageModel,
@@ -74,35 +97,29 @@ class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
     # for update the value of the desire
 
     def _update_value_prompt(self,agent_name:str, action: str, observation: str,reflection_prompt_history:str, prompt:interactive_document.InteractiveDocument) -> str:
+        zero, *_, ten = self._value_scale
+        # Static instructions come first and this step's values last, so the
+        # repeated calls of an agent share a prefix the provider can cache.
         question = (
+                f"{self._description}"
+                f"How would the magnitude value of {self._value_name} change according to the consequence of the action? \n"
+                f"Please select the final magnitude value after the event on the scale of {zero} to {ten}, "
+                "if the consequence of the action will not affect the state value "
+                "(e.g. The action is irrelevant with this value dimension or the action was failed to conduct), "
+                "then maintain the previous magnitude value.\n"
+                "Please just answer in the format of (a) (b) (c) (d) and so on.\n"
                 f"The current magnitude value of {self._value_name} is {round(self._value)}.\n"
                 f"The agent {agent_name}'s action is: {action}.\n"
                 f"And the consequence is: \n{observation}.\n"
-                f"{self._description}"
-                f"How would the magnitude value of {self._value_name} change according to the consequence of the action? \n"
                 )
 
         if reflection_prompt_history != "":
                 current_reflection = (f"There are some unreasonable examples:\n {reflection_prompt_history}\n")
                 question += current_reflection
-        zero, *_, ten = self._value_scale
-
-        question += (
-            f"Please select the final magnitude value after the event on the scale of {zero} to {ten}, "
-            "if the consequence of the action will not affect the state value "
-            "(e.g. The action is irrelevant with this value dimension or the action was failed to conduct), "
-            "then maintain the previous magnitude value.\n"
-            "Please just answer in the format of (a) (b) (c) (d) and so on, Rating: \n"
-            # f"""Output format:
-            # <Reason>
-            # The final answer is: \n(Your choice in letter)\n"""
-            # f"""Output example:
-            # Since Alice felt more relaxed and centered after her actions......
-            # The final answer is: (c)\n"""
-            # f"**Make sure you answer in the format of a letter corresponding to your choice:**"
-            )
+        question += "Rating: \n"
 
-        current_value = prompt.multiple_choice_question(question,answers=self._value_scale)
+        with model_route('desire_update'):
+            current_value = prompt.multiple_choice_question(question,answers=self._value_scale)
         return current_value, prompt.view().text()
 
     def _check_reasonable(self, agent_name, previous_value: int, current_value: int, action: str, observation: str, prompt:interactive_document.InteractiveDocument) -> bool:
@@ -110,18 +127,16 @@ class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
                 f"The current magnitude value of {self._value_name} is {round(self._value)}."
                 f"The agent {agent_name}'s action is: {action}."
                 f"And the consequence is: {observation}."
-                + self._description ,
-                f"The reward model has changed the magnitude value of {self._value_name} from {previous_value} to {current_value}. "
+                + self._description
+                + f"The reward model has changed the magnitude value of {self._value_name} from {previous_value} to {current_value}. "
                 f"Is the change of the magnitude value of {self._value_name} reasonable? "
                 f"You should check whether the consequence can lead to a change in the magnitude value of {self._value_name} (e.g., looking for an item but not using it yet)."
-                f"Please answer in the format of the letter with brackets : (a) Yes. (b) No."
             )
 
-        reasonable = prompt.open_question(reasonable_question)
-        if 'Yes' in reasonable or '(a)' in reasonable:
-            reasonable = True
-        else:
-            reasonable = False
+        # A multiple-choice question, so models with choice scoring answer
+        # from one short request instead of free text matched for 'Yes'.
+        with model_route('desire_check'):
+            reasonable = prompt.yes_no_question(reasonable_question)
 
         return reasonable, prompt.view().text()
 
@@ -326,6 +341,13 @@ class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
     def get_desire_name(self) -> str:
         return self._value_name
 
+    def configure_history(self, window: int | None, log_dir: str | None = None, agent_name: str = '') -> None:
+        # Keep only the last `window` actions in memory; older ones go to log_dir.
+        self._action_cache = bounded_like(
+            self._action_cache, window,
+            history_log_path(log_dir, agent_name, f'{self._value_name}_actions'),
+        )
+
     def post_act(self, action_attempt: str) -> str:
         self._action_cache.append(action_attempt)
         return ''
@@ -421,6 +443,12 @@ class desireWithoutPreAct(agent_components.action_spec_ignored.ActionSpecIgnored
     def get_desire_name(self) -> str:
         return self._component.get_desire_name()
 
+    def bind_desire_store(self, store, agent_name: str) -> None:
+        self._component.bind_desire_store(store, agent_name)
+
+    def configure_history(self, window: int | None, log_dir: str | None = None, agent_name: str = '') -> None:
+        self._component.configure_history(window, log_dir, agent_name)
+
     def get_current_numerical_value(self) -> int:
         return self._component.get_current_numerical_value()
 
@@ -496,19 +524,37 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
                  expected_value_dict: Mapping[str, int],
                  clock_now: Callable[[], datetime.datetime] | None = None,
                  logging_channel: logging.LoggingChannel = logging.NoOpLoggingChannel,
+                 desire_store=None,
+                 agent_name: str = '',
+                 history_window: int | None = None,
+                 history_dir: str | None = None,
                  ) -> None:
         super().__init__(pre_act_key)
         self._desire_components = dict(desire_components)
+        # Optional simulation-wide DesireStore; the dict trackers are kept either way.
+        self._desire_store = desire_store
+        self._agent_name = agent_name
+        if desire_store is not None:
+            for desire_component in self._desire_components.values():
+                desire_component.bind_desire_store(desire_store, agent_name)
+            desire_store.set_expected(agent_name, expected_value_dict)
         self._logging_channel = logging_channel
         self._expected_value_dict = expected_value_dict
         self._step_counter = 0 # track the step, always the next step
-        self._whole_delta_tracker = dict()
-        self._individual_desire_tracker = dict()
-        self._individual_delta_tracker = dict()
-        self._individual_qualitative_desire_tracker = dict()
+        # With history_window set, the trackers keep that many steps in memory
+        # and spill older ones to JSONL logs in history_dir.
+        def history(name, items):
+            return bounded_like(items, history_window, history_log_path(history_dir, agent_name, name))
+        self._whole_delta_tracker = history('whole_delta_tracker', dict())
+        self._individual_desire_tracker = history('individual_desire_tracker', dict())
+        self._individual_delta_tracker = history('individual_delta_tracker', dict())
+        self._individual_qualitative_desire_tracker = history('individual_qualitative_desire_tracker', dict())
+        if history_window is not None:
+            for desire_component in self._desire_components.values():
+                desire_component.configure_history(history_window, history_dir, agent_name)
         # self._track_value()
         self._track_initial_value(init_value, expected_value_dict)
-        self._action_cache = []
+        self._action_cache = history('actions', [])
         self._clock_now = clock_now
 
     def _track_initial_value(self, init_value, expected_value):
@@ -532,6 +578,8 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             current_qualitative_desire_tracker[current_value_name] = current_qualitative_value
             current_delta_tracker[current_value_name] = component_delta
 
+        if self._desire_store is not None:
+            self._desire_store.record(self._agent_name, current_numerical_desire_tracker)
         self._individual_desire_tracker[self._step_counter] = current_numerical_desire_tracker
         self._individual_delta_tracker[self._step_counter] = current_delta_tracker
         self._whole_delta_tracker[self._step_counter] = sum(current_delta_tracker.values())
@@ -558,6 +606,8 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             current_qualitative_desire_tracker[current_value_name] = current_qualitative_value
             current_delta_tracker[current_value_name] = component_delta
 
+        if self._desire_store is not None:
+            self._desire_store.record(self._agent_name)
         self._individual_desire_tracker[self._step_counter] = current_numerical_desire_tracker
         self._individual_delta_tracker[self._step_counter] = current_delta_tracker
         self._whole_delta_tracker[self._step_counter] = sum(current_delta_tracker.values())
@@ -606,3 +656,6 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
 
     def get_expected_value_dict(self) -> dict:
         return self._expected_value_dict
+
+    def get_desire_store(self):
+        return self._desire_store
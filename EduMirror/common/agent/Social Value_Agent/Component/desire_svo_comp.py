@@ -15,6 +15,36 @@ from concordia.typing import entity_component
 from concordia.typing import logging
 from .hardcoded_value_state import hardcode_state
 
+try:
+    from common.simulation_utils.llm_telemetry import emit_event
+except ImportError:
+    def emit_event(event, **fields):
+        del event, fields
+
+try:
+    from common.agent.bounded_history import bounded_like, history_log_path
+    from common.agent.desire_store import StoreBackedValue
+except ImportError:
+    class StoreBackedValue:
+        """Fallback without the desire store: values stay on the component."""
+
+    def bounded_like(existing, window, log_path=None):
+        del window, log_path
+        return existing
+
+    def history_log_path(log_dir, agent_name, name):
+        del log_dir, agent_name, name
+        return None
+
+try:
+    from common.simulation_utils.model_router import model_route
+except ImportError:
+    import contextlib
+
+    def model_route(tag, validate=None):
+        del tag, validate
+        return contextlib.nullcontext()
+
 DEFAULT_VALUE_SCALE = tuple(range(11))
 DEFAULT_SATISFACTION = 5
 
@@ -96,7 +126,7 @@ class SVO_Instructions(constant.Constant):
       super().__init__(
             state=state, pre_act_key=pre_act_key, logging_channel=logging_channel)
 
-class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
+class desire(StoreBackedValue, agent_components.action_spec_ignored.ActionSpecIgnored):
     def __init__(self,
                  *,
                  model: language_model.LanguageModel,
@@ -150,37 +180,31 @@ class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
 
     def _update_value_prompt(self,agent_name:str, action: str, observation: str,reflection_prompt_history:str, prompt:interactive_document.InteractiveDocument) -> str:
         personality_text = PERSONALITY_DESIRE_PREF_TEXT.get(self._social_personality)
+        zero, *_, ten = self._value_scale
+        # Static instructions come first and this step's values last, so the
+        # repeated calls of an agent share a prefix the provider can cache.
         question = (
                 f"The agent has a social personality of {self._social_personality}.\n"
                 f"{personality_text}\n"
+                f"{self._description}"
+                f"How would the magnitude value of {self._value_name} change according to the consequence of the action? \n"
+                f"Please select the final magnitude value after the event on the scale of {zero} to {ten}, "
+                "if the consequence of the action will not affect the state value "
+                "(e.g. The action is irrelevant with this value dimension or the action was failed to conduct), "
+                "then maintain the previous magnitude value.\n"
+                "Please just answer in the format of (a) (b) (c) (d) and so on.\n"
                 f"The current magnitude value of {self._value_name} is {round(self._value)}.\n"
                 f"The agent {agent_name}'s action is: {action}.\n"
                 f"And the consequence is: \n{observation}.\n"
-                f"{self._description}"
-                f"How would the magnitude value of {self._value_name} change according to the consequence of the action? \n"
                 )
 
         if reflection_prompt_history != "":
                 current_reflection = (f"There are some unreasonable examples:\n {reflection_prompt_history}\n")
                 question += current_reflection
-        zero, *_, ten = self._value_scale
+        question += "Rating: \n"
 
-        question += (
-            f"Please select the final magnitude value after the event on the scale of {zero} to {ten}, "
-            "if the consequence of the action will not affect the state value "
-            "(e.g. The action is irrelevant with this value dimension or the action was failed to conduct), "
-            "then maintain the previous magnitude value.\n"
-            "Please just answer in the format of (a) (b) (c) (d) and so on, Rating: \n"
-            # f"""Output format:
-            # <Reason>
-            # The final answer is: \n(Your choice in letter)\n"""
-            # f"""Output example:
-            # Since Alice felt more relaxed and centered after her actions......
-            # The final answer is: (c)\n"""
-            # f"**Make sure you answer in the format of a letter corresponding to your choice:**"
-            )
-
-        current_value = prompt.multiple_choice_question(question,answers=self._value_scale)
+        with model_route('desire_update'):
+            current_value = prompt.multiple_choice_question(question,answers=self._value_scale)
         return current_value, prompt.view().text()
 
     def _check_reasonable(self, agent_name, previous_value: int, current_value: int, action: str, observation: str, prompt:interactive_document.InteractiveDocument) -> bool:
@@ -188,18 +212,16 @@ class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
                 f"The current magnitude value of {self._value_name} is {round(self._value)}."
                 f"The agent {agent_name}'s action is: {action}."
                 f"And the consequence is: {observation}."
-                + self._description ,
-                f"The reward model has changed the magnitude value of {self._value_name} from {previous_value} to {current_value}. "
+                + self._description
+                + f"The reward model has changed the magnitude value of {self._value_name} from {previous_value} to {current_value}. "
                 f"Is the change of the magnitude value of {self._value_name} reasonable? "
                 f"You should check whether the consequence can lead to a change in the magnitude value of {self._value_name} (e.g., looking for an item but not using it yet)."
-                f"Please answer in the format of the letter with brackets : (a) Yes. (b) No."
             )
 
-        reasonable = prompt.open_question(reasonable_question)
-        if 'Yes' in reasonable or '(a)' in reasonable:
-            reasonable = True
-        else:
-            reasonable = False
+        # A multiple-choice question, so models with choice scoring answer
+        # from one short request instead of free text matched for 'Yes'.
+        with model_route('desire_check'):
+            reasonable = prompt.yes_no_question(reasonable_question)
 
         return reasonable, prompt.view().text()
 
@@ -409,6 +431,13 @@ class desire(agent_components.action_spec_ignored.ActionSpecIgnored):
     def get_desire_name(self) -> str:
         return self._value_name
 
+    def configure_history(self, window: int | None, log_dir: str | None = None, agent_name: str = '') -> None:
+        # Keep only the last `window` actions in memory; older ones go to log_dir.
+        self._action_cache = bounded_like(
+            self._action_cache, window,
+            history_log_path(log_dir, agent_name, f'{self._value_name}_actions'),
+        )
+
     def post_act(self, action_attempt: str) -> str:
         self._action_cache.append(action_attempt)
         return ''
@@ -545,6 +574,12 @@ class desireWithoutPreAct(agent_components.action_spec_ignored.ActionSpecIgnored
     def get_desire_name(self) -> str:
         return self._component.get_desire_name()
 
+    def bind_desire_store(self, store, agent_name: str) -> None:
+        self._component.bind_desire_store(store, agent_name)
+
+    def configure_history(self, window: int | None, log_dir: str | None = None, agent_name: str = '') -> None:
+        self._component.configure_history(window, log_dir, agent_name)
+
     def get_current_numerical_value(self) -> int:
         return self._component.get_current_numerical_value()
 
@@ -665,18 +700,25 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
                  current_agent_name: str = "",
                  model: language_model.LanguageModel,
                  social_personality: str ='',
+                 desire_store=None,
+                 history_window: int | None = None,
+                 history_dir: str | None = None,
                  ) -> None:
         super().__init__(pre_act_key)
         self._desire_components = dict(desire_components)
         self._logging_channel = logging_channel
         self._expected_value_dict = expected_value_dict
         self._step_counter = 0 # track the step, always the next step
-        self._whole_delta_tracker = dict()
-        self._individual_desire_tracker = dict()
-        self._individual_delta_tracker = dict()
-        self._individual_qualitative_desire_tracker = dict()
+        # With history_window set, the trackers keep that many steps in memory
+        # and spill older ones to JSONL logs in history_dir.
+        def history(name, items):
+            return bounded_like(items, history_window, history_log_path(history_dir, current_agent_name, name))
+        self._whole_delta_tracker = history('whole_delta_tracker', dict())
+        self._individual_desire_tracker = history('individual_desire_tracker', dict())
+        self._individual_delta_tracker = history('individual_delta_tracker', dict())
+        self._individual_qualitative_desire_tracker = history('individual_qualitative_desire_tracker', dict())
         # self._track_value()
-        self._action_cache = []
+        self._action_cache = history('actions', [])
         self._clock_now = clock_now
 
         
@@ -693,12 +735,20 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
         self._alpha = 0
         # self._gamma = 0.7
         self._beta = 1
-        self._estimate_other_desire_tracker = dict()
-        self._svo_tracker = dict()
-        self._satisfaction_tracker = dict()
-        self._expected_value_traker = dict()
+        self._estimate_other_desire_tracker = history('estimate_other_desire_tracker', dict())
+        self._svo_tracker = history('svo_tracker', dict())
+        self._satisfaction_tracker = history('satisfaction_tracker', dict())
+        self._expected_value_traker = history('expected_value_tracker', dict())
         self._desire_value = dict()
         self._desire_delta = dict()
+        # Optional simulation-wide DesireStore; the dict trackers are kept either way.
+        self._desire_store = desire_store
+        if desire_store is not None:
+            for desire_component in self._desire_components.values():
+                desire_component.bind_desire_store(desire_store, current_agent_name)
+        if history_window is not None:
+            for desire_component in self._desire_components.values():
+                desire_component.configure_history(history_window, history_dir, current_agent_name)
 
         # tracker initializer must be called last
         self._track_initial_value(init_value)
@@ -726,8 +776,12 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             self._normalize_key(name): component.get_current_numerical_value_without_update()
             for name, component in self._desire_components.items()
         }
-        print("initial expected values: ", self._expected_value)
-        print("initial desire values: ", self._desire_value)
+        emit_event(
+            'svo_tracker_initialized',
+            agent=self._current_agent_name,
+            expected_value=self._expected_value,
+            desire_value=self._desire_value,
+        )
         current_numerical_desire_tracker = dict()
         current_qualitative_desire_tracker = dict()
         current_delta_tracker = dict()
@@ -751,6 +805,7 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             current_delta_tracker[current_value_name] = delta
 
         self._desire_delta = current_delta_tracker
+        self._record_in_desire_store(current_numerical_desire_tracker)
 
         current_svo = get_svo_from_personality(self._social_personality)
         action = f"{self._current_agent_name} does not take any action yet."
@@ -787,16 +842,18 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
         """Determine whether the action benefits the current agent."""
         prompt = interactive_document.InteractiveDocument(self._model)
         prompt_text = (f"The agent {self._current_agent_name} is considering the action: {action}.\n"
-                       f"Is this behavior more beneficial to {self._current_agent_name}? "
-                       f"Please answer in the format of the letter with brackets : (a) Yes. (b) No."
+                       f"Is this behavior more beneficial to {self._current_agent_name}?"
                        )
-        answer = prompt.open_question(prompt_text, max_tokens=20, terminators=())
-        if 'yes' in answer or '(a)' in answer.lower():
-            print(f"step {self._step_counter}: {self._current_agent_name} considers this action beneficial")
-            return True
-        else:
-            print(f"step {self._step_counter}: {self._current_agent_name} considers this action not beneficial")
-            return False
+        with model_route('desire_check'):
+            beneficial = prompt.yes_no_question(prompt_text)
+        emit_event(
+            'action_benefit_judged',
+            agent=self._current_agent_name,
+            tracker_step=self._step_counter,
+            action=action,
+            beneficial=beneficial,
+        )
+        return beneficial
 
     def _update_expected_value(self, observation: str, action: str, satisfaction: dict):
         """Dynamically adjust expected desire values."""
@@ -805,15 +862,10 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
         prompt_text = (f"The current expected value of {self._current_agent_name}'s desire is: {self._expected_value}\n"
                        f"The agent {self._current_agent_name}'s action is: {action}."
                        f"And the consequence is: {observation}."
-                       f"You should check whether the action can lead to a change in the expected value of {self._current_agent_name}'s desire. "
-                       f"Please answer in the format of the letter with brackets : (a) Yes. (b) No."
+                       f"You should check whether the action can lead to a change in the expected value of {self._current_agent_name}'s desire."
                        )
-        answer = prompt.open_question(prompt_text)
-        # sleep(5)
-        if 'yes' in answer or '(a)' in answer.lower():
-            change_signal = True
-        else:
-            change_signal = False
+        with model_route('desire_check'):
+            change_signal = prompt.yes_no_question(prompt_text)
         # change_signal = True
         if change_signal:
             update_prompt = (
@@ -829,19 +881,15 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
                 "SenseOfSuperiority: 8.0\n"
                 "SenseOfAchievement: 7.0\n"
             )
-            update_answer = prompt.open_question(update_prompt, max_tokens=100, terminators=())
-            print("Key section")
-            print("update_answer: ", update_answer)
             pattern = r"[-*]?\s*([A-Za-z_]+):\s*([0-9]+(?:\.[0-9]+)?)"
+            with model_route('desire_update', validate=lambda text: re.search(pattern, text) is not None):
+                update_answer = prompt.open_question(update_prompt, max_tokens=100, terminators=())
             matches = re.findall(pattern, update_answer)
             valid_desires = set(self._normalize_key(desire_name) for desire_name in self._desire_name)
             # valid_desires = set(self._desire_name)
-            print("valid desires", valid_desires)
             updated_value = {}
 
-            print("Check")
             for desire, value in matches:
-                print("desire: ", desire, "\nvalue: ", value)
                 normalized_desire = self._normalize_key(desire)
                 if normalized_desire in valid_desires:
                     val = float(value)
@@ -853,12 +901,14 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
                 self._normalize_key(desire_name): value
                 for desire_name, value in self._expected_value.items()
             }
-            print("=======")
-            print("step: ",self._step_counter)
-            print("check expected_value updates")
-            print("expected value: ",self._expected_value)
-            print("change signal: ",self._expected_value_changed)
-            print("=======")
+            emit_event(
+                'expected_value_updated',
+                agent=self._current_agent_name,
+                tracker_step=self._step_counter,
+                answer=update_answer,
+                expected_value=self._expected_value,
+                changed=self._expected_value_changed,
+            )
 
     def _estimate_other_desire(self, agent_name: str, observation: str, action_attempt: str, observed_agent: dict) -> dict:
         """Estimate other agents' desires and return a dict of desire_name -> value."""
@@ -1055,15 +1105,23 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             "Do NOT output any explanations, markdown, code block, or extra content. Do NOT output more or less than 8 lines."
         )
 
-        total_prompt = personality_prompt + observed_prompt + rule_prompt + table_prompt + output_format + objective_prompt
-        print("total_prompt: ", total_prompt)
-        
+        # Instructions that are fixed for this pair of agents form the prompt
+        # prefix; the observation-dependent parts follow, keeping the prefix
+        # cacheable across steps.
+        total_prompt = personality_prompt + rule_prompt + output_format + objective_prompt + observed_prompt + table_prompt
         answer = prompt.open_question(
             question=total_prompt,
             max_tokens=500,
             terminators=(),
         )
-        print("answer: ", answer)
+        emit_event(
+            'other_desire_estimated',
+            agent=self._current_agent_name,
+            tracker_step=self._step_counter,
+            other_agent=agent_name,
+            prompt=total_prompt,
+            answer=answer,
+        )
         pattern = r"[-*]?\s*\*{0,2}([A-Za-z_]+)\*{0,2}\s*:\s*([+\-]?\d+(?:\.\d+)?)"
         matches = re.findall(pattern, answer)
         desire_set = set(normalized_desire_name)
@@ -1092,12 +1150,6 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
     def _calculate_svo(self, others_desires: dict):
         """Compute current agent's SVO angle."""
         desire_num = len(self._desire_name)
-        print("--------")
-        print("check data during computation")
-        print("step: ",self._step_counter)
-        print("self_desire: ", self._desire_value)
-        print("current agent: ", self._current_agent_name)
-        print("estimated other desires: ", self._estimate_other_desire_tracker)
         # normalize expected and self desires
         normalized_expected_value = {self._normalize_key(k): v for k, v in self._expected_value.items()}
         normalized_self_desire = {self._normalize_key(k): v for k, v in self._desire_value.items()}
@@ -1107,7 +1159,6 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
         # print("normalized_expected_value", normalized_expected_value, "\n")
         # print("normalized_self_desire", normalized_self_desire, "\n")
         # print("normalized_other_desire", normalized_other_desire, "\n")
-        print("others_desires: ", others_desires)
         expected_svo_value = get_svo_from_personality(self._social_personality)
 
         # compute self satisfaction
@@ -1143,14 +1194,20 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
         self._self_satisfaction_value = self_satisfaction
         self._other_satisfaction_value = other_satisfaction
 
-        print("self_satisfaction: ", self._self_satisfaction_value)
-        print("other_satisfaction: ", self._other_satisfaction_value)
 
         # compute SVO angle
         self._svo_value = (1 - self._beta) * expected_svo_value + degrees(
             atan(1 * (self._other_satisfaction_value + 0.01) / (self._self_satisfaction_value + 0.01))) * self._beta
-        print("SVO value: ", self._svo_value)
-        print("--------")
+        emit_event(
+            'svo_computed',
+            agent=self._current_agent_name,
+            tracker_step=self._step_counter,
+            self_desire=self._desire_value,
+            others_desires=others_desires,
+            self_satisfaction=self._self_satisfaction_value,
+            other_satisfaction=self._other_satisfaction_value,
+            svo=self._svo_value,
+        )
 
     def _update_value(self, action: str, observation: str, ):
 
@@ -1213,11 +1270,11 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             current_numerical_desire_tracker[current_value_name] = current_numerical_value
             current_qualitative_desire_tracker[current_value_name] = current_qualitative_value
             current_delta_tracker[current_value_name] = delta
-            print("step: ",self._step_counter,"\ncurrent_numerical_value: ", current_numerical_value)
             self._desire_value[current_value_name] = current_numerical_value
         # print("++++++++")
 
         self._desire_delta = current_delta_tracker
+        self._record_in_desire_store()
         self._individual_desire_tracker[self._step_counter] = current_numerical_desire_tracker
         self._individual_delta_tracker[self._step_counter] = current_delta_tracker
         self._whole_delta_tracker[self._step_counter] = sum(current_delta_tracker.values())
@@ -1240,15 +1297,23 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
             "expected value": self._expected_value,
             "change": self._expected_value_changed,
         }
-        print('--------')
-        print("check whether saved data is normal")
-        print("desire_tracker: ", self._individual_desire_tracker)
-        print("svo_tracker: ", self._svo_tracker)
-        print("satisfaction_tracker: ", self._satisfaction_tracker)
-        print("expected_value_tracker: ", self._expected_value_traker)
-        print("--------")
+        emit_event(
+            'desire_tracked',
+            agent=self._current_agent_name,
+            tracker_step=self._step_counter,
+            desire_value=current_numerical_desire_tracker,
+            svo=self._svo_value,
+            satisfaction=self._satisfaction_tracker[self._step_counter],
+            expected_value=self._expected_value_traker[self._step_counter],
+        )
         self._step_counter += 1
 
+    def _record_in_desire_store(self, values: Mapping[str, float] | None = None) -> None:
+        if self._desire_store is None:
+            return
+        self._desire_store.set_expected(self._current_agent_name, self._expected_value)
+        self._desire_store.record(self._current_agent_name, values)
+
     def _make_pre_act_value(self) -> str:
         
         index = self._step_counter
@@ -1293,6 +1358,9 @@ class ValueTracker(agent_components.action_spec_ignored.ActionSpecIgnored):
     def get_svo_tracker(self):
         return self._svo_tracker
 
+    def get_desire_store(self):
+        return self._desire_store
+
     def get_satisfaction_tracker(self):
         return self._satisfaction_tracker
 
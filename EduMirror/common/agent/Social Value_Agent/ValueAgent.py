@@ -51,6 +51,9 @@ def build_social_value_agent(
     social_personality: str,
     agent_names: list,
     current_time: str,
+    desire_store=None,
+    history_window: int | None = None,
+    history_dir: str | None = None,
 ) -> entity_agent_with_logging.EntityAgentWithLogging:
     del update_time_interval
     if not config.extras.get('main_character', False):
@@ -200,6 +203,9 @@ def build_social_value_agent(
         current_agent_name=agent_name,
         model=model,
         social_personality=social_personality,
+        desire_store=desire_store,
+        history_window=history_window,
+        history_dir=history_dir,
     )
 
     null_observation = NullObservation.NULLObservation(
@@ -253,6 +259,10 @@ def build_social_value_agent(
         # Place goal after the instructions.
         component_order.insert(1, goal_label)
 
+    # Extra components (e.g. memory consolidation) run alongside the built-in
+    # ones but are not part of the ordered acting context.
+    components_of_agent.update(additional_components)
+
     act_component = MCTSActComponent(
         model=model,
         clock=clock,
@@ -14,6 +14,9 @@
 
 """Agent module for EduSim educational simulation platform."""
 
-from .agent_factory import AgentFactory
+from .agent_factory import AgentBlueprint, AgentFactory
+from .desire_store import DesireStore
+from .indexed_memory import IndexedAssociativeMemoryBank
+from .memory_consolidation import MemoryConsolidation
 
-__all__ = ['AgentFactory']
+__all__ = ['AgentBlueprint', 'AgentFactory', 'DesireStore', 'IndexedAssociativeMemoryBank', 'MemoryConsolidation']
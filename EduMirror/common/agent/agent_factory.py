@@ -16,7 +16,9 @@
 
 import sys
 import os
+import copy
 import importlib.util
+import threading
 import types
 from typing import List, Callable, Any, Optional, Dict
 import numpy as np
@@ -32,6 +34,11 @@ from concordia.clocks import game_clock
 # Import our project's model configuration instead of direct concordia import
 # from concordia.language_model import language_model
 from concordia.prefabs.entity import basic_with_plan
+
+from .desire_store import DesireStore
+from .indexed_memory import IndexedAssociativeMemoryBank
+from .memory_consolidation import MemoryConsolidation
+from ..simulation_utils.initializer_cache import cached_embedder
  
 _base_dir = os.path.dirname(__file__)
 _individual_path = os.path.join(_base_dir, 'Individual_Value_Agent', 'NDA_agent', 'ValueAgent.py')
@@ -54,6 +61,74 @@ except Exception:
     build_social_value_agent = None
 
 
+def _copy_on_write_bank(
+    source: basic_associative_memory.AssociativeMemoryBank,
+) -> basic_associative_memory.AssociativeMemoryBank:
+    """Create a memory bank that shares `source`'s memories and embeddings.
+    
+    `add` replaces a bank's data frame instead of mutating it, so the shared
+    rows (and their embedding arrays) are never written through either bank:
+    memories added later to one bank are invisible to the other.
+    
+    Args:
+        source: The bank to copy.
+        
+    Returns:
+        A new, independent bank of the same type.
+    """
+    bank = copy.copy(source)
+    bank._memory_bank_lock = threading.Lock()
+    with source._memory_bank_lock:
+        bank._memory_bank = source._memory_bank.copy(deep=False)
+        bank._stored_hashes = set(source._stored_hashes)
+    if isinstance(bank, IndexedAssociativeMemoryBank):
+        # The index writes into a preallocated matrix, so it cannot be shared.
+        bank._index_lock = threading.Lock()
+        bank._rebuild_index()
+    return bank
+
+
+# Resources a clone writes to; sharing them would mix the clones' state.
+_PER_CLONE_KWARGS = ('desire_store', 'history_dir', 'memory_archive_dir', 'stored_target_folder')
+# Mutable arguments each clone gets its own copy of unless `clone` is given one.
+_COPIED_KWARGS = ('clock', 'additional_components')
+
+
+def _same_resource(a: Any, b: Any) -> bool:
+    if isinstance(a, str) and isinstance(b, str):
+        return os.path.abspath(a) == os.path.abspath(b)
+    return a is b
+
+
+class AgentBlueprint:
+    """A pristine template agent and the recipe it was built from.
+    
+    Created by `AgentFactory.create_template`; `AgentFactory.clone` turns it
+    into independent agents. The template itself should not take part in a
+    simulation.
+    """
+    
+    def __init__(
+        self,
+        create_method: str,
+        kwargs: Dict[str, Any],
+        template: entity_agent_with_logging.EntityAgentWithLogging,
+        memory_bank: basic_associative_memory.AssociativeMemoryBank,
+    ):
+        self.create_method = create_method
+        self.kwargs = kwargs
+        self.template = template
+        self.memory_bank = memory_bank
+        # Per-clone resources in use by the template and its clones.
+        self.claimed: Dict[str, List[Any]] = {
+            key: [kwargs[key]] for key in _PER_CLONE_KWARGS if kwargs.get(key) is not None
+        }
+    
+    @property
+    def name(self) -> str:
+        return self.kwargs['name']
+
+
 class AgentFactory:
     """Factory class for creating educational simulation agents.
     
@@ -62,26 +137,190 @@ class AgentFactory:
     different characteristics and behaviors.
     """
     
-    def __init__(self, model: Any, embedder_model: Callable[[str], np.ndarray]):
+    def __init__(
+        self,
+        model: Any,
+        embedder_model: Callable[[str], np.ndarray],
+        embedding_cache_dir: Optional[str] = None,
+    ):
         """Initialize the agent factory.
         
         Args:
             model: Language model for agent reasoning
             embedder_model: Function to create text embeddings
+            embedding_cache_dir: Directory of the persistent embedding cache
+                shared with `SceneBuilder`; defaults to the
+                EDUMIRROR_INITIALIZER_CACHE environment variable (no cache if unset)
         """
         self._model = model
-        self._embedder_model = embedder_model
+        self._embedder_model = cached_embedder(embedder_model, embedding_cache_dir)
+        # Per-thread build context: the bank a clone starts from, and the
+        # bank created by the latest build.
+        self._build_context = threading.local()
     
-    def _create_memory_bank(self) -> basic_associative_memory.AssociativeMemoryBank:
+    def _create_memory_bank(
+        self,
+        indexed_memory: bool = False,
+    ) -> basic_associative_memory.AssociativeMemoryBank:
         """Create an empty memory bank.
         
+        Args:
+            indexed_memory: If True, use a vector-indexed memory bank whose
+                retrieval cost stays sublinear as memories accumulate
+        
         Returns:
             Configured AssociativeMemoryBank instance
         """
-        return basic_associative_memory.AssociativeMemoryBank(
-            sentence_embedder=self._embedder_model
+        source = getattr(self._build_context, 'source_bank', None)
+        if source is not None:
+            bank = _copy_on_write_bank(source)
+        elif indexed_memory:
+            bank = IndexedAssociativeMemoryBank(
+                sentence_embedder=self._embedder_model
+            )
+        else:
+            bank = basic_associative_memory.AssociativeMemoryBank(
+                sentence_embedder=self._embedder_model
+            )
+        self._build_context.created_bank = bank
+        return bank
+
+    def _add_formative_memories(
+        self,
+        memory_bank: basic_associative_memory.AssociativeMemoryBank,
+        memories: Optional[List[str]],
+    ) -> None:
+        """Add formative memories unless the bank is a clone that has them.
+        
+        Args:
+            memory_bank: The agent's memory bank.
+            memories: Formative memories to add.
+        """
+        if getattr(self._build_context, 'source_bank', None) is not None:
+            return
+        for memory in memories or []:
+            memory_bank.add(memory)
+
+    def create_template(self, create_method: str, **kwargs) -> AgentBlueprint:
+        """Build a pristine template agent once, for cheap cloning later.
+        
+        Args:
+            create_method: Name of the factory method that builds the agent,
+                e.g. 'create_student' or 'create_value_agent_individual'.
+            **kwargs: Arguments for that method.
+            
+        Returns:
+            The blueprint to pass to `clone`.
+        """
+        agent = getattr(self, create_method)(**kwargs)
+        return AgentBlueprint(
+            create_method=create_method,
+            kwargs=dict(kwargs),
+            template=agent,
+            memory_bank=self._build_context.created_bank,
         )
 
+    def clone(self, blueprint: AgentBlueprint, **overrides) -> entity_agent_with_logging.EntityAgentWithLogging:
+        """Create an independent copy of a template agent.
+        
+        Components are wired afresh (cheap), while the memory bank starts as a
+        copy-on-write view of the template's, so formative memories are not
+        embedded again. The clock and `additional_components` are deep-copied
+        (sharing only the model and embedder) unless given in `overrides`.
+        A blueprint built with a `desire_store`, `history_dir`,
+        `memory_archive_dir` or `stored_target_folder` needs a different one
+        per clone, e.g. one store and one directory per condition, so
+        baseline and intervention branches never share state.
+        
+        Args:
+            blueprint: A blueprint from `create_template`.
+            **overrides: Arguments of the create method replacing the
+                blueprint's for this clone.
+            
+        Returns:
+            A new agent equivalent to the pristine template.
+            
+        Raises:
+            ValueError: If a per-clone resource is already used by the
+                template or another clone, or a stateful argument cannot be
+                copied.
+        """
+        kwargs = self._clone_kwargs(blueprint, overrides)
+        self._build_context.source_bank = blueprint.memory_bank
+        try:
+            return getattr(self, blueprint.create_method)(**kwargs)
+        finally:
+            self._build_context.source_bank = None
+
+    def _clone_kwargs(self, blueprint: AgentBlueprint, overrides: Dict[str, Any]) -> Dict[str, Any]:
+        kwargs = {**blueprint.kwargs, **overrides}
+        for key in _PER_CLONE_KWARGS:
+            value = kwargs.get(key)
+            if value is not None and any(_same_resource(value, used) for used in blueprint.claimed.get(key, [])):
+                raise ValueError(
+                    f'Clone of {blueprint.name!r} needs its own {key}; pass {key}=... to clone'
+                )
+        # Copy in one pass so components referring to the clock get the copy.
+        memo = {id(self._model): self._model, id(self._embedder_model): self._embedder_model}
+        for key in _COPIED_KWARGS:
+            if key in overrides or kwargs.get(key) is None:
+                continue
+            try:
+                kwargs[key] = copy.deepcopy(kwargs[key], memo)
+            except Exception as e:
+                raise ValueError(
+                    f'Cannot copy {key} of {blueprint.name!r} ({e!r}); pass a fresh {key}=... to clone'
+                ) from e
+        for key in _PER_CLONE_KWARGS:
+            if kwargs.get(key) is not None:
+                blueprint.claimed.setdefault(key, []).append(kwargs[key])
+        return kwargs
+
+    def clone_all(
+        self,
+        blueprints: List[AgentBlueprint],
+        **overrides,
+    ) -> List[entity_agent_with_logging.EntityAgentWithLogging]:
+        """Clone every blueprint with the same `overrides`, preserving order.
+        
+        As in a normal build, the agents of one call share a `desire_store`
+        (one slot each) and directories (one file per agent name).
+        """
+        return [self.clone(blueprint, **overrides) for blueprint in blueprints]
+
+    def _with_memory_consolidation(
+        self,
+        name: str,
+        memory_bank: basic_associative_memory.AssociativeMemoryBank,
+        additional_components: Optional[Dict[str, Any]],
+        memory_budget: Optional[int],
+        memory_archive_dir: Optional[str],
+    ) -> Dict[str, Any]:
+        """Add a memory consolidation component when a budget is configured.
+        
+        Args:
+            name: The agent's name.
+            memory_bank: The agent's memory bank.
+            additional_components: Components requested by the caller.
+            memory_budget: Maximum number of memories kept in the bank, or None.
+            memory_archive_dir: Directory where consolidated raw memories are archived.
+            
+        Returns:
+            The additional components, including the consolidation component if any.
+        """
+        components = dict(additional_components or {})
+        if memory_budget is not None:
+            components['MemoryConsolidation'] = MemoryConsolidation(
+                model=self._model,
+                memory_bank=memory_bank,
+                embedder=self._embedder_model,
+                agent_name=name,
+                memory_budget=memory_budget,
+                keep_recent=max(1, min(50, memory_budget // 2)),
+                archive_dir=memory_archive_dir,
+            )
+        return components
+
     
     
     def _create_base_agent(
@@ -108,8 +347,7 @@ class AgentFactory:
         memory_bank = self._create_memory_bank()
         
         # Add formative memories
-        for memory in formative_memories_list:
-            memory_bank.add(memory)
+        self._add_formative_memories(memory_bank, formative_memories_list)
         
         # Create the basic_with_plan prefab
         prefab = basic_with_plan.Entity(
@@ -280,13 +518,18 @@ class AgentFactory:
         clock: Optional[game_clock.MultiIntervalClock] = None,
         main_character: bool = True,
         additional_components: Optional[Dict[str, Any]] = None,
+        indexed_memory: bool = False,
+        memory_budget: Optional[int] = None,
+        memory_archive_dir: Optional[str] = None,
+        context_token_budget: Optional[int] = None,
+        desire_store: Optional[DesireStore] = None,
+        history_window: Optional[int] = None,
+        history_dir: Optional[str] = None,
     ) -> entity_agent_with_logging.EntityAgentWithLogging:
         if build_individual_value_agent is None:
             raise RuntimeError('Individual value agent module not available')
-        memory_bank = self._create_memory_bank()
-        if formative_memories_list:
-            for m in formative_memories_list:
-                memory_bank.add(m)
+        memory_bank = self._create_memory_bank(indexed_memory=indexed_memory)
+        self._add_formative_memories(memory_bank, formative_memories_list)
         if clock is None:
             clock = game_clock.MultiIntervalClock(
                 game_clock.GameClockConfig(time_step=game_clock.timedelta(hours=1))
@@ -296,8 +539,9 @@ class AgentFactory:
             goal=goal,
             extras={'main_character': main_character},
         )
-        if additional_components is None:
-            additional_components = types.MappingProxyType({})
+        additional_components = types.MappingProxyType(self._with_memory_consolidation(
+            name, memory_bank, additional_components, memory_budget, memory_archive_dir,
+        ))
         return build_individual_value_agent(
             config=config,
             context_dict=context_dict,
@@ -310,6 +554,10 @@ class AgentFactory:
             clock=clock,
             update_time_interval=game_clock.timedelta(hours=1),
             additional_components=additional_components,
+            context_token_budget=context_token_budget,
+            desire_store=desire_store,
+            history_window=history_window,
+            history_dir=history_dir,
         )
 
     def create_value_agent_social(
@@ -329,13 +577,17 @@ class AgentFactory:
         clock: Optional[game_clock.MultiIntervalClock] = None,
         main_character: bool = True,
         additional_components: Optional[Dict[str, Any]] = None,
+        indexed_memory: bool = False,
+        memory_budget: Optional[int] = None,
+        memory_archive_dir: Optional[str] = None,
+        desire_store: Optional[DesireStore] = None,
+        history_window: Optional[int] = None,
+        history_dir: Optional[str] = None,
     ) -> entity_agent_with_logging.EntityAgentWithLogging:
         if build_social_value_agent is None:
             raise RuntimeError('Social value agent module not available')
-        memory_bank = self._create_memory_bank()
-        if formative_memories_list:
-            for m in formative_memories_list:
-                memory_bank.add(m)
+        memory_bank = self._create_memory_bank(indexed_memory=indexed_memory)
+        self._add_formative_memories(memory_bank, formative_memories_list)
         if clock is None:
             clock = game_clock.MultiIntervalClock(
                 game_clock.GameClockConfig(time_step=game_clock.timedelta(hours=1))
@@ -345,8 +597,9 @@ class AgentFactory:
             goal=goal,
             extras={'main_character': main_character},
         )
-        if additional_components is None:
-            additional_components = types.MappingProxyType({})
+        additional_components = types.MappingProxyType(self._with_memory_consolidation(
+            name, memory_bank, additional_components, memory_budget, memory_archive_dir,
+        ))
         return build_social_value_agent(
             config=config,
             context_dict=context_dict,
@@ -363,4 +616,7 @@ class AgentFactory:
             social_personality=social_personality,
             agent_names=agent_names,
             current_time=current_time,
+            desire_store=desire_store,
+            history_window=history_window,
+            history_dir=history_dir,
         )
@@ -0,0 +1,279 @@
+# Copyright 2024 EduSim Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bounded in-memory histories that spill old entries to disk.
+
+Value-agent components keep every action and every per-step tracker entry
+(desire values, deltas, SVO, satisfaction, expected values, estimates of other
+agents' desires) for the whole run, so memory and pickled checkpoints grow
+with the number of steps. The containers here keep only the last `window`
+entries in memory:
+
+- `BoundedHistory` replaces the list-like action caches
+- `BoundedStepHistory` replaces the step-keyed tracker dicts
+
+Entries leaving the window are appended to a JSONL log (one
+`{"key": ..., "value": ...}` object per line) when a `log_path` is given, and
+dropped otherwise, in which case `len()`, indexing and iteration cover only
+the retained entries. Each log keeps the byte offset of every spilled key, so
+indexing reads a single line and `len()` reads none; iteration and
+`to_list()`/`to_dict()` read the log once. `read_history(path)` gives
+analysis tools the same records without loading the simulation.
+
+A history opened on an existing log appends to it and picks up its records
+as spilled entries, so a resumed run continues the same log.
+`history_log_path(log_dir, agent_name, name)` is the naming scheme the
+value-agent components use; give each run (or branch) its own `log_dir` so
+unrelated runs do not share a log.
+"""
+
+import collections
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List, Mapping, MutableMapping, Optional
+
+
+def history_log_path(log_dir: Optional[str], agent_name: str, name: str) -> Optional[str]:
+    """Return `<log_dir>/<agent_name>_<name>.jsonl`, or None without a `log_dir`."""
+    if not log_dir:
+        return None
+    safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', f'{agent_name}_{name}').strip('_')
+    return os.path.join(log_dir, f'{safe}.jsonl')
+
+
+def read_history(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the spilled `{"key": ..., "value": ...}` records of one log.
+
+    Keys deleted from a `BoundedStepHistory` after spilling are followed by a
+    `{"key": ..., "deleted": true}` record.
+    """
+    if not path or not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def bounded_like(existing: Any, window: Optional[int], log_path: Optional[str] = None) -> Any:
+    """Return a bounded history holding the items of `existing`.
+
+    Args:
+        existing: A list (becomes a `BoundedHistory`) or a step-keyed dict
+            (becomes a `BoundedStepHistory`)
+        window: Entries kept in memory; None returns `existing` unchanged
+        log_path: JSONL file receiving entries that leave the window
+
+    Returns:
+        The bounded history, or `existing` when `window` is None
+    """
+    if window is None:
+        return existing
+    if isinstance(existing, Mapping):
+        history = BoundedStepHistory(window, log_path)
+        history.update(existing)
+    else:
+        history = BoundedHistory(window, log_path)
+        for item in existing:
+            history.append(item)
+    return history
+
+
+def _hashable(key: Any) -> Any:
+    # JSON turns tuple keys into lists; index them as tuples again.
+    return tuple(_hashable(k) for k in key) if isinstance(key, list) else key
+
+
+class _SpillLog:
+    """Append-only JSONL file holding entries that left the window.
+
+    `offsets` maps each spilled key to the byte offset of its latest record,
+    in first-spill order, so single entries are read with one seek.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.count = 0
+        self.offsets: Dict[Any, int] = {}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if os.path.exists(path):
+                self._index()
+
+    def _index(self) -> None:
+        with open(self.path, 'rb') as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('deleted'):
+                    self.offsets.pop(_hashable(record['key']), None)
+                else:
+                    self.offsets[_hashable(record['key'])] = offset
+                    self.count += 1
+
+    def append(self, key: Any, value: Any) -> None:
+        self.count += 1
+        if not self.path:
+            return
+        line = json.dumps({'key': key, 'value': value}, ensure_ascii=False, default=str) + '\n'
+        with open(self.path, 'ab') as f:
+            self.offsets[key] = f.tell()
+            f.write(line.encode('utf-8'))
+
+    def remove(self, key: Any) -> None:
+        """Forget `key`, writing a deletion record so a reopened log does too."""
+        if self.offsets.pop(key, None) is None:
+            return
+        line = json.dumps({'key': key, 'deleted': True}, ensure_ascii=False, default=str) + '\n'
+        with open(self.path, 'ab') as f:
+            f.write(line.encode('utf-8'))
+
+    def read(self, key: Any) -> Any:
+        """Return the latest spilled value of `key`; KeyError if none."""
+        offset = self.offsets[key]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['value']
+
+    def items(self, skip: Mapping = ()) -> Iterator[Any]:
+        """Yield `(key, value)` for the latest record of each spilled key."""
+        if not self.offsets:
+            return
+        with open(self.path, 'rb') as f:
+            for key, offset in list(self.offsets.items()):
+                if key in skip:
+                    continue
+                f.seek(offset)
+                yield key, json.loads(f.readline())['value']
+
+
+class BoundedHistory:
+    """List-like history keeping the last `window` items in memory."""
+
+    def __init__(self, window: Optional[int] = None, log_path: Optional[str] = None):
+        """Initialize the history.
+
+        Args:
+            window: Number of items kept in memory; None keeps everything
+            log_path: JSONL file receiving items that leave the window
+        """
+        if window is not None and window < 1:
+            raise ValueError(f'window must be at least 1, got {window}')
+        self._window = window
+        self._recent = collections.deque()
+        self._log = _SpillLog(log_path)
+
+    @property
+    def log_path(self) -> Optional[str]:
+        return self._log.path
+
+    def append(self, item: Any) -> None:
+        self._recent.append(item)
+        if self._window is not None and len(self._recent) > self._window:
+            self._log.append(self._log.count, self._recent.popleft())
+
+    def recent(self) -> List[Any]:
+        """Return the items still held in memory."""
+        return list(self._recent)
+
+    def to_list(self) -> List[Any]:
+        """Return every item, reading spilled ones back from the log."""
+        return list(self)
+
+    def __len__(self) -> int:
+        # Without a log, dropped items are gone and no longer count.
+        spilled = self._log.count if self._log.path else 0
+        return spilled + len(self._recent)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[Any]:
+        for _, value in self._log.items():
+            yield value
+        yield from list(self._recent)
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('history index out of range')
+        spilled = len(self) - len(self._recent)
+        if index >= spilled:
+            return self._recent[index - spilled]
+        return self._log.read(index)
+
+
+class BoundedStepHistory(MutableMapping):
+    """Step-keyed history keeping the last `window` entries in memory."""
+
+    def __init__(self, window: Optional[int] = None, log_path: Optional[str] = None):
+        """Initialize the history.
+
+        Args:
+            window: Number of entries kept in memory; None keeps everything
+            log_path: JSONL file receiving entries that leave the window
+        """
+        if window is not None and window < 1:
+            raise ValueError(f'window must be at least 1, got {window}')
+        self._window = window
+        self._recent = collections.OrderedDict()
+        self._log = _SpillLog(log_path)
+
+    @property
+    def log_path(self) -> Optional[str]:
+        return self._log.path
+
+    def recent(self) -> Dict[Any, Any]:
+        """Return the entries still held in memory."""
+        return dict(self._recent)
+
+    def to_dict(self) -> Dict[Any, Any]:
+        """Return every entry, reading spilled ones back from the log."""
+        return dict(self.items())
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._recent[key] = value
+        self._recent.move_to_end(key)
+        if self._window is not None and len(self._recent) > self._window:
+            self._log.append(*self._recent.popitem(last=False))
+
+    def __getitem__(self, key: Any) -> Any:
+        if key in self._recent:
+            return self._recent[key]
+        return self._log.read(key)
+
+    def __delitem__(self, key: Any) -> None:
+        if key not in self._recent and key not in self._log.offsets:
+            raise KeyError(key)
+        # A re-set key may also have an older spilled value.
+        self._recent.pop(key, None)
+        self._log.remove(key)
+
+    def __len__(self) -> int:
+        spilled = sum(1 for key in self._log.offsets if key not in self._recent)
+        return spilled + len(self._recent)
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from [key for key in self._log.offsets if key not in self._recent]
+        yield from list(self._recent)
+
+    def items(self):
+        return list(self._log.items(skip=self._recent)) + list(self._recent.items())
@@ -0,0 +1,316 @@
+# Copyright 2024 EduSim Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Simulation-wide array store for value-agent desire state.
+
+Each desire component normally keeps its value in a Python attribute and each
+`ValueTracker` keeps per-step dicts of values and deltas, so any population
+statistic means walking every agent's dicts. A `DesireStore` shared by all
+agents of a run keeps the same state in preallocated NumPy arrays:
+
+- `current[agent, desire]`: the live value each desire component reads and
+  writes once bound with `bind_desire_store`
+- `values[agent, desire, step]` and `expected[agent, desire, step]`: what each
+  tracker recorded at each of its steps
+
+Arrays grow in chunks along every axis. Deltas from the expected values,
+per-step totals and trajectories are computed on the whole array at once, and
+`to_frame()` / `to_parquet()` export the history in long format.
+
+Usage:
+    store = DesireStore()
+    agent = factory.create_value_agent_individual(..., desire_store=store)
+    ...
+    store.totals()            # (agents, steps) summed shortfall
+    store.to_parquet('desires.parquet')
+"""
+
+import threading
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Desires whose value grows as the agent gets worse off (see ValueTracker).
+REVERSED_DESIRES = ('hunger', 'thirst', 'sleepiness')
+
+
+def normalize_desire_name(name: str) -> str:
+    """Return the key the trackers use for `name` (no separators, lower case)."""
+    return str(name).replace('_', '').replace(' ', '').lower()
+
+
+def _round_up(size: int, chunk: int) -> int:
+    return max(chunk, -(-size // chunk) * chunk)
+
+
+class DesireSlot:
+    """Handle on one agent's desire inside a `DesireStore`."""
+
+    __slots__ = ('_store', '_agent', '_desire')
+
+    def __init__(self, store: 'DesireStore', agent: int, desire: int):
+        self._store = store
+        self._agent = agent
+        self._desire = desire
+
+    def get(self) -> float:
+        return float(self._store._current[self._agent, self._desire])
+
+    def set(self, value: float) -> None:
+        # Under the store lock, so a concurrent `_grow` cannot drop the write.
+        with self._store._lock:
+            self._store._current[self._agent, self._desire] = value
+
+
+class StoreBackedValue:
+    """Mixin keeping a desire component's `_value` in a `DesireStore`.
+
+    Until `bind_desire_store` is called the value stays on the instance, so
+    components built without a store behave as before.
+    """
+
+    _desire_slot: Optional[DesireSlot] = None
+
+    @property
+    def _value(self):
+        if self._desire_slot is None:
+            return self._local_value
+        return self._desire_slot.get()
+
+    @_value.setter
+    def _value(self, value) -> None:
+        if self._desire_slot is None:
+            self._local_value = value
+        else:
+            self._desire_slot.set(value)
+
+    def bind_desire_store(self, store: 'DesireStore', agent_name: str) -> None:
+        """Move this component's value into `store` under `agent_name`."""
+        slot = store.slot(agent_name, self.get_desire_name())
+        slot.set(self._local_value)
+        self._desire_slot = slot
+
+
+class DesireStore:
+    """Preallocated agents x desires x steps arrays of desire state."""
+
+    def __init__(
+        self,
+        desire_names: Iterable[str] = (),
+        chunk_steps: int = 64,
+        chunk_agents: int = 16,
+        reversed_desires: Sequence[str] = REVERSED_DESIRES,
+    ):
+        """Initialize the store.
+
+        Args:
+            desire_names: Desires to allocate up front; others are added on
+                first use
+            chunk_steps: Step columns added each time an agent outgrows the array
+            chunk_agents: Agent rows (and desire columns) added per growth
+            reversed_desires: Desires where values above the expected value
+                count as a shortfall
+        """
+        self._chunk_steps = chunk_steps
+        self._chunk_agents = chunk_agents
+        self._reversed_names = {normalize_desire_name(n) for n in reversed_desires}
+        self._lock = threading.RLock()
+        self._agents: Dict[str, int] = {}
+        self._desires: Dict[str, int] = {}
+        self._steps: List[int] = []
+        self._current = np.full((chunk_agents, chunk_agents), np.nan, dtype=np.float32)
+        self._values = np.full((chunk_agents, chunk_agents, chunk_steps), np.nan, dtype=np.float32)
+        self._expected = np.full_like(self._values, np.nan)
+        self._latest_expected = np.full_like(self._current, np.nan)
+        self._reversed = np.zeros(chunk_agents, dtype=bool)
+        for name in desire_names:
+            self.desire_index(name)
+
+    # -- indexing -------------------------------------------------------------
+
+    @property
+    def agent_names(self) -> List[str]:
+        return list(self._agents)
+
+    @property
+    def desire_names(self) -> List[str]:
+        return list(self._desires)
+
+    @property
+    def num_steps(self) -> int:
+        return max(self._steps, default=0)
+
+    def agent_index(self, agent_name: str) -> int:
+        with self._lock:
+            index = self._agents.get(agent_name)
+            if index is None:
+                index = len(self._agents)
+                self._grow(agents=index + 1)
+                self._agents[agent_name] = index
+                self._steps.append(0)
+            return index
+
+    def desire_index(self, desire_name: str) -> int:
+        key = normalize_desire_name(desire_name)
+        with self._lock:
+            index = self._desires.get(key)
+            if index is None:
+                index = len(self._desires)
+                self._grow(desires=index + 1)
+                self._desires[key] = index
+                self._reversed[index] = key in self._reversed_names
+            return index
+
+    def slot(self, agent_name: str, desire_name: str) -> DesireSlot:
+        return DesireSlot(self, self.agent_index(agent_name), self.desire_index(desire_name))
+
+    def _grow(self, agents: int = 0, desires: int = 0, steps: int = 0) -> None:
+        num_agents, num_desires, num_steps = self._values.shape
+        new_shape = (
+            num_agents if agents <= num_agents else _round_up(agents, self._chunk_agents),
+            num_desires if desires <= num_desires else _round_up(desires, self._chunk_agents),
+            num_steps if steps <= num_steps else _round_up(steps, self._chunk_steps),
+        )
+        if new_shape == self._values.shape:
+            return
+        a, d, s = self._values.shape
+        values = np.full(new_shape, np.nan, dtype=np.float32)
+        expected = np.full(new_shape, np.nan, dtype=np.float32)
+        values[:a, :d, :s] = self._values
+        expected[:a, :d, :s] = self._expected
+        self._values, self._expected = values, expected
+        if new_shape[:2] == (a, d):
+            # Only the step dimension grew; the current values stay in place.
+            return
+        current = np.full(new_shape[:2], np.nan, dtype=np.float32)
+        latest_expected = np.full(new_shape[:2], np.nan, dtype=np.float32)
+        current[:a, :d] = self._current
+        latest_expected[:a, :d] = self._latest_expected
+        reversed_ = np.zeros(new_shape[1], dtype=bool)
+        reversed_[:d] = self._reversed
+        self._current, self._latest_expected = current, latest_expected
+        self._reversed = reversed_
+
+    # -- writing --------------------------------------------------------------
+
+    def get_current(self, agent_name: str, desire_name: str) -> float:
+        return self.slot(agent_name, desire_name).get()
+
+    def set_current(self, agent_name: str, desire_name: str, value: float) -> None:
+        self.slot(agent_name, desire_name).set(value)
+
+    def set_expected(self, agent_name: str, expected: Mapping[str, float]) -> None:
+        """Set the expected values used for `agent_name`'s next recorded steps."""
+        with self._lock:
+            agent = self.agent_index(agent_name)
+            for desire_name, value in expected.items():
+                # Resolve first: a new desire may reallocate the array.
+                desire = self.desire_index(desire_name)
+                self._latest_expected[agent, desire] = value
+
+    def record(self, agent_name: str, values: Optional[Mapping[str, float]] = None) -> int:
+        """Append one step to `agent_name`'s history.
+
+        Args:
+            agent_name: The agent
+            values: Desire values to record instead of the current values;
+                the current values are left unchanged
+
+        Returns:
+            The step index the values were written to
+        """
+        with self._lock:
+            agent = self.agent_index(agent_name)
+            overrides = {self.desire_index(name): value for name, value in (values or {}).items()}
+            column = self._current[agent].copy()
+            for desire, value in overrides.items():
+                column[desire] = value
+            step = self._steps[agent]
+            self._grow(steps=step + 1)
+            self._values[agent, :, step] = column
+            self._expected[agent, :, step] = self._latest_expected[agent]
+            self._steps[agent] = step + 1
+            return step
+
+    # -- reading --------------------------------------------------------------
+
+    @property
+    def values(self) -> np.ndarray:
+        """View of the recorded values, shaped (agents, desires, steps)."""
+        return self._values[:len(self._agents), :len(self._desires), :self.num_steps]
+
+    @property
+    def expected(self) -> np.ndarray:
+        """View of the expected values in force at each recorded step."""
+        return self._expected[:len(self._agents), :len(self._desires), :self.num_steps]
+
+    @property
+    def current(self) -> np.ndarray:
+        """View of the live values, shaped (agents, desires)."""
+        return self._current[:len(self._agents), :len(self._desires)]
+
+    def deltas(self, signed: bool = False) -> np.ndarray:
+        """Shortfall of every recorded value from its expected value.
+
+        Args:
+            signed: Keep surpluses as negative numbers instead of clipping at 0
+
+        Returns:
+            Array shaped (agents, desires, steps); NaN where nothing was recorded
+        """
+        gap = self.expected - self.values
+        reversed_ = self._reversed[:len(self._desires)]
+        gap[:, reversed_, :] *= -1
+        if not signed:
+            gap = np.maximum(gap, 0, where=~np.isnan(gap), out=gap)
+        return gap
+
+    def totals(self, signed: bool = False) -> np.ndarray:
+        """Summed delta per agent and step, shaped (agents, steps)."""
+        deltas = self.deltas(signed=signed)
+        totals = np.nansum(deltas, axis=1)
+        totals[np.all(np.isnan(deltas), axis=1)] = np.nan
+        return totals
+
+    def trajectory(self, agent_name: str, desire_name: str) -> np.ndarray:
+        """View of one desire's recorded values for one agent."""
+        agent = self._agents[agent_name]
+        return self._values[agent, self._desires[normalize_desire_name(desire_name)], :self._steps[agent]]
+
+    def agent_history(self, agent_name: str) -> np.ndarray:
+        """View of one agent's recorded values, shaped (desires, steps)."""
+        agent = self._agents[agent_name]
+        return self._values[agent, :len(self._desires), :self._steps[agent]]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the history as rows of (agent, step, desire, value, expected, delta)."""
+        values = self.values
+        expected = self.expected
+        deltas = self.deltas()
+        agent_idx, desire_idx, step_idx = np.nonzero(~np.isnan(values))
+        agents = np.array(self.agent_names, dtype=object)
+        desires = np.array(self.desire_names, dtype=object)
+        return pd.DataFrame({
+            'agent': agents[agent_idx],
+            'step': step_idx,
+            'desire': desires[desire_idx],
+            'value': values[agent_idx, desire_idx, step_idx],
+            'expected': expected[agent_idx, desire_idx, step_idx],
+            'delta': deltas[agent_idx, desire_idx, step_idx],
+        }).sort_values(['agent', 'step', 'desire'], kind='stable', ignore_index=True)
+
+    def to_parquet(self, path: str) -> None:
+        """Write `to_frame()` to `path` (needs pyarrow or fastparquet)."""
+        self.to_frame().to_parquet(path, index=False)
@@ -0,0 +1,228 @@
+# Copyright 2024 EduSim Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Associative memory bank backed by an incremental vector index.
+
+`IndexedAssociativeMemoryBank` is a drop-in replacement for concordia's
+`basic_associative_memory.AssociativeMemoryBank`. Embeddings are kept in a
+preallocated float32 matrix that grows in chunks, and retrieval uses an
+inverted-file (IVF) index once the bank is large enough. Small banks fall back
+to an exact dot-product scan over the matrix, which is still much cheaper than
+the row-wise pandas scan of the base class.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from concordia.associative_memory import basic_associative_memory
+from concordia.typing import entity_component
+
+
+DEFAULT_EXACT_SEARCH_THRESHOLD = 2048
+DEFAULT_INITIAL_CAPACITY = 256
+DEFAULT_NUM_PROBES = 8
+
+
+class _IVFIndex:
+    """Inverted-file index over rows of an externally owned matrix.
+
+    Centroids are trained with a few rounds of k-means on the rows present at
+    training time. Rows added afterwards are assigned to their nearest centroid
+    without retraining; the owner decides when to retrain.
+    """
+
+    def __init__(self, num_lists: int, num_probes: int, seed: int = 0):
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self._seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[List[int]] = []
+        self.trained_size = 0
+
+    def train(self, vectors: np.ndarray, iterations: int = 10) -> None:
+        """Train centroids on `vectors` and assign every row to a list."""
+        rng = np.random.default_rng(self._seed)
+        n = vectors.shape[0]
+        k = min(self.num_lists, n)
+        centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+        assignment = np.zeros(n, dtype=np.int64)
+        for _ in range(iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(k):
+                members = vectors[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        self.centroids = centroids
+        self.lists = [[] for _ in range(k)]
+        for row, c in enumerate(assignment):
+            self.lists[int(c)].append(row)
+        self.trained_size = n
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        """Assign a newly stored row to its nearest centroid."""
+        c = int(np.argmax(self.centroids @ vector))
+        self.lists[c].append(row)
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        """Return the row ids stored in the lists nearest to `query`."""
+        scores = self.centroids @ query
+        probes = min(self.num_probes, len(self.lists))
+        nearest = np.argpartition(-scores, probes - 1)[:probes]
+        rows: List[int] = []
+        for c in nearest:
+            rows.extend(self.lists[int(c)])
+        return np.asarray(rows, dtype=np.int64)
+
+
+class IndexedAssociativeMemoryBank(basic_associative_memory.AssociativeMemoryBank):
+    """Associative memory bank with vector-indexed retrieval.
+
+    The public API is identical to `AssociativeMemoryBank`; only
+    `retrieve_associative` changes its cost profile. Up to
+    `exact_search_threshold` memories are searched exactly. Beyond that an IVF
+    index with roughly sqrt(n) lists is trained and retrained whenever the bank
+    has doubled in size since the last training.
+    """
+
+    def __init__(
+        self,
+        sentence_embedder: Optional[Callable[[str], np.ndarray]] = None,
+        exact_search_threshold: int = DEFAULT_EXACT_SEARCH_THRESHOLD,
+        num_probes: int = DEFAULT_NUM_PROBES,
+        initial_capacity: int = DEFAULT_INITIAL_CAPACITY,
+    ):
+        """Initialize the memory bank.
+
+        Args:
+            sentence_embedder: Function to create text embeddings
+            exact_search_threshold: Bank size up to which retrieval is exact
+            num_probes: Number of inverted lists scanned per query
+            initial_capacity: Number of rows preallocated for embeddings
+        """
+        super().__init__(sentence_embedder=sentence_embedder)
+        self._exact_search_threshold = exact_search_threshold
+        self._num_probes = num_probes
+        self._initial_capacity = initial_capacity
+        self._vectors: Optional[np.ndarray] = None
+        self._size = 0
+        self._index: Optional[_IVFIndex] = None
+        self._index_lock = threading.Lock()
+
+    def _append_vector(self, vector: np.ndarray) -> None:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if self._vectors is None:
+            self._vectors = np.zeros(
+                (max(1, self._initial_capacity), vector.shape[0]), dtype=np.float32
+            )
+        elif self._size == self._vectors.shape[0]:
+            grown = np.zeros(
+                (self._vectors.shape[0] * 2, self._vectors.shape[1]), dtype=np.float32
+            )
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size] = vector
+        row = self._size
+        self._size += 1
+        if self._index is not None:
+            self._index.add(row, vector)
+
+    def _maybe_train_index(self) -> None:
+        if self._size <= self._exact_search_threshold:
+            return
+        if self._index is not None and self._size < 2 * self._index.trained_size:
+            return
+        num_lists = max(1, int(np.sqrt(self._size)))
+        index = _IVFIndex(num_lists=num_lists, num_probes=self._num_probes)
+        index.train(self._vectors[:self._size])
+        self._index = index
+
+    def _rebuild_index(self) -> None:
+        self._vectors = None
+        self._size = 0
+        self._index = None
+        for embedding in self._memory_bank['embedding']:
+            self._append_vector(embedding)
+        self._maybe_train_index()
+
+    def add(self, text: str) -> None:
+        """Adds a nonduplicated memory and indexes its embedding.
+
+        Args:
+            text: what goes into the memory
+        """
+        if not self._embedder:
+            raise ValueError('Embedder must be set before calling `add` method.')
+
+        text = text.replace('\n', ' ')
+        contents = {'text': text}
+        hashed_contents = hash(tuple(contents.values()))
+        embedding = self._embedder(text)
+        new_df = pd.Series(contents | {'embedding': embedding}).to_frame().T.infer_objects()
+
+        with self._memory_bank_lock:
+            if hashed_contents in self._stored_hashes:
+                return
+            self._memory_bank = pd.concat([self._memory_bank, new_df], ignore_index=True)
+            self._stored_hashes.add(hashed_contents)
+            with self._index_lock:
+                self._append_vector(embedding)
+                self._maybe_train_index()
+
+    def set_state(self, state: entity_component.ComponentState) -> None:
+        """Sets the memory bank from a dictionary and rebuilds the index."""
+        super().set_state(state)
+        with self._memory_bank_lock, self._index_lock:
+            self._rebuild_index()
+
+    def _get_top_k_cosine(self, x: np.ndarray, k: int) -> pd.DataFrame:
+        """Returns the top k rows by dot product with `x`.
+
+        Args:
+            x: The query embedding.
+            k: The number of rows to return.
+
+        Returns:
+            Rows, sorted by similarity in descending order.
+        """
+        query = np.asarray(x, dtype=np.float32).reshape(-1)
+        with self._memory_bank_lock, self._index_lock:
+            if self._size == 0:
+                return self._memory_bank.iloc[[]]
+            if self._index is None:
+                rows = np.arange(self._size)
+            else:
+                rows = self._index.candidates(query)
+                if len(rows) < k:
+                    rows = np.arange(self._size)
+            scores = self._vectors[rows] @ query
+            top = min(k, len(rows))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            return self._memory_bank.iloc[rows[best]]
+
+    def get_index_stats(self) -> Dict[str, int]:
+        """Returns the size and layout of the vector index.
+
+        Returns:
+            Dictionary with stored rows, allocated capacity and number of lists
+        """
+        with self._index_lock:
+            return {
+                'size': self._size,
+                'capacity': 0 if self._vectors is None else self._vectors.shape[0],
+                'num_lists': 0 if self._index is None else len(self._index.lists),
+            }
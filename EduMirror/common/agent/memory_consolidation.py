@@ -0,0 +1,236 @@
+# Copyright 2024 EduSim Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Periodic memory consolidation that keeps an agent's memory bank bounded.
+
+`MemoryConsolidation` is a context component that contributes nothing to the
+agent's prompt. Every `consolidation_interval` acts it checks the size of the
+agent's memory bank; once the bank exceeds `memory_budget` the oldest,
+least salient memories are summarized into condensed entries, the raw entries
+are appended to an on-disk JSONL archive, and the bank is rebuilt without them.
+Retrieval and prompt-building components that read from the bank
+(`ObservationSummary`, `Identity`) then see a roughly constant-size bank no
+matter how long the simulation runs.
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from concordia.associative_memory import basic_associative_memory
+from concordia.document import interactive_document
+from concordia.language_model import language_model
+from concordia.typing import entity as entity_lib
+from concordia.typing import entity_component
+from concordia.typing import logging
+
+
+CONSOLIDATED_TAG = '[Consolidated memory]'
+
+
+def recency_relevance_salience(
+    embeddings: np.ndarray,
+    recent_window: int,
+) -> np.ndarray:
+    """Score each memory by its similarity to the most recent memories.
+
+    Args:
+        embeddings: Matrix of memory embeddings in insertion order
+        recent_window: Number of most recent memories describing current context
+
+    Returns:
+        One salience score per row; higher means more worth keeping verbatim
+    """
+    # Explicit start index: [-0:] would treat every memory as recent.
+    recent = embeddings[max(0, len(embeddings) - max(1, recent_window)):]
+    centroid = recent.mean(axis=0)
+    norms = np.linalg.norm(embeddings, axis=1) * (np.linalg.norm(centroid) + 1e-8)
+    return (embeddings @ centroid) / (norms + 1e-8)
+
+
+class MemoryConsolidation(entity_component.ContextComponent):
+    """Summarizes and archives old, low-salience memories.
+
+    The component only acts in `post_act`, after the agent's action has been
+    produced. The entity still runs `post_act` before `act()` returns, so the
+    act that triggers a consolidation pass (one in every
+    `consolidation_interval`) waits for its summarization calls.
+    """
+
+    def __init__(
+        self,
+        *,
+        model: language_model.LanguageModel,
+        memory_bank: basic_associative_memory.AssociativeMemoryBank,
+        embedder: Callable[[str], np.ndarray],
+        agent_name: str,
+        memory_budget: int = 200,
+        low_watermark: float = 0.75,
+        keep_recent: int = 50,
+        chunk_size: int = 10,
+        consolidation_interval: int = 5,
+        archive_dir: Optional[str] = None,
+        salience_fn: Callable[[np.ndarray, int], np.ndarray] = recency_relevance_salience,
+        logging_channel: logging.LoggingChannel = logging.NoOpLoggingChannel,
+    ) -> None:
+        """Initialize the consolidation component.
+
+        Args:
+            model: Language model used to write condensed memories
+            memory_bank: The bank owned by the agent's memory component
+            embedder: Function to create text embeddings for condensed entries
+            agent_name: Name used in summaries and the archive file name
+            memory_budget: Maximum number of entries kept in the bank
+            low_watermark: Fraction of the budget to shrink to when consolidating
+            keep_recent: Number of most recent memories never consolidated (>= 1)
+            chunk_size: Number of raw memories folded into one condensed entry (>= 2)
+            consolidation_interval: Number of acts between budget checks
+            archive_dir: Directory for the raw-memory archive; None disables it
+            salience_fn: Maps (embeddings, keep_recent) to per-memory salience
+            logging_channel: Channel for consolidation events
+        """
+        if keep_recent < 1:
+            raise ValueError('keep_recent must be at least 1.')
+        if memory_budget <= keep_recent:
+            raise ValueError('memory_budget must be larger than keep_recent.')
+        self._model = model
+        self._memory_bank = memory_bank
+        self._embedder = embedder
+        self._agent_name = agent_name
+        self._memory_budget = memory_budget
+        self._target_size = max(keep_recent + 1, int(memory_budget * low_watermark))
+        self._keep_recent = keep_recent
+        self._chunk_size = max(2, chunk_size)
+        self._consolidation_interval = max(1, consolidation_interval)
+        self._archive_dir = archive_dir
+        self._salience_fn = salience_fn
+        self._logging_channel = logging_channel
+        self._act_counter = 0
+        self._num_archived = 0
+
+    def get_archive_path(self) -> Optional[str]:
+        """Returns the JSONL file raw memories are archived to, if any."""
+        if self._archive_dir is None:
+            return None
+        safe_name = self._agent_name.replace(' ', '_').replace('.', '')
+        return os.path.join(self._archive_dir, f'{safe_name}_memory_archive.jsonl')
+
+    def pre_act(self, action_spec: entity_lib.ActionSpec) -> str:
+        del action_spec
+        return ''
+
+    def post_act(self, action_attempt: str) -> str:
+        del action_attempt
+        self._act_counter += 1
+        if self._act_counter % self._consolidation_interval == 0:
+            self.consolidate()
+        return ''
+
+    def _summarize(self, texts: Sequence[str]) -> str:
+        prompt = interactive_document.InteractiveDocument(self._model)
+        memories = '\n'.join(f'- {t}' for t in texts)
+        summary = prompt.open_question(
+            f'The following are older memories of {self._agent_name}:\n'
+            f'{memories}\n'
+            f'Condense them into a short paragraph written from the perspective '
+            f'of {self._agent_name}. Keep names, commitments, conflicts and '
+            'feelings that may matter later; drop routine details.',
+            max_tokens=300,
+            terminators=('\n\n',),
+        )
+        summary = summary.strip()
+        if not summary:
+            summary = ' '.join(texts)[:500]
+        return f'{CONSOLIDATED_TAG} {summary}'
+
+    def _archive(self, rows: pd.DataFrame) -> None:
+        path = self.get_archive_path()
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for text in rows['text']:
+                f.write(json.dumps({'agent': self._agent_name, 'text': text}, ensure_ascii=False) + '\n')
+
+    def consolidate(self) -> Dict[str, Any]:
+        """Shrink the memory bank to the low watermark if it exceeds the budget.
+
+        Returns:
+            Summary of what was consolidated; empty when nothing was done
+        """
+        data = self._memory_bank.get_data_frame().reset_index(drop=True)
+        if len(data) <= self._memory_budget:
+            return {}
+        num_to_remove = len(data) - self._target_size
+        # Each chunk of raw memories is replaced by one condensed entry.
+        num_candidates = int(np.ceil(num_to_remove * self._chunk_size / (self._chunk_size - 1)))
+        old = data.iloc[:len(data) - self._keep_recent]
+        num_candidates = min(num_candidates, len(old))
+        if num_candidates == 0:
+            return {}
+
+        embeddings = np.stack([np.asarray(e, dtype=np.float32) for e in data['embedding']])
+        salience = self._salience_fn(embeddings, self._keep_recent)[:len(old)]
+        selected = np.sort(np.argsort(salience, kind='stable')[:num_candidates])
+
+        removed = data.iloc[selected]
+        self._archive(removed)
+        chunks: List[List[int]] = [
+            list(selected[i:i + self._chunk_size])
+            for i in range(0, len(selected), self._chunk_size)
+        ]
+        condensed: Dict[int, str] = {}
+        for chunk in chunks:
+            condensed[chunk[0]] = self._summarize([data.at[i, 'text'] for i in chunk])
+
+        removed_set = set(int(i) for i in selected)
+        rows: List[Dict[str, Any]] = []
+        for i in range(len(data)):
+            if i in condensed:
+                rows.append({'text': condensed[i], 'embedding': self._embedder(condensed[i])})
+            if i not in removed_set:
+                rows.append({'text': data.at[i, 'text'], 'embedding': data.at[i, 'embedding']})
+        # Archived hashes are kept so that an identical raw memory is not
+        # re-added later, matching the bank's usual de-duplication.
+        hashes = set(self._memory_bank.get_state()['stored_hashes'])
+        hashes.update(hash((row['text'],)) for row in rows)
+        self._memory_bank.set_state({
+            'stored_hashes': list(hashes),
+            'memory_bank': pd.DataFrame(rows, columns=['text', 'embedding']).to_json(),
+        })
+
+        self._num_archived += len(removed)
+        log = {
+            'size_before': len(data),
+            'size_after': len(self._memory_bank),
+            'archived': len(removed),
+            'condensed_entries': len(condensed),
+            'total_archived': self._num_archived,
+            'archive_path': self.get_archive_path(),
+        }
+        self._logging_channel(log)
+        return log
+
+    def get_state(self) -> entity_component.ComponentState:
+        return {
+            'act_counter': self._act_counter,
+            'num_archived': self._num_archived,
+        }
+
+    def set_state(self, state: entity_component.ComponentState) -> None:
+        self._act_counter = int(state.get('act_counter', 0))
+        self._num_archived = int(state.get('num_archived', 0))
@@ -1,4 +1,4 @@
-from .surveyor import EduMirrorSurveyor
+from .surveyor import EduMirrorSurveyor, model_responder
 from .rater import EduMirrorRater
 from .surveyor import EduMirrorSurveyor
 from .questionnaire import *
@@ -6,5 +6,6 @@ from .rubrics import *
 
 __all__ = [
     'EduMirrorSurveyor',
+    'model_responder',
     'EduMirrorRater',
 ]
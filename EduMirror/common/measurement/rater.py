@@ -2,11 +2,15 @@ from __future__ import annotations
 
 import json
 import os
+import re
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Optional
 
 import pandas as pd
 
+from ..simulation_utils.batch_jobs import BatchJob, run_prompts
+from ..simulation_utils.model_router import model_route
+
 
 @dataclass
 class RubricItem:
@@ -73,6 +77,99 @@ class EduMirrorRater:
         df = pd.DataFrame(rows)
         return df
 
+    def judge_transcript(
+        self,
+        transcript: List[Dict[str, Any]],
+        rubric: Rubric,
+        batch: Optional[BatchJob] = None,
+    ) -> pd.DataFrame:
+        """Rate each event with the model instead of keyword matching.
+
+        One prompt per event asks which option of each rubric item the event
+        shows. With `batch`, all prompts go out as one batch job and are joined
+        back when it completes; otherwise they are sent one by one.
+
+        Returns:
+            Rows in the `analyze_transcript` format, with the model's quote as
+            evidence
+        """
+        if batch is None and self._model is None:
+            raise ValueError("judge_transcript needs a model or a batch job")
+        prompts = self.build_judge_prompts(transcript, rubric)
+        with model_route('rating'):
+            answers = run_prompts(prompts, model=self._model, batch=batch, max_tokens=400)
+        return self.join_judgments(transcript, rubric, answers)
+
+    def build_judge_prompts(self, transcript: List[Dict[str, Any]], rubric: Rubric) -> Dict[str, str]:
+        """Return one judging prompt per rated event, keyed by a batch request id."""
+        prompts: Dict[str, str] = {}
+        item_lines = "\n".join(
+            f"- {item.id} ({item.label}): options {item.options}; cues: {', '.join(map(str, item.criteria.get('keywords', [])))}"
+            for item in rubric.items
+        )
+        for i, entry in enumerate(transcript):
+            event = entry.get("Event", "")
+            agent = self._extract_agent(event)
+            if not event or (rubric.target_agent and agent != rubric.target_agent):
+                continue
+            prompts[f"{rubric.name}:{i}"] = (
+                f"You rate transcripts of a classroom simulation. {rubric.prompt_template}.\n"
+                f"Rubric: {rubric.description}\n"
+                f"Items:\n{item_lines}\n"
+                "For each item, answer with the option the event shows, or \"none\". "
+                "Reply with JSON only: {\"<item id>\": {\"option\": \"...\", \"evidence\": \"<short quote>\"}}\n"
+                f"Event by {agent or 'unknown'}: {event}\n"
+            )
+        return prompts
+
+    def join_judgments(
+        self,
+        transcript: List[Dict[str, Any]],
+        rubric: Rubric,
+        answers: Dict[str, Optional[str]],
+    ) -> pd.DataFrame:
+        """Turn judging answers keyed as in `build_judge_prompts` into result rows.
+
+        Answers to other requests of a shared batch are ignored.
+        """
+        items = {item.id: item for item in rubric.items}
+        rows: List[Dict[str, Any]] = []
+        for index, entry in enumerate(transcript):
+            answer = answers.get(f"{rubric.name}:{index}")
+            if answer is None:
+                continue
+            event = entry.get("Event", "")
+            for item_id, judgment in self._parse_judgment(answer).items():
+                item = items.get(item_id)
+                if item is None or not isinstance(judgment, dict):
+                    continue
+                option = str(judgment.get("option", ""))
+                if option not in item.options:
+                    continue
+                rows.append({
+                    "time_step": entry.get("Step"),
+                    "scene": entry.get("Scene"),
+                    "agent": self._extract_agent(event),
+                    "rubric": rubric.name,
+                    "item_id": item.id,
+                    "label": item.label,
+                    "option": option,
+                    "score": self._option_score(item, option),
+                    "severity": item.scoring.get("severity_map", {}).get(option, 1),
+                    "evidence": str(judgment.get("evidence", "")),
+                })
+        return pd.DataFrame(rows)
+
+    def _parse_judgment(self, answer: Optional[str]) -> Dict[str, Any]:
+        if not answer:
+            return {}
+        match = re.search(r"\{.*\}", answer, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
     def _extract_agent(self, event_text: str) -> str:
         if not event_text:
             return ""
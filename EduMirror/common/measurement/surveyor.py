@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import json
 import os
+import re
+import string
 from typing import Any, Callable, Dict, List, Optional, Sequence
 
 import pandas as pd
@@ -10,6 +12,79 @@ from concordia.components.game_master.questionnaire import Questionnaire as GMQu
 from concordia.components.game_master import event_resolution
 from concordia.typing import entity as entity_lib
 from concordia.contrib.data.questionnaires.base_questionnaire import QuestionnaireBase
+from concordia.document import interactive_document
+from concordia.language_model import language_model
+
+from ..simulation_utils.batch_jobs import BatchJob
+from ..simulation_utils.choice_scoring import match_choice
+from ..simulation_utils.model_router import model_route
+
+
+def parse_action_spec(action_spec_str: str) -> Dict[str, Any]:
+    """Split a questionnaire action spec string into prompt, type and options."""
+    spec: Dict[str, Any] = {"prompt": "", "type": "free", "options": []}
+    for part in action_spec_str.split(";;"):
+        key, _, value = part.partition(":")
+        key = key.strip()
+        if key == "prompt":
+            spec["prompt"] = re.sub(r'^"|"$', "", value.strip()).replace('\\"', '"')
+        elif key == "type":
+            spec["type"] = value.strip()
+        elif key == "options":
+            spec["options"] = [x.strip() for x in value.split(",") if x.strip()]
+    return spec
+
+
+def model_responder(
+    model: language_model.LanguageModel,
+    player_context: Optional[Callable[[str], str]] = None,
+) -> Callable[[str, str], str]:
+    """Return a `run_once` responder that answers each item with `model`.
+
+    Choice items are asked as multiple-choice questions in their listed
+    order, so a model built with `choice_scoring` answers each with one short
+    request and logs the distribution over the options. Free items are
+    answered with an open question.
+
+    Args:
+        model: The model answering for the players
+        player_context: Returns text put before each question for a player,
+            e.g. their persona or recent memories
+    """
+    def responder(player_name: str, action_spec_str: str) -> str:
+        spec = parse_action_spec(action_spec_str)
+        prompt = interactive_document.InteractiveDocument(model)
+        if player_context is not None:
+            prompt.statement(player_context(player_name))
+        if spec["options"]:
+            idx = prompt.multiple_choice_question(spec["prompt"], spec["options"], randomize_choices=False)
+            return spec["options"][idx]
+        return prompt.open_question(spec["prompt"], max_tokens=200)
+
+    return responder
+
+
+def survey_item_prompt(player_name: str, spec: Dict[str, Any], context: str = "") -> str:
+    """Render one questionnaire item as a standalone prompt for `player_name`."""
+    lines = [context] if context else []
+    lines.append(f"Answer the following as {player_name}.")
+    lines.append(f"Question: {spec['prompt']}")
+    for letter, option in zip(string.ascii_lowercase, spec["options"]):
+        lines.append(f"  ({letter}) {option}")
+    if spec["options"]:
+        lines.append("Reply with the letter of one option only.")
+    return "\n".join(lines) + "\n"
+
+
+def parse_survey_answer(text: Optional[str], spec: Dict[str, Any]) -> Optional[str]:
+    """Return the option a reply to `survey_item_prompt` picked, or None."""
+    options = spec["options"]
+    if not options:
+        return (text or "").strip() or None
+    idx = match_choice(text or "", list(string.ascii_lowercase[:len(options)]))
+    if idx is None:
+        idx = match_choice(text or "", options)
+    return None if idx is None else options[idx]
 
 
 class EduMirrorSurveyor:
@@ -26,10 +101,7 @@ class EduMirrorSurveyor:
             pre_act_label=pre_act_label,
         )
 
-    def run_once(
-        self,
-        responder: Callable[[str, str], str],
-    ) -> Optional[pd.DataFrame]:
+    def _pending_items(self) -> List[Dict[str, Any]]:
         spec = entity_lib.ActionSpec(
             call_to_action=",".join(self._player_names),
             output_type=entity_lib.OutputType.NEXT_ACTION_SPEC,
@@ -39,15 +111,54 @@ class EduMirrorSurveyor:
             items: List[Dict[str, Any]] = json.loads(payload)
         except Exception:
             items = []
-        for item in items:
-            player = item.get("player_name", "")
-            q_id = item.get("question_id", "")
-            action_spec_str = item.get("action_spec_str", "")
-            if not player or not q_id:
-                continue
-            answer_text = responder(player, action_spec_str)
-            observation = f"{event_resolution.PUTATIVE_EVENT_TAG} {player}: {q_id}: {answer_text}"
-            self._questionnaire.pre_observe(observation)
+        return [item for item in items if item.get("player_name") and item.get("question_id")]
+
+    def _record_answer(self, player: str, q_id: str, answer_text: str) -> None:
+        observation = f"{event_resolution.PUTATIVE_EVENT_TAG} {player}: {q_id}: {answer_text}"
+        self._questionnaire.pre_observe(observation)
+
+    def run_once(
+        self,
+        responder: Callable[[str, str], str],
+    ) -> Optional[pd.DataFrame]:
+        for item in self._pending_items():
+            player = item["player_name"]
+            with model_route('survey'):
+                answer_text = responder(player, item.get("action_spec_str", ""))
+            self._record_answer(player, item["question_id"], answer_text)
+        return self._questionnaire.get_questionnaires_results()
+
+    def run_batch(
+        self,
+        batch: BatchJob,
+        player_context: Optional[Callable[[str], str]] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Answer every pending item in one batch job.
+
+        Each item becomes one request of `batch`; the answers are joined back
+        into the questionnaire when the job completes. Items whose answer
+        matches no option stay unanswered, so a later `run_once` or
+        `run_batch` can ask them again.
+
+        Args:
+            batch: The batch job the requests are added to and run
+            player_context: Returns text put before each question for a
+                player, e.g. their persona or transcript summary
+        """
+        specs: Dict[str, tuple] = {}
+        for item in self._pending_items():
+            player, q_id = item["player_name"], item["question_id"]
+            spec = parse_action_spec(item.get("action_spec_str", ""))
+            context = player_context(player) if player_context is not None else ""
+            custom_id = batch.add(f"{player}:{q_id}", survey_item_prompt(player, spec, context), max_tokens=200)
+            specs[custom_id] = (player, q_id, spec)
+        if not specs:
+            return self._questionnaire.get_questionnaires_results()
+        answers = batch.run()
+        for custom_id, (player, q_id, spec) in specs.items():
+            answer_text = parse_survey_answer(answers.get(custom_id), spec)
+            if answer_text is not None:
+                self._record_answer(player, q_id, answer_text)
         return self._questionnaire.get_questionnaires_results()
 
     def save_results(
@@ -11,6 +11,7 @@ from .model_setup import (
     create_model_config_from_environment,
     create_simple_embedder,
     create_openai_embedder,
+    create_service_embedder,
     DEFAULT_CONFIG,
     TEST_CONFIG,
     PRODUCTION_CONFIG,
@@ -26,6 +27,10 @@ from .config import (
     validate_configuration
 )
 from .intervention_runner import InterventionScenarioRunner, InterventionSpec
+from .adaptive_replicates import AdaptiveReplicateScheduler, replicate_outcomes
+from .work_queue import FileWorkQueue, Job, SQLiteWorkQueue, Worker, open_queue, sweep_jobs
+from .param_sweep import Parameter, ParameterSpace, ParameterSweep, config_hash
+from .active_learning import ActiveLearner, GaussianProcessSurrogate
 from .scene_builder import SceneBuilder
 from .time_manager import (
     create_fixed_interval_clock,
@@ -36,6 +41,21 @@ from .time_manager import (
     current_interval_str,
 )
 from .log_to_comic import LogToComicGenerator
+from .llm_telemetry import InstrumentedLanguageModel, LLMTelemetry, emit_event
+from .model_router import RoutedLanguageModel, model_route
+from .budget_guard import BudgetExceededError, BudgetGuard, BudgetedLanguageModel, set_active_budget, spend_report
+from .request_scheduler import RequestScheduler, ScheduledLanguageModel, model_priority, set_active_scheduler
+from .choice_scoring import ChoiceScoringLanguageModel
+from .batch_jobs import BatchJob, LocalBatchBackend, OpenAIBatchBackend, create_batch_backend
+from .initializer_cache import CachedEmbedder, InitializerCache, cached_embedder
+from .population import (
+    AgentTemplate,
+    ClassroomPopulation,
+    NeighbourhoodScheduler,
+    SocialGraph,
+    build_classroom_graph,
+    generate_population,
+)
 
 __all__ = [
     'CheckpointManager',
@@ -43,11 +63,26 @@ __all__ = [
     'load_simulation_from_checkpoint',
     'InterventionScenarioRunner',
     'InterventionSpec',
+    'AdaptiveReplicateScheduler',
+    'replicate_outcomes',
+    'FileWorkQueue',
+    'Job',
+    'SQLiteWorkQueue',
+    'Worker',
+    'open_queue',
+    'sweep_jobs',
+    'Parameter',
+    'ParameterSpace',
+    'ParameterSweep',
+    'config_hash',
+    'ActiveLearner',
+    'GaussianProcessSurrogate',
     'ModelConfig',
     'create_language_model',
     'create_model_config_from_environment',
     'create_simple_embedder',
     'create_openai_embedder',
+    'create_service_embedder',
     'DEFAULT_CONFIG',
     'TEST_CONFIG',
     'PRODUCTION_CONFIG',
@@ -70,4 +105,32 @@ __all__ += [
     'now',
     'current_interval_str',
     'LogToComicGenerator',
+    'InstrumentedLanguageModel',
+    'LLMTelemetry',
+    'emit_event',
+    'RoutedLanguageModel',
+    'model_route',
+    'BudgetExceededError',
+    'BudgetGuard',
+    'BudgetedLanguageModel',
+    'set_active_budget',
+    'spend_report',
+    'RequestScheduler',
+    'ScheduledLanguageModel',
+    'model_priority',
+    'set_active_scheduler',
+    'ChoiceScoringLanguageModel',
+    'BatchJob',
+    'LocalBatchBackend',
+    'OpenAIBatchBackend',
+    'create_batch_backend',
+    'CachedEmbedder',
+    'InitializerCache',
+    'cached_embedder',
+    'AgentTemplate',
+    'ClassroomPopulation',
+    'NeighbourhoodScheduler',
+    'SocialGraph',
+    'build_classroom_graph',
+    'generate_population',
 ]
@@ -0,0 +1,305 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Surrogate-guided choice of which sweep configs to simulate next.
+
+An exhaustive `ParameterSweep` over a large space costs one full LLM
+simulation per config. `ActiveLearner` spends a fixed job budget instead:
+
+1. Run a small Latin hypercube design.
+2. Fit a `GaussianProcessSurrogate` per outcome (survey subscale scores,
+   rubric hit counts, final desire deltas) on the unit-scaled parameters,
+   averaging replicates of the same config.
+3. Score candidate configs by the expected information gain of observing
+   them, `0.5 * log(1 + var / noise)` summed over outcomes, and pick a batch
+   greedily: after each pick the surrogates are conditioned on it, so the
+   rest of the batch goes to other uncertain regions.
+4. Enqueue the batch, let the workers run it and repeat until the budget is
+   spent.
+
+Each round is appended to `<work_root>/active_learning.jsonl`.
+
+Usage:
+    learner = ActiveLearner(sweep, open_queue('sweep.db'), 'sweep_runs', budget=60,
+                            outcomes=['leo_post_baseline:Leo:survey:RSES'])
+    table = learner.run()
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .param_sweep import ParameterSweep, config_hash
+from .work_queue import LEASED, QUEUED, Worker, WorkQueue
+
+META_COLUMNS = ('job_id', 'config_hash', 'condition', 'seed')
+
+
+class GaussianProcessSurrogate:
+    """Gaussian process with an RBF kernel over unit-scaled parameters.
+
+    The length scale and noise level are chosen by marginal likelihood from a
+    small grid, and targets are standardized, so the model needs no tuning.
+    """
+
+    LENGTH_SCALES = (0.1, 0.2, 0.3, 0.5, 0.8, 1.2)
+    NOISE_LEVELS = (1e-3, 1e-2, 0.1, 0.3)
+
+    def __init__(self):
+        self.length_scale = 0.3
+        self.noise = 0.1
+        self._x: Optional[np.ndarray] = None
+        self._chol: Optional[np.ndarray] = None
+        self._alpha: Optional[np.ndarray] = None
+        self._mean = 0.0
+        self._scale = 1.0
+
+    def _kernel(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        sq = ((a[:, None, :] - b[None, :, :]) ** 2).sum(-1)
+        return np.exp(-0.5 * sq / self.length_scale ** 2)
+
+    def fit(self, x: np.ndarray, y: np.ndarray) -> 'GaussianProcessSurrogate':
+        y = np.asarray(y, dtype=float)
+        self._mean = float(y.mean())
+        self._scale = float(y.std()) or 1.0
+        z = (y - self._mean) / self._scale
+        best = None
+        for length_scale in self.LENGTH_SCALES:
+            for noise in self.NOISE_LEVELS:
+                self.length_scale, self.noise = length_scale, noise
+                try:
+                    chol = np.linalg.cholesky(self._kernel(x, x) + noise * np.eye(len(x)))
+                except np.linalg.LinAlgError:
+                    continue
+                alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, z))
+                log_likelihood = -0.5 * z @ alpha - np.log(np.diag(chol)).sum()
+                if best is None or log_likelihood > best[0]:
+                    best = (log_likelihood, length_scale, noise, chol, alpha)
+        _, self.length_scale, self.noise, self._chol, self._alpha = best
+        self._x = x
+        return self
+
+    def predict(self, x: np.ndarray) -> tuple:
+        """Return the predictive mean and standard deviation at `x`."""
+        k = self._kernel(x, self._x)
+        mean = k @ self._alpha
+        v = np.linalg.solve(self._chol, k.T)
+        var = np.maximum(1.0 - (v ** 2).sum(0), 1e-12)
+        return mean * self._scale + self._mean, np.sqrt(var) * self._scale
+
+    def information_gain(self, x: np.ndarray, pending: Optional[np.ndarray] = None) -> np.ndarray:
+        """Expected information gain of observing `x`, given observations also at `pending`.
+
+        The posterior variance of a GP does not depend on the observed
+        values, so pending (chosen but not yet run) configs can be added
+        before their outcomes exist.
+        """
+        train = self._x if pending is None or not len(pending) else np.vstack([self._x, pending])
+        k_train = self._kernel(train, train) + self.noise * np.eye(len(train))
+        chol = np.linalg.cholesky(k_train)
+        v = np.linalg.solve(chol, self._kernel(x, train).T)
+        var = np.maximum(1.0 - (v ** 2).sum(0), 1e-12)
+        return 0.5 * np.log1p(var / self.noise)
+
+
+class ActiveLearner:
+    """Runs a `ParameterSweep` in surrogate-chosen batches under a job budget."""
+
+    def __init__(
+        self,
+        sweep: ParameterSweep,
+        queue: WorkQueue,
+        work_root: str,
+        budget: int,
+        batch_size: int = 4,
+        initial: Optional[int] = None,
+        outcomes: Optional[Sequence[str]] = None,
+        candidates: int = 512,
+        local_workers: int = 1,
+        poll_interval: float = 30.0,
+        seed: int = 0,
+        surrogate_factory: Any = GaussianProcessSurrogate,
+    ):
+        """Initialize the learner.
+
+        Args:
+            sweep: The sweep whose parameter space is explored
+            queue: Queue the jobs go to
+            work_root: The workers' work root (results are read from it)
+            budget: Total jobs (configs x seeds) to run, including earlier ones
+            batch_size: Configs chosen per round
+            initial: Configs in the initial Latin hypercube; defaults to twice
+                the number of parameters
+            outcomes: Outcome columns to model; None models every outcome
+                measured in all finished jobs
+            candidates: Random candidate configs scored per round
+            local_workers: Workers this process runs in threads after each
+                enqueue; 0 waits for external workers instead
+            poll_interval: Seconds between queue checks when waiting
+            seed: Seed of the initial design and the candidate draws
+            surrogate_factory: Callable returning an unfitted surrogate with
+                `fit`, `predict` and `information_gain`
+        """
+        self.sweep = sweep
+        self.queue = queue
+        self.work_root = work_root
+        self.budget = budget
+        self.batch_size = batch_size
+        self.initial = initial or 2 * len(sweep.space.parameters)
+        self.outcomes = list(outcomes) if outcomes else None
+        self._candidates = candidates
+        self._local_workers = local_workers
+        self._poll_interval = poll_interval
+        self._seed = seed
+        self._surrogate_factory = surrogate_factory
+        self._round = 0
+        self.surrogates: Dict[str, Any] = {}
+        self._last_gains: List[float] = []
+        self._log_path = os.path.join(work_root, 'active_learning.jsonl')
+
+    @property
+    def jobs_per_config(self) -> int:
+        return len(self.sweep.seeds)
+
+    def _sweep_jobs(self) -> int:
+        return sum(1 for job in self.queue.jobs()
+                   if job.config.get('scenario') == self.sweep.scenario and 'config_hash' in job.config)
+
+    def _wait(self) -> None:
+        if self._local_workers:
+            # Workers run each job in a subprocess, so threads are enough.
+            threads = [threading.Thread(target=Worker(self.queue, self.work_root, poll_interval=1.0).run)
+                       for _ in range(self._local_workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return
+        while self.queue.jobs(QUEUED) or self.queue.jobs(LEASED):
+            time.sleep(self._poll_interval)
+
+    def observations(self) -> tuple:
+        """Return (configs, unit features, outcome frame) averaged per config."""
+        table = self.sweep.outcomes_table(self.work_root)
+        if table.empty:
+            return [], np.empty((0, len(self.sweep.space.parameters))), pd.DataFrame()
+        columns = self.outcomes or [c for c in table.columns
+                                    if c not in META_COLUMNS and not c.startswith('param:')
+                                    and table[c].notna().all()]
+        grouped = table.groupby('config_hash')
+        outcome_frame = grouped[columns].mean()
+        configs = [self._config_of(group) for _, group in grouped]
+        return configs, self.sweep.space.encode(configs), outcome_frame
+
+    def _config_of(self, group: pd.DataFrame) -> Dict[str, Any]:
+        row = group.iloc[0]
+        config = {}
+        for name in self.sweep.space.names:
+            value = row[f'param:{name}']
+            if isinstance(value, str) and value[:1] in '[{':
+                value = json.loads(value)
+            config[name] = value.item() if hasattr(value, 'item') else value
+        return config
+
+    def fit(self) -> Dict[str, Any]:
+        """Fit one surrogate per outcome on the finished jobs."""
+        _, x, frame = self.observations()
+        self.surrogates = {}
+        for column in frame.columns:
+            y = frame[column].to_numpy(dtype=float)
+            if len(y) >= 2 and np.isfinite(y).all():
+                self.surrogates[column] = self._surrogate_factory().fit(x, y)
+        return self.surrogates
+
+    def propose(self, count: int) -> List[Dict[str, Any]]:
+        """Greedily pick `count` unseen candidate configs by summed information gain."""
+        space = self.sweep.space
+        seen = {job.config.get('config_hash') for job in self.queue.jobs()}
+        pool, keys = [], set()
+        for config in space.latin_hypercube(self._candidates, self._seed + 1000 + self._round):
+            key = config_hash({**self.sweep.fixed, **config})
+            if key not in seen and key not in keys:
+                keys.add(key)
+                pool.append(config)
+        if not pool:
+            return []
+        if not self.surrogates:
+            return pool[:count]
+        x = space.encode(pool)
+        chosen: List[int] = []
+        gains: List[float] = []
+        for _ in range(min(count, len(pool))):
+            pending = x[chosen] if chosen else None
+            gain = sum(s.information_gain(x, pending) for s in self.surrogates.values())
+            gain[chosen] = -np.inf
+            best = int(np.argmax(gain))
+            chosen.append(best)
+            gains.append(float(gain[best]))
+        self._last_gains = gains
+        return [pool[i] for i in chosen]
+
+    def step(self) -> int:
+        """Run one round; returns the number of jobs it enqueued."""
+        remaining_configs = (self.budget - self._sweep_jobs()) // self.jobs_per_config
+        if remaining_configs <= 0:
+            return 0
+        self._last_gains = []
+        if self._sweep_jobs() == 0:
+            configs = self.sweep.configs('lhs', min(self.initial, remaining_configs), self._seed)
+        else:
+            self.fit()
+            configs = self.propose(min(self.batch_size, remaining_configs))
+        added = self.queue.enqueue_many(self.sweep.jobs(configs))
+        self._log(configs)
+        self._round += 1
+        if added:
+            self._wait()
+        return added
+
+    def run(self) -> pd.DataFrame:
+        """Run rounds until the budget is spent; returns the outcomes table."""
+        while self.step():
+            pass
+        self.fit()
+        return self.sweep.outcomes_table(self.work_root)
+
+    def predict(self, configs: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+        """Surrogate mean and standard deviation of every modelled outcome."""
+        x = self.sweep.space.encode(configs)
+        columns = {}
+        for outcome, surrogate in self.surrogates.items():
+            mean, std = surrogate.predict(x)
+            columns[f'{outcome}:mean'] = mean
+            columns[f'{outcome}:std'] = std
+        return pd.DataFrame(columns)
+
+    def _log(self, configs: List[Dict[str, Any]]) -> None:
+        os.makedirs(self.work_root, exist_ok=True)
+        record = {
+            'round': self._round,
+            'time': time.time(),
+            'jobs': self._sweep_jobs(),
+            'budget': self.budget,
+            'configs': configs,
+            'information_gain': self._last_gains,
+            'surrogates': {k: {'length_scale': s.length_scale, 'noise': s.noise}
+                           for k, s in self.surrogates.items() if hasattr(s, 'length_scale')},
+        }
+        with open(self._log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
@@ -0,0 +1,364 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adaptive replicate scheduling with sequential stopping rules.
+
+Claiming an intervention effect needs each condition run many times, and a
+fixed replicate count either wastes runs on comparisons that are already
+clear or stops short on close ones. `AdaptiveReplicateScheduler` runs
+replicates in waves instead. After each wave it compares every intervention
+with the baseline on every outcome (questionnaire dimensions, rubric scores)
+using a Welch confidence interval on the difference in means:
+
+- 'effect': the interval excludes 0
+- 'null': the interval lies inside +/- `null_margin`
+- 'uncertain': neither; the comparison keeps receiving runs
+
+Arms whose replicates are all identical have no estimated spread, so their
+interval is unbounded; the difference is only taken as exact once both arms
+have `min_constant_replicates` runs.
+
+Each wave's runs go to the arms whose next replicate shrinks the intervals of
+the uncertain comparisons most, so resolved and clearly null conditions stop
+consuming budget. The study stops when no comparison is uncertain or the
+budget is spent. Repeated looks are paid for by splitting `alpha` evenly over
+the planned number of waves (a conservative Bonferroni correction).
+
+Every replicate's outcomes are appended to `<output_dir>/replicates.jsonl`,
+so an interrupted study resumes without rerunning finished replicates.
+
+Usage:
+    def run_replicate(spec, replicate):
+        runner = make_runner(seed=replicate)       # fresh agents per replicate
+        result = runner.run_branch(spec, verbose=False)
+        return replicate_outcomes(survey_df=..., rating_df=..., player='Lucas')
+
+    scheduler = AdaptiveReplicateScheduler(
+        run_replicate, baseline=baseline_spec, interventions=[i1, i2],
+        budget=60, wave_size=6, null_margin=0.5, output_dir='results/study')
+    report = scheduler.run()
+"""
+
+import json
+import math
+import os
+import statistics
+from concurrent import futures
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .intervention_runner import InterventionSpec
+
+try:
+    from scipy import stats as _stats
+except ImportError:
+    _stats = None
+
+ReplicateFn = Callable[[InterventionSpec, int], Mapping[str, float]]
+
+EFFECT = 'effect'
+NULL = 'null'
+UNCERTAIN = 'uncertain'
+
+
+def _quantile(level: float, dof: float) -> float:
+    """Two-sided critical value; Student t with scipy, else normal."""
+    if _stats is not None and math.isfinite(dof):
+        return float(_stats.t.ppf(level, dof))
+    return statistics.NormalDist().inv_cdf(level)
+
+
+def welch_interval(a: Sequence[float], b: Sequence[float], alpha: float) -> Tuple[float, float, float]:
+    """Return (difference of means b - a, lower, upper) at confidence 1 - alpha.
+
+    With zero variance in both samples the standard error is unknown, and
+    the interval is (-inf, inf).
+    """
+    n_a, n_b = len(a), len(b)
+    diff = statistics.fmean(b) - statistics.fmean(a)
+    var_a = statistics.variance(a) / n_a
+    var_b = statistics.variance(b) / n_b
+    se = math.sqrt(var_a + var_b)
+    if se == 0:
+        return diff, -math.inf, math.inf
+    dof = (var_a + var_b) ** 2 / (
+        (var_a ** 2 / (n_a - 1) if var_a else 0.0) + (var_b ** 2 / (n_b - 1) if var_b else 0.0))
+    half = _quantile(1 - alpha / 2, dof) * se
+    return diff, diff - half, diff + half
+
+
+def replicate_outcomes(
+    survey_df: Optional[pd.DataFrame] = None,
+    rating_df: Optional[pd.DataFrame] = None,
+    player: Optional[str] = None,
+) -> Dict[str, float]:
+    """Flatten one replicate's measurements into outcome -> value.
+
+    Args:
+        survey_df: `EduMirrorSurveyor` results (players x dimension scores);
+            each column becomes `survey:<column>`
+        rating_df: `EduMirrorRater` rows; scores are summed per item as
+            `rubric:<rubric>:<item_id>`
+        player: Survey row and rated agent to use; None uses the first survey
+            row and every rated agent
+    """
+    outcomes: Dict[str, float] = {}
+    if survey_df is not None and len(survey_df):
+        row = survey_df.loc[player] if player is not None else survey_df.iloc[0]
+        for column, value in row.items():
+            if isinstance(value, (int, float)) and not pd.isna(value):
+                outcomes[f'survey:{column}'] = float(value)
+    if rating_df is not None and len(rating_df):
+        rows = rating_df if player is None else rating_df[rating_df['agent'] == player]
+        for (rubric, item_id), score in rows.groupby(['rubric', 'item_id'])['score'].sum().items():
+            outcomes[f'rubric:{rubric}:{item_id}'] = float(score)
+    return outcomes
+
+
+class AdaptiveReplicateScheduler:
+    """Runs intervention replicates in waves until the comparisons resolve."""
+
+    def __init__(
+        self,
+        run_replicate: ReplicateFn,
+        baseline: InterventionSpec,
+        interventions: Sequence[InterventionSpec],
+        budget: int,
+        wave_size: int = 4,
+        min_replicates: int = 3,
+        alpha: float = 0.05,
+        null_margin: float | Mapping[str, float] = 0.0,
+        outcomes: Optional[Sequence[str]] = None,
+        output_dir: Optional[str] = None,
+        max_workers: int = 1,
+        min_constant_replicates: int = 10,
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            run_replicate: Runs one replicate of a condition with a fresh
+                simulation and returns its outcomes (see `replicate_outcomes`)
+            baseline: The control condition every intervention is compared with
+            interventions: The conditions under test
+            budget: Total replicate runs across all conditions
+            wave_size: Runs per wave after the initial `min_replicates`
+            min_replicates: Runs per condition before any comparison is made
+            alpha: Family-wise error per comparison over all waves
+            null_margin: Differences within +/- this (per outcome, or one
+                value for all) count as no effect; 0 disables null stopping
+            outcomes: Outcomes to compare; None compares every outcome the
+                replicates report
+            output_dir: Where `replicates.jsonl` and `decisions.json` are kept
+            max_workers: Replicates run in parallel within a wave
+            min_constant_replicates: Runs per arm after which an outcome that
+                never varies in either arm is compared by its exact difference
+        """
+        labels = [baseline.output_label] + [s.output_label for s in interventions]
+        if len(set(labels)) != len(labels):
+            raise ValueError(f'Condition labels must be unique, got {labels}')
+        if min_replicates < 2:
+            raise ValueError('min_replicates must be at least 2 to estimate variances')
+        self._run_replicate = run_replicate
+        self._baseline = baseline
+        self._conditions = {s.output_label: s for s in [baseline, *interventions]}
+        self._budget = budget
+        self._wave_size = wave_size
+        self._min_replicates = min_replicates
+        self._null_margin = null_margin
+        self._outcomes = list(outcomes) if outcomes is not None else None
+        self._output_dir = output_dir
+        self._max_workers = max_workers
+        self._min_constant_replicates = min_constant_replicates
+        initial = min_replicates * len(self._conditions)
+        planned_waves = 1 + max(0, math.ceil((budget - initial) / max(wave_size, 1)))
+        self.alpha_per_look = alpha / planned_waves
+        self._results: Dict[str, List[Dict[str, float]]] = {label: [] for label in self._conditions}
+        self.history: List[Dict[str, Any]] = []
+        self._load()
+
+    # -- bookkeeping ----------------------------------------------------------
+
+    @property
+    def runs_used(self) -> int:
+        return sum(len(r) for r in self._results.values())
+
+    def replicates(self, label: str) -> List[Dict[str, float]]:
+        return list(self._results[label])
+
+    def _log_path(self) -> Optional[str]:
+        return os.path.join(self._output_dir, 'replicates.jsonl') if self._output_dir else None
+
+    def _load(self) -> None:
+        path = self._log_path()
+        if not path or not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record['condition'] in self._results:
+                        self._results[record['condition']].append(record['outcomes'])
+
+    def _record(self, label: str, replicate: int, outcomes: Mapping[str, float]) -> None:
+        self._results[label].append(dict(outcomes))
+        path = self._log_path()
+        if path:
+            os.makedirs(self._output_dir, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'condition': label, 'replicate': replicate, 'outcomes': dict(outcomes)}) + '\n')
+
+    def _margin(self, outcome: str) -> float:
+        if isinstance(self._null_margin, Mapping):
+            return float(self._null_margin.get(outcome, 0.0))
+        return float(self._null_margin)
+
+    # -- statistics -----------------------------------------------------------
+
+    def _values(self, label: str, outcome: str) -> List[float]:
+        return [r[outcome] for r in self._results[label] if outcome in r]
+
+    def _outcome_names(self) -> List[str]:
+        if self._outcomes is not None:
+            return self._outcomes
+        names = {name for runs in self._results.values() for r in runs for name in r}
+        return sorted(names)
+
+    def comparisons(self) -> List[Dict[str, Any]]:
+        """Current interval and decision of every (intervention, outcome) pair."""
+        base = self._baseline.output_label
+        rows = []
+        for label in self._conditions:
+            if label == base:
+                continue
+            for outcome in self._outcome_names():
+                a, b = self._values(base, outcome), self._values(label, outcome)
+                row = {'condition': label, 'outcome': outcome, 'n_baseline': len(a), 'n_condition': len(b)}
+                if len(a) < 2 or len(b) < 2:
+                    row.update(diff=None, lower=None, upper=None, status=UNCERTAIN)
+                else:
+                    diff, lower, upper = welch_interval(a, b, self.alpha_per_look)
+                    if math.isinf(lower) and min(len(a), len(b)) >= self._min_constant_replicates:
+                        # Both arms constant over many runs: the difference is exact.
+                        lower = upper = diff
+                    margin = self._margin(outcome)
+                    if math.isinf(lower):
+                        status = UNCERTAIN
+                        lower = upper = None
+                    elif lower > 0 or upper < 0:
+                        status = EFFECT
+                    elif margin > 0 and -margin <= lower and upper <= margin:
+                        status = NULL
+                    else:
+                        status = UNCERTAIN
+                    row.update(diff=diff, lower=lower, upper=upper, status=status)
+                rows.append(row)
+        return rows
+
+    def _variance_gain(self, label: str, outcome: str) -> float:
+        values = self._values(label, outcome)
+        n = len(values)
+        if n < 2:
+            return math.inf
+        var = statistics.variance(values)
+        return var / n - var / (n + 1)
+
+    def _allocate(self, uncertain: List[Dict[str, Any]], runs: int) -> List[str]:
+        """Greedily give each run to the arm that shrinks the uncertain intervals most."""
+        base = self._baseline.output_label
+        planned: Dict[str, int] = {label: 0 for label in self._conditions}
+        allocation: List[str] = []
+        for _ in range(runs):
+            scores: Dict[str, float] = {}
+            for row in uncertain:
+                width = (row['upper'] - row['lower']) if row['upper'] is not None else 1.0
+                for label in (base, row['condition']):
+                    # Pretend planned runs already happened by discounting the gain.
+                    gain = self._variance_gain(label, row['outcome']) / (1 + planned[label])
+                    scores[label] = scores.get(label, 0.0) + gain / max(width, 1e-9) ** 2
+            if not scores:
+                break
+            best = max(scores, key=lambda label: (scores[label], -planned[label]))
+            planned[best] += 1
+            allocation.append(best)
+        return allocation
+
+    # -- running --------------------------------------------------------------
+
+    def _run_wave(self, labels: List[str]) -> None:
+        jobs = []
+        counts = {label: len(self._results[label]) for label in self._conditions}
+        for label in labels:
+            jobs.append((label, counts[label]))
+            counts[label] += 1
+        if self._max_workers <= 1:
+            for label, replicate in jobs:
+                self._record(label, replicate, self._run_replicate(self._conditions[label], replicate))
+            return
+        with futures.ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            pending = {pool.submit(self._run_replicate, self._conditions[label], replicate): (label, replicate)
+                       for label, replicate in jobs}
+            for future in futures.as_completed(pending):
+                label, replicate = pending[future]
+                self._record(label, replicate, future.result())
+
+    def step(self) -> bool:
+        """Run one wave; return False when the study is finished."""
+        remaining = self._budget - self.runs_used
+        if remaining <= 0:
+            return False
+        short = [label for label in self._conditions
+                 for _ in range(self._min_replicates - len(self._results[label]))]
+        if short:
+            labels = short[:remaining]
+        else:
+            uncertain = [row for row in self.comparisons() if row['status'] == UNCERTAIN]
+            if not uncertain:
+                return False
+            labels = self._allocate(uncertain, min(self._wave_size, remaining))
+            if not labels:
+                return False
+        self._run_wave(labels)
+        comparisons = self.comparisons()
+        self.history.append({
+            'wave': len(self.history),
+            'runs': labels,
+            'runs_used': self.runs_used,
+            'comparisons': comparisons,
+        })
+        self._write_decisions(comparisons)
+        return any(row['status'] == UNCERTAIN for row in comparisons) and self.runs_used < self._budget
+
+    def run(self) -> Dict[str, Any]:
+        """Run waves until every comparison is resolved or the budget is spent."""
+        while self.step():
+            pass
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        """Return the replicate counts, the final comparisons and the budget used."""
+        return {
+            'runs_used': self.runs_used,
+            'budget': self._budget,
+            'alpha_per_look': self.alpha_per_look,
+            'replicates': {label: len(runs) for label, runs in self._results.items()},
+            'comparisons': self.comparisons(),
+        }
+
+    def _write_decisions(self, comparisons: List[Dict[str, Any]]) -> None:
+        if not self._output_dir:
+            return
+        os.makedirs(self._output_dir, exist_ok=True)
+        with open(os.path.join(self._output_dir, 'decisions.json'), 'w', encoding='utf-8') as f:
+            json.dump({**self.report(), 'comparisons': comparisons, 'waves': len(self.history)}, f, indent=2)
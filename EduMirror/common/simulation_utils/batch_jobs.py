@@ -0,0 +1,339 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deferred execution of post-hoc model calls as provider batch jobs.
+
+Rubric judging, questionnaire answering over archived transcripts and comic
+narrative structuring do not need interactive latency. A `BatchJob` collects
+their prompts instead of calling the model, writes them to a batch input
+JSONL file (OpenAI batch format: one `{"custom_id", "method", "url", "body"}`
+request per line), submits the file through a `BatchBackend`, polls until the
+job finishes and returns the completions by `custom_id`:
+
+- `OpenAIBatchBackend` uploads the file to the Batch API of an
+  OpenAI-compatible endpoint (batch-tier price and rate limits)
+- `LocalBatchBackend` answers the requests with an ordinary language model,
+  e.g. `FakeLanguageModel` in tests or a local server
+
+The job id is saved next to the input file, so a rerun after an interruption
+polls the submitted job instead of submitting it again. A run that returns
+clears the queued prompts, so the same `BatchJob` can collect the next batch;
+one that raises keeps them for a retry. Saved jobs and cached
+results are matched by a hash of each request body as well as its
+`custom_id`, so a rerun with other prompts under the same ids is submitted
+afresh.
+
+Usage:
+    job = BatchJob(create_batch_backend(config), 'results/batch', name='ratings')
+    df = rater.judge_transcript(transcript, rubric, batch=job)
+"""
+
+import abc
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, Mapping, Optional
+
+from concordia.language_model import language_model
+
+from .model_setup import ModelConfig, create_language_model
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+
+# Batch states after which no more results will arrive.
+FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def batch_request_line(custom_id: str, model_name: str, prompt: str, max_tokens: int,
+                       temperature: float) -> Dict[str, Any]:
+    """Return one batch input request for a single-message chat completion."""
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': model_name,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+        },
+    }
+
+
+def request_hash(request: Mapping[str, Any]) -> str:
+    """Hash of a batch request's body (model, prompt and sampling settings)."""
+    body = json.dumps(request['body'], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def parse_batch_output(lines: Any) -> Dict[str, Optional[str]]:
+    """Map `custom_id` to completion text for batch output lines (None on error)."""
+    results: Dict[str, Optional[str]] = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        body = response.get('body') or {}
+        try:
+            results[record['custom_id']] = body['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            results[record['custom_id']] = None
+    return results
+
+
+class BatchBackend(abc.ABC):
+    """Submits batch input files and returns their results."""
+
+    model_name: str = ''
+
+    @abc.abstractmethod
+    def submit(self, input_path: str) -> str:
+        """Submit the requests in `input_path` and return the job id."""
+
+    @abc.abstractmethod
+    def status(self, job_id: str) -> str:
+        """Return the job state, e.g. 'in_progress' or one of FINAL_STATES."""
+
+    @abc.abstractmethod
+    def results(self, job_id: str) -> Dict[str, Optional[str]]:
+        """Return the completion text by `custom_id` of a completed job."""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Backend for the Batch API of an OpenAI-compatible endpoint."""
+
+    def __init__(self, client: Any, model_name: str, completion_window: str = '24h'):
+        """Initialize the backend.
+
+        Args:
+            client: An `openai.OpenAI` client
+            model_name: Model the requests are sent to
+            completion_window: Batch completion window
+        """
+        self._client = client
+        self.model_name = model_name
+        self._completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, 'rb') as f:
+            uploaded = self._client.files.create(file=f, purpose='batch')
+        batch = self._client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self._completion_window,
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        return self._client.batches.retrieve(job_id).status
+
+    def results(self, job_id: str) -> Dict[str, Optional[str]]:
+        batch = self._client.batches.retrieve(job_id)
+        if not batch.output_file_id:
+            return {}
+        content = self._client.files.content(batch.output_file_id)
+        return parse_batch_output(content.text.splitlines())
+
+
+class LocalBatchBackend(BatchBackend):
+    """Answers batch files with a language model; a stand-in for tests."""
+
+    def __init__(self, model: language_model.LanguageModel, output_dir: Optional[str] = None):
+        """Initialize the backend.
+
+        Args:
+            model: The model answering each request
+            output_dir: Where output files are written; defaults to the
+                directory of each input file
+        """
+        self._model = model
+        self.model_name = getattr(model, 'model_name', '') or type(model).__name__
+        self._output_dir = output_dir
+
+    def submit(self, input_path: str) -> str:
+        # The job id is the output path, so a resumed job is found again.
+        directory = self._output_dir or os.path.dirname(os.path.abspath(input_path))
+        output_path = os.path.join(directory, f'local_batch_{uuid.uuid4().hex[:12]}_output.jsonl')
+        with open(input_path, 'r', encoding='utf-8') as f, open(output_path, 'w', encoding='utf-8') as out:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                body = request['body']
+                record: Dict[str, Any] = {'id': uuid.uuid4().hex, 'custom_id': request['custom_id'], 'error': None}
+                try:
+                    text = self._model.sample_text(
+                        body['messages'][-1]['content'],
+                        max_tokens=body.get('max_tokens', language_model.DEFAULT_MAX_TOKENS),
+                        temperature=body.get('temperature', language_model.DEFAULT_TEMPERATURE),
+                    )
+                    record['response'] = {'status_code': 200, 'body': {
+                        'model': self.model_name,
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}}],
+                    }}
+                except Exception as e:
+                    record['response'] = None
+                    record['error'] = {'message': repr(e)}
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return output_path
+
+    def status(self, job_id: str) -> str:
+        return 'completed' if os.path.exists(job_id) else 'failed'
+
+    def results(self, job_id: str) -> Dict[str, Optional[str]]:
+        with open(job_id, 'r', encoding='utf-8') as f:
+            return parse_batch_output(f)
+
+
+def create_batch_backend(config: Optional[ModelConfig] = None) -> BatchBackend:
+    """Return the Batch API backend for `config`, or a local one.
+
+    OpenAI-compatible configs get an `OpenAIBatchBackend`; other APIs and
+    `disable_language_model` configs answer locally with the configured model.
+    """
+    config = config or ModelConfig(disable_language_model=True)
+    if config.api_type == 'openai' and not config.disable_language_model:
+        import openai
+        client = openai.OpenAI(api_key=config.api_key, base_url=config.base_url)
+        return OpenAIBatchBackend(client, config.model_name)
+    return LocalBatchBackend(create_language_model(config))
+
+
+class BatchJob:
+    """Collects prompts and runs them as one batch job."""
+
+    def __init__(
+        self,
+        backend: BatchBackend,
+        work_dir: str,
+        name: str = 'batch',
+        poll_interval: float = 30.0,
+        timeout: Optional[float] = None,
+    ):
+        """Initialize the job.
+
+        Args:
+            backend: Where the batch is submitted
+            work_dir: Directory for the input, job and result files
+            name: Prefix of those files; one name per batch in `work_dir`
+            poll_interval: Seconds between status checks
+            timeout: Seconds to wait for the job; None waits until it finishes
+        """
+        self.backend = backend
+        self.name = name
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        os.makedirs(work_dir, exist_ok=True)
+        self.input_path = os.path.join(work_dir, f'{name}_input.jsonl')
+        self.results_path = os.path.join(work_dir, f'{name}_results.jsonl')
+        self._job_path = os.path.join(work_dir, f'{name}_job.json')
+        self._requests: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def add(self, custom_id: str, prompt: str, max_tokens: int = 1000, temperature: float = 0.0) -> str:
+        """Queue one prompt; `custom_id` identifies its completion in `run()`."""
+        if custom_id in self._requests:
+            raise ValueError(f'Duplicate batch request id: {custom_id}')
+        self._requests[custom_id] = batch_request_line(
+            custom_id, self.backend.model_name, prompt, max_tokens, temperature)
+        return custom_id
+
+    def run(self) -> Dict[str, Optional[str]]:
+        """Submit the queued prompts (or resume the submitted job) and wait.
+
+        The queue is emptied once the results are returned; it is kept when
+        the run raises, so calling `run()` again resumes the job.
+
+        Returns:
+            Completion text by `custom_id`; None for requests that failed
+
+        Raises:
+            RuntimeError: If the job ends in a state other than 'completed'
+            TimeoutError: If the job does not finish within `timeout`
+        """
+        hashes = {key: request_hash(request) for key, request in self._requests.items()}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, 'r', encoding='utf-8') as f:
+                cached = {(r['custom_id'], r.get('hash')): r['text'] for r in map(json.loads, f)}
+            if all(item in cached for item in hashes.items()):
+                self._requests = {}
+                return {key: cached[key, digest] for key, digest in hashes.items()}
+        job_id = self._resume_job_id(hashes)
+        if job_id is None:
+            if not self._requests:
+                return {}
+            with open(self.input_path, 'w', encoding='utf-8') as f:
+                for request in self._requests.values():
+                    f.write(json.dumps(request, ensure_ascii=False) + '\n')
+            job_id = self.backend.submit(self.input_path)
+            with open(self._job_path, 'w', encoding='utf-8') as f:
+                json.dump({'job_id': job_id, 'requests': hashes}, f)
+        state = self._wait(job_id)
+        if state != 'completed':
+            raise RuntimeError(f'Batch job {job_id} ended as {state}')
+        results = self.backend.results(job_id)
+        with open(self.results_path, 'w', encoding='utf-8') as f:
+            for key, text in results.items():
+                f.write(json.dumps({'custom_id': key, 'hash': hashes.get(key), 'text': text},
+                                   ensure_ascii=False) + '\n')
+        answers = {key: results.get(key) for key in self._requests}
+        self._requests = {}
+        return answers
+
+    def _resume_job_id(self, hashes: Mapping[str, str]) -> Optional[str]:
+        try:
+            with open(self._job_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('requests') != dict(hashes):
+            return None
+        return saved.get('job_id')
+
+    def _wait(self, job_id: str) -> str:
+        start = time.monotonic()
+        while True:
+            state = self.backend.status(job_id)
+            if state in FINAL_STATES:
+                return state
+            if self._timeout is not None and time.monotonic() - start > self._timeout:
+                raise TimeoutError(f'Batch job {job_id} still {state} after {self._timeout}s')
+            time.sleep(self._poll_interval)
+
+
+def run_prompts(prompts: Mapping[str, str], model: Any = None, batch: Optional[BatchJob] = None,
+                max_tokens: int = 1000) -> Dict[str, Optional[str]]:
+    """Answer `prompts` (id -> prompt) through `batch`, or one by one with `model`.
+
+    Without a batch, a prompt whose call fails is logged and answered with
+    None, so the other prompts still get their answers.
+    """
+    if batch is not None:
+        for key, prompt in prompts.items():
+            batch.add(key, prompt, max_tokens=max_tokens)
+        return batch.run()
+    results: Dict[str, Optional[str]] = {}
+    for key, prompt in prompts.items():
+        try:
+            results[key] = model.sample_text(prompt, max_tokens=max_tokens)
+        except Exception as e:
+            print(f'[Batch Jobs] prompt {key} failed: {e!r}')
+            results[key] = None
+    return results
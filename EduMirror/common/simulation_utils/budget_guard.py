@@ -0,0 +1,565 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Spend and token budgets enforced in the model layer.
+
+A `BudgetGuard` prices every call made through `create_language_model(...,
+budget=guard)` from its token counts and `PRICE_TABLE`, and tracks the
+running cost of the job and, through a shared ledger directory, of every job
+of the sweep. When the spent fraction of a limit crosses a threshold it
+
+- 'warn': prints and emits a `budget_threshold` event
+- 'degrade': switches the call-site router to `degrade_routes`, e.g. every
+  tag to a nano model (see model_router.py)
+- 'pause': runs the `on_pause` callbacks (`InterventionScenarioRunner` saves
+  its checkpoint there) and makes every further call raise
+  `BudgetExceededError`. Before each call the guard also checks that the
+  call cannot cross the limit, counting its prompt and `max_tokens`.
+
+Each guard writes its totals per (scenario, condition) to
+`<ledger_dir>/<job_id>.json` (`<job_id>.<n>.json` for later attempts);
+`spend_report` sums the ledger.
+
+Workers started with a budget (`work_queue worker --budget '{"limit_usd": 20}'`)
+give each job a guard, put a paused job back in the queue, stop leasing once
+the sweep's budget is spent and write `<work_root>/spend_report.csv`. A job
+paused by its own `job_limit_usd` counts as a failed attempt instead, and the
+worker goes on leasing.
+
+Example:
+    guard = BudgetGuard(limit_usd=5.0, degrade_routes={'default': 'gpt-4.1-nano'},
+                        scenario='the_spread_of_gossip', condition='baseline')
+    model = create_language_model(config, budget=guard)
+    ...  # build agents and run the simulation
+    guard.close()
+    print(spend_report(guard.ledger_dir))
+"""
+
+import json
+import os
+import re
+import socket
+import threading
+import time
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from concordia.language_model import language_model
+from concordia.language_model import no_language_model
+
+from .choice_scoring import ChoiceScoringLanguageModel
+from .llm_telemetry import count_tokens, emit_event
+
+WARN = 'warn'
+DEGRADE = 'degrade'
+PAUSE = 'pause'
+ACTIONS = (WARN, DEGRADE, PAUSE)
+
+DEFAULT_THRESHOLDS = ((0.5, WARN), (0.8, DEGRADE), (1.0, PAUSE))
+
+# USD per million (input, output) tokens.
+PRICE_TABLE: Dict[str, Tuple[float, float]] = {
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1-nano': (0.10, 0.40),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4': (30.00, 60.00),
+    'gpt-5': (1.25, 10.00),
+    'gpt-5-mini': (0.25, 2.00),
+    'gpt-5-nano': (0.05, 0.40),
+    'o3': (2.00, 8.00),
+    'o3-mini': (1.10, 4.40),
+    'o4-mini': (1.10, 4.40),
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'mistral-large-latest': (2.00, 6.00),
+    'mistral-small-latest': (0.10, 0.30),
+}
+
+# Unknown models are billed like a large model rather than for free.
+DEFAULT_PRICE = PRICE_TABLE['gpt-4.1']
+
+# Suffixes of dated snapshots ('-2025-04-14', '-0613') and aliases ('-latest', '-preview').
+_SNAPSHOT_SUFFIX = re.compile(r'-(\d[\d-]*|latest|preview(-[\d-]+)?)')
+
+# Attempts of the free-text `sample_choice` protocol, as in concordia's models.
+CHOICE_ATTEMPTS = 20
+
+_active_budget: Optional['BudgetGuard'] = None
+
+
+class BudgetExceededError(RuntimeError):
+    """Raised for model calls made after the budget guard paused the run."""
+
+
+def get_active_budget() -> Optional['BudgetGuard']:
+    """Returns the guard `create_language_model` uses when given none."""
+    return _active_budget
+
+
+def set_active_budget(guard: Optional['BudgetGuard']) -> None:
+    """Sets the guard `create_language_model` uses when given none."""
+    global _active_budget
+    _active_budget = guard
+
+
+def model_price(model_name: str, price_table: Mapping[str, Tuple[float, float]] = PRICE_TABLE
+                ) -> Optional[Tuple[float, float]]:
+    """Return the (input, output) USD per million tokens of `model_name`.
+
+    Provider-prefixed names ('openai/gpt-4.1') and dated snapshots
+    ('gpt-4.1-mini-2025-04-14') match their table entry; other variants
+    ('o3-mini' when only 'o3' is listed) are unpriced.
+    """
+    name = (model_name or '').rsplit('/', 1)[-1]
+    if name in price_table:
+        return tuple(price_table[name])
+    matches = [key for key in price_table
+               if name.startswith(key) and _SNAPSHOT_SUFFIX.fullmatch(name[len(key):])]
+    return tuple(price_table[max(matches, key=len)]) if matches else None
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0}
+
+
+class BudgetGuard:
+    """Thread-safe spend tracker with warn/degrade/pause thresholds."""
+
+    def __init__(
+        self,
+        limit_usd: Optional[float] = None,
+        job_limit_usd: Optional[float] = None,
+        limit_tokens: Optional[int] = None,
+        thresholds: Sequence[Tuple[float, str]] = DEFAULT_THRESHOLDS,
+        degrade_routes: Optional[Mapping[str, Any]] = None,
+        price_table: Optional[Mapping[str, Tuple[float, float]]] = None,
+        ledger_dir: Optional[str] = None,
+        job_id: Optional[str] = None,
+        scenario: str = '',
+        condition: str = '',
+        sync_interval: float = 5.0,
+    ):
+        """Initialize the guard.
+
+        Args:
+            limit_usd: Spend limit of all jobs sharing `ledger_dir`
+            job_limit_usd: Spend limit of this job alone
+            limit_tokens: Prompt plus completion token limit of all jobs
+            thresholds: (fraction of the limit, action) pairs; actions are
+                'warn', 'degrade' and 'pause'
+            degrade_routes: Routes used after 'degrade', in the format of
+                `ModelConfig.routes`; the key 'default' replaces the model of
+                untagged calls and of every tag not listed
+            price_table: Entries added to `PRICE_TABLE`
+            ledger_dir: Directory shared by the jobs of a sweep; None keeps
+                the totals in memory
+            job_id: Name of this guard's ledger file; defaults to host-pid
+            scenario: Scenario the spend is reported under
+            condition: Condition the spend is reported under (see
+                `set_context`)
+            sync_interval: Seconds between ledger writes and reads
+        """
+        for _, action in thresholds:
+            if action not in ACTIONS:
+                raise ValueError(f'Budget action must be one of {ACTIONS}, got {action!r}')
+        self.limit_usd = limit_usd
+        self.job_limit_usd = job_limit_usd
+        self.limit_tokens = limit_tokens
+        self.thresholds = sorted((float(f), a) for f, a in thresholds)
+        self.degrade_routes = dict(degrade_routes or {})
+        self.price_table = {**PRICE_TABLE, **{k: tuple(v) for k, v in (price_table or {}).items()}}
+        self.ledger_dir = ledger_dir
+        self.job_id = job_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.scenario = scenario
+        self.condition = condition
+        self._sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._totals = _empty_totals()
+        self._by_model: Dict[str, Dict[str, Any]] = {}
+        self._by_context: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._others = _empty_totals()
+        self._last_sync = 0.0
+        self._ledger_path: Optional[str] = None
+        self._fired: set = set()
+        self._unpriced: set = set()
+        self._degrade_callbacks: List[Callable[[], None]] = []
+        self._pause_callbacks: List[Callable[[], None]] = []
+        self.degraded = False
+        self.paused = False
+        self.pause_reason = ''
+        # 'job' when only `job_limit_usd` paused the guard, 'shared' otherwise.
+        self.pause_scope = ''
+
+    @property
+    def cost_usd(self) -> float:
+        return self._totals['cost_usd']
+
+    @property
+    def global_cost_usd(self) -> float:
+        return self._totals['cost_usd'] + self._others['cost_usd']
+
+    def set_context(self, scenario: Optional[str] = None, condition: Optional[str] = None) -> None:
+        """Report the following calls under another scenario or condition."""
+        with self._lock:
+            if scenario is not None:
+                self.scenario = scenario
+            if condition is not None:
+                self.condition = condition
+
+    def on_degrade(self, callback: Callable[[], None]) -> None:
+        """Call `callback` when 'degrade' fires (at once if it already has)."""
+        self._degrade_callbacks.append(callback)
+        if self.degraded:
+            callback()
+
+    def on_pause(self, callback: Callable[[], None]) -> None:
+        """Call `callback` when 'pause' fires, before calls start failing."""
+        self._pause_callbacks.append(callback)
+
+    def price(self, model_name: str, price: Optional[Tuple[float, float]] = None) -> Tuple[float, float]:
+        if price is not None:
+            return price
+        found = model_price(model_name, self.price_table)
+        if found is None:
+            if model_name not in self._unpriced:
+                self._unpriced.add(model_name)
+                print(f'[Budget Guard] no price for {model_name!r}, using {DEFAULT_PRICE} USD/1M tokens')
+            return DEFAULT_PRICE
+        return found
+
+    def _fraction(self, extra_cost: float = 0.0, extra_tokens: int = 0, job: bool = True) -> float:
+        fractions = [0.0]
+        if self.limit_usd:
+            fractions.append((self.global_cost_usd + extra_cost) / self.limit_usd)
+        if job and self.job_limit_usd:
+            fractions.append((self.cost_usd + extra_cost) / self.job_limit_usd)
+        if self.limit_tokens:
+            tokens = sum(t['prompt_tokens'] + t['completion_tokens'] for t in (self._totals, self._others))
+            fractions.append((tokens + extra_tokens) / self.limit_tokens)
+        return max(fractions)
+
+    def fraction(self) -> float:
+        """Largest spent fraction of the configured limits."""
+        with self._lock:
+            return self._fraction()
+
+    def _pause_fraction(self) -> Optional[float]:
+        return next((f for f, a in self.thresholds if a == PAUSE), None)
+
+    def _pause_scope(self, extra_cost: float = 0.0, extra_tokens: int = 0) -> str:
+        limit = self._pause_fraction()
+        shared = self._fraction(extra_cost, extra_tokens, job=False)
+        return 'shared' if limit is not None and shared >= limit else 'job'
+
+    def check(self, model_name: str, prompt_tokens: int, max_tokens: int = 0,
+              price: Optional[Tuple[float, float]] = None) -> None:
+        """Raise `BudgetExceededError` if a call of this size may not be made."""
+        input_price, output_price = self.price(model_name, price)
+        with self._lock:
+            self._maybe_sync()
+            estimate = (prompt_tokens * input_price + max_tokens * output_price) / 1e6
+            if not self.paused:
+                limit = self._pause_fraction()
+                if limit is None or self._fraction(estimate, prompt_tokens + max_tokens) < limit:
+                    return
+            fire = PAUSE not in self._fired
+            self._fired.add(PAUSE)
+            fraction = self._fraction()
+            if fire:
+                self.pause_scope = self._pause_scope(estimate, prompt_tokens + max_tokens)
+        if fire:
+            self._fire(PAUSE, fraction, 'the next call could exceed the budget')
+        raise BudgetExceededError(self.pause_reason or 'budget paused')
+
+    def charge(self, model_name: str, prompt_tokens: int, completion_tokens: int,
+               price: Optional[Tuple[float, float]] = None) -> float:
+        """Record a finished call; returns its cost in USD."""
+        input_price, output_price = self.price(model_name, price)
+        cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1e6
+        with self._lock:
+            context = self._by_context.setdefault((self.scenario, self.condition), _empty_totals())
+            for totals in (self._totals, context, self._by_model.setdefault(model_name, _empty_totals())):
+                totals['calls'] += 1
+                totals['prompt_tokens'] += prompt_tokens
+                totals['completion_tokens'] += completion_tokens
+                totals['cost_usd'] += cost
+            self._maybe_sync()
+            fraction = self._fraction()
+            due = [a for f, a in self.thresholds if fraction >= f and a not in self._fired]
+            self._fired.update(due)
+            if PAUSE in due:
+                self.pause_scope = self._pause_scope()
+        for action in due:
+            self._fire(action, fraction)
+        return cost
+
+    def _fire(self, action: str, fraction: float, reason: str = '') -> None:
+        print(f'[Budget Guard] {action} at {fraction:.0%} of budget: ${self.cost_usd:.4f} this job, '
+              f'${self.global_cost_usd:.4f} total')
+        emit_event('budget_threshold', action=action, fraction=fraction, cost_usd=self.cost_usd,
+                   global_cost_usd=self.global_cost_usd, job_id=self.job_id)
+        if action == DEGRADE and not self.degraded:
+            self.degraded = True
+            for callback in list(self._degrade_callbacks):
+                callback()
+        elif action == PAUSE and not self.paused:
+            scope = 'job budget' if self.pause_scope == 'job' else 'budget'
+            self.pause_reason = (f'{scope} paused at {fraction:.0%} ({reason or "limit reached"}); '
+                                 f'${self.global_cost_usd:.4f} spent')
+            for callback in list(self._pause_callbacks):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f'[Budget Guard] pause callback failed: {e!r}')
+            self.paused = True
+            self.sync('paused')
+
+    def exhausted(self) -> bool:
+        """Re-read the ledger; whether the shared budget reached its pause threshold.
+
+        `job_limit_usd` does not count: it pauses this guard's job only.
+        """
+        self.sync()
+        with self._lock:
+            return self._pause_scope() == 'shared'
+
+    def _new_ledger_path(self) -> str:
+        # A resumed job keeps the spend of its earlier attempts in their files.
+        path = os.path.join(self.ledger_dir, f'{self.job_id}.json')
+        attempt = 1
+        while os.path.exists(path):
+            path = os.path.join(self.ledger_dir, f'{self.job_id}.{attempt}.json')
+            attempt += 1
+        return path
+
+    def _maybe_sync(self) -> None:
+        if self.ledger_dir and time.time() - self._last_sync >= self._sync_interval:
+            self._sync_locked()
+
+    def sync(self, status: Optional[str] = None) -> None:
+        """Write this guard's totals to the ledger and read the other jobs'."""
+        with self._lock:
+            self._sync_locked(status)
+
+    def _sync_locked(self, status: Optional[str] = None) -> None:
+        self._last_sync = time.time()
+        if not self.ledger_dir:
+            return
+        os.makedirs(self.ledger_dir, exist_ok=True)
+        if self._totals['calls'] or status:
+            if self._ledger_path is None:
+                self._ledger_path = self._new_ledger_path()
+            record = self._record(status or ('paused' if self.paused else 'running'))
+            tmp = f'{self._ledger_path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(record, f, indent=2)
+            os.replace(tmp, self._ledger_path)
+        others = _empty_totals()
+        for record in load_ledger(self.ledger_dir, exclude=self._ledger_path):
+            for key in others:
+                others[key] += record.get(key, 0)
+        self._others = others
+
+    def _record(self, status: str) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'status': status,
+            **self._totals,
+            'by_model': self._by_model,
+            'conditions': [{'scenario': s, 'condition': c, **totals}
+                           for (s, c), totals in self._by_context.items()],
+            'updated': time.time(),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """This guard's totals per model and per (scenario, condition)."""
+        with self._lock:
+            return {**self._record('paused' if self.paused else 'running'),
+                    'global_cost_usd': self.global_cost_usd, 'degraded': self.degraded}
+
+    def close(self) -> Dict[str, Any]:
+        """Write the final totals to the ledger; returns `summary()`."""
+        self.sync('paused' if self.paused else 'done')
+        return self.summary()
+
+
+class BudgetedLanguageModel(language_model.LanguageModel):
+    """Wraps a language model and charges every call to a `BudgetGuard`."""
+
+    def __init__(
+        self,
+        model: language_model.LanguageModel,
+        guard: BudgetGuard,
+        model_name: str = '',
+        price: Optional[Tuple[float, float]] = None,
+    ):
+        """Wrap `model`.
+
+        Args:
+            model: The language model to meter
+            guard: Guard charged for each call
+            model_name: Model looked up in the guard's price table
+            price: (input, output) USD per million tokens overriding the table
+        """
+        self._model = model
+        self.guard = guard
+        self._model_name = model_name
+        self._price = price
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def sample_text(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = language_model.DEFAULT_MAX_TOKENS,
+        terminators: Collection[str] = language_model.DEFAULT_TERMINATORS,
+        temperature: float = language_model.DEFAULT_TEMPERATURE,
+        timeout: float = language_model.DEFAULT_TIMEOUT_SECONDS,
+        seed: int | None = None,
+    ) -> str:
+        prompt_tokens = count_tokens(prompt)
+        self.guard.check(self._model_name, prompt_tokens, max_tokens, self._price)
+        text = self._model.sample_text(
+            prompt,
+            max_tokens=max_tokens,
+            terminators=terminators,
+            temperature=temperature,
+            timeout=timeout,
+            seed=seed,
+        )
+        self.guard.charge(self._model_name, prompt_tokens, count_tokens(text), self._price)
+        return text
+
+    def sample_choice(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        *,
+        seed: int | None = None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        scorer = _find_wrapped(self._model, ChoiceScoringLanguageModel)
+        if scorer is None and _find_wrapped(self._model, no_language_model.NoLanguageModel) is None:
+            return self._sample_choice_as_text(prompt, responses, seed)
+        prompt_tokens = count_tokens(prompt) + sum(count_tokens(r) for r in responses)
+        self.guard.check(self._model_name, prompt_tokens, 0, self._price)
+        first_request = scorer.requests_made() if scorer is not None else 0
+        answer_tokens = 0
+        try:
+            result = self._model.sample_choice(prompt, responses, seed=seed)
+            answer_tokens = count_tokens(result[1])
+        finally:
+            # Failed methods and retried choices are billed too.
+            calls = scorer.requests_made() - first_request if scorer is not None else 1
+            for _ in range(calls):
+                self.guard.charge(self._model_name, prompt_tokens, answer_tokens, self._price)
+        return result
+
+    def _sample_choice_as_text(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        seed: int | None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        # Concordia's models answer a choice by re-asking for free text, which
+        # this wrapper cannot see; asking here checks and charges each attempt.
+        prompt = prompt + '\nRespond EXACTLY with one of the following strings:\n' + '\n'.join(responses) + '.'
+        max_tokens = max(count_tokens(r) for r in responses) + 16
+        answer = ''
+        for attempt in range(CHOICE_ATTEMPTS):
+            answer = self.sample_text(prompt, max_tokens=max_tokens, temperature=1.0, seed=seed).strip()
+            if answer in responses:
+                return list(responses).index(answer), answer, {'attempts': attempt + 1}
+        raise language_model.InvalidResponseError(
+            f'Too many multiple choice attempts.\nLast attempt: {answer}')
+
+
+def _find_wrapped(model: Any, cls: type) -> Any:
+    """Return the first model of type `cls` among `model` and its `_model` wrappees."""
+    while model is not None:
+        if isinstance(model, cls):
+            return model
+        model = getattr(model, '_model', None)
+    return None
+
+
+def load_ledger(ledger_dir: str, exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Return the records of every guard that wrote to `ledger_dir`, except `exclude`."""
+    records = []
+    if not os.path.isdir(ledger_dir):
+        return records
+    for name in sorted(os.listdir(ledger_dir)):
+        if not name.endswith('.json') or os.path.join(ledger_dir, name) == exclude:
+            continue
+        try:
+            with open(os.path.join(ledger_dir, name), 'r', encoding='utf-8') as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            # Partially written by another process; it is rewritten shortly.
+            continue
+    return records
+
+
+def spend_report(ledger_dir: str) -> Any:
+    """Spend per scenario and condition, summed over the ledger's jobs.
+
+    Returns:
+        DataFrame with scenario, condition, jobs, paused_attempts, calls,
+        prompt_tokens, completion_tokens and cost_usd columns
+    """
+    import pandas as pd
+
+    rows = [{'job_id': record['job_id'], 'paused': record.get('status') == 'paused', **entry}
+            for record in load_ledger(ledger_dir) for entry in record.get('conditions', [])]
+    columns = ['scenario', 'condition', 'jobs', 'paused_attempts', 'calls',
+               'prompt_tokens', 'completion_tokens', 'cost_usd']
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    frame = pd.DataFrame(rows)
+    report = frame.groupby(['scenario', 'condition'], as_index=False).agg(
+        jobs=('job_id', 'nunique'),
+        paused_attempts=('paused', 'sum'),
+        calls=('calls', 'sum'),
+        prompt_tokens=('prompt_tokens', 'sum'),
+        completion_tokens=('completion_tokens', 'sum'),
+        cost_usd=('cost_usd', 'sum'),
+    )
+    return report[columns]
+
+
+def write_spend_report(ledger_dir: str, path: str) -> str:
+    """Write `spend_report` as CSV; returns the path."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    spend_report(ledger_dir).to_csv(path, index=False)
+    return path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Spend report of a budget ledger')
+    parser.add_argument('ledger_dir')
+    parser.add_argument('--output', default=None, help='CSV path; prints the table when omitted')
+    args = parser.parse_args()
+    if args.output:
+        print(f'[Budget Guard] report written to {write_spend_report(args.ledger_dir, args.output)}')
+    else:
+        print(spend_report(args.ledger_dir).to_string(index=False))
@@ -0,0 +1,323 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Multiple-choice answers scored from token log-probabilities.
+
+Concordia's OpenAI models answer `sample_choice` by generating free text and
+re-asking (up to 20 times) until it equals one of the responses. Desire
+ratings, yes/no checks and questionnaire items all go through it.
+`ChoiceScoringLanguageModel` answers each choice with one short request
+instead, using the first method the backend supports:
+
+1. 'logprobs': a one-token completion with `top_logprobs`. Each response
+   scores the probability of the tokens that spell it, and the answer is the
+   most likely response.
+2. 'schema': a completion constrained to a JSON schema whose `answer` is an
+   enum of the responses (OpenAI structured outputs, vLLM guided decoding).
+3. 'prompt': a few-token `sample_text` call, matched strictly against the
+   responses. Unusable answers raise `InvalidResponseError`, which
+   `RoutedLanguageModel` escalates, rather than falling through silently.
+
+A method the endpoint rejects (HTTP 400 or no logprobs in the response) is
+not tried again by the same model. Every answer is published as a
+`choice_scored` event with the method and the full response distribution,
+and is returned in the `sample_choice` debug dict together with the number
+of `requests` it took.
+
+Enable it with `ModelConfig(..., choice_scoring='logprobs')`, or
+'constrained' to skip the logprobs request.
+"""
+
+import math
+import re
+import threading
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from concordia.language_model import language_model
+
+from .llm_telemetry import emit_event
+
+CHOICE_SCORING_MODES = ('logprobs', 'constrained')
+
+_STRIP = '()[]{}.,:;!?"\'*` \t\n'
+
+
+def normalize_choice(text: str) -> str:
+    """Return `text` lower-cased without surrounding brackets and punctuation."""
+    return str(text).strip(_STRIP).lower()
+
+
+def match_choice(text: str, responses: Sequence[str]) -> Optional[int]:
+    """Return the index of the response `text` answers, or None if unclear.
+
+    Accepts the response itself ('b', '(b)', 'Agree.') or a leading key
+    followed by more text ('(b) No.'); anything matching two responses, or
+    none, is rejected. A single-letter key must be bracketed or followed by
+    punctuation ('b. No', 'b: No'), so 'I think...' or 'A friend...' does not
+    answer options i or a.
+    """
+    keys = [normalize_choice(r) for r in responses]
+    answer = normalize_choice(text)
+    if answer in keys:
+        return keys.index(answer)
+    lead = re.match(r'\s*([(\[]?)([^\s()\[\].,:;]+)([)\].,:;]?)', text or '')
+    if lead is None:
+        return None
+    opening, word, closing = lead.groups()
+    if len(word) == 1 and not (opening or closing):
+        return None
+    lead_key = normalize_choice(word)
+    matches = [i for i, key in enumerate(keys) if key == lead_key]
+    return matches[0] if len(matches) == 1 else None
+
+
+def distribution_from_logprobs(
+    top_logprobs: Sequence[Tuple[str, float]],
+    responses: Sequence[str],
+) -> Tuple[List[float], float]:
+    """Turn the first token's top logprobs into a distribution over responses.
+
+    A token counts for a response if it spells the whole response, or the
+    start (two characters or more) of exactly one response. Single-letter
+    responses need the same case, so the words 'I' and 'A' do not count for
+    options i and a.
+
+    Args:
+        top_logprobs: (token, logprob) alternatives for the first token
+        responses: The choices
+
+    Returns:
+        Probabilities per response (summing to 1, all 0 if no token matched)
+        and the probability mass the matched tokens covered
+    """
+    keys = [normalize_choice(r) for r in responses]
+    mass = [0.0] * len(responses)
+    for token, logprob in top_logprobs:
+        token_key = normalize_choice(token)
+        if not token_key:
+            continue
+        matches = [i for i, key in enumerate(keys) if key == token_key and (
+            len(key) > 1 or str(token).strip(_STRIP) == str(responses[i]).strip(_STRIP))]
+        if not matches and len(token_key) > 1:
+            matches = [i for i, key in enumerate(keys) if key.startswith(token_key)]
+        if len(matches) == 1:
+            mass[matches[0]] += math.exp(logprob)
+    covered = sum(mass)
+    if covered <= 0:
+        return mass, 0.0
+    return [m / covered for m in mass], covered
+
+
+def _options_suffix(responses: Sequence[str]) -> str:
+    return '\nRespond with exactly one of the following and nothing else: ' + ', '.join(responses) + '\n'
+
+
+class ChoiceScoringLanguageModel(language_model.LanguageModel):
+    """Answers `sample_choice` in one short request; passes text calls through."""
+
+    def __init__(
+        self,
+        model: language_model.LanguageModel,
+        client: Any = None,
+        model_name: str = '',
+        mode: str = 'logprobs',
+        top_logprobs: int = 20,
+        greedy: bool = True,
+    ):
+        """Initialize the wrapper.
+
+        Args:
+            model: The wrapped model; used for `sample_text` and the 'prompt'
+                fallback
+            client: An `openai.OpenAI` client for the same endpoint; without
+                it only the 'prompt' method is available
+            model_name: Model name sent with the client requests
+            mode: 'logprobs' tries all methods, 'constrained' starts at 'schema'
+            top_logprobs: Alternatives requested for the first token
+            greedy: Answer with the most likely response instead of sampling
+                from the distribution
+        """
+        if mode not in CHOICE_SCORING_MODES:
+            raise ValueError(f'mode must be one of {CHOICE_SCORING_MODES}, got {mode!r}')
+        self._model = model
+        self._client = client
+        self._model_name = model_name or getattr(model, 'model_name', '')
+        self._top_logprobs = top_logprobs
+        self._greedy = greedy
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._unsupported = set() if client is not None else {'logprobs', 'schema'}
+        if mode == 'constrained':
+            self._unsupported.add('logprobs')
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def methods(self) -> List[str]:
+        """Return the scoring methods still tried, in order."""
+        return [m for m in ('logprobs', 'schema', 'prompt') if m not in self._unsupported]
+
+    def requests_made(self) -> int:
+        """Return the requests this thread has sent, including failed choices."""
+        return getattr(self._local, 'requests', 0)
+
+    def _count_request(self) -> None:
+        self._local.requests = self.requests_made() + 1
+
+    def _disable(self, method: str, reason: str) -> None:
+        with self._lock:
+            if method in self._unsupported:
+                return
+            self._unsupported.add(method)
+        emit_event('choice_scoring_unsupported', method=method, model=self._model_name, reason=reason)
+
+    def sample_text(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = language_model.DEFAULT_MAX_TOKENS,
+        terminators: Collection[str] = language_model.DEFAULT_TERMINATORS,
+        temperature: float = language_model.DEFAULT_TEMPERATURE,
+        timeout: float = language_model.DEFAULT_TIMEOUT_SECONDS,
+        seed: int | None = None,
+    ) -> str:
+        return self._model.sample_text(
+            prompt,
+            max_tokens=max_tokens,
+            terminators=terminators,
+            temperature=temperature,
+            timeout=timeout,
+            seed=seed,
+        )
+
+    def sample_choice(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        *,
+        seed: int | None = None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        responses = list(responses)
+        first_request = self.requests_made()
+        for method in self.methods():
+            if method == 'logprobs':
+                probs = self._score_logprobs(prompt, responses, seed)
+                if probs is None:
+                    continue
+                distribution, covered = probs
+                if self._greedy:
+                    idx = int(np.argmax(distribution))
+                else:
+                    idx = int(np.random.default_rng(seed).choice(len(responses), p=distribution))
+                debug = {'method': method, 'coverage': covered}
+            elif method == 'schema':
+                idx = self._constrained_choice(prompt, responses, seed)
+                if idx is None:
+                    continue
+                distribution = [float(i == idx) for i in range(len(responses))]
+                debug = {'method': method}
+            else:
+                text = self._model.sample_text(
+                    prompt + _options_suffix(responses),
+                    max_tokens=max(8, max(len(r) for r in responses) // 2 + 4),
+                    terminators=('\n',),
+                    temperature=0.0,
+                    seed=seed,
+                )
+                self._count_request()
+                idx = match_choice(text, responses)
+                if idx is None:
+                    emit_event('choice_unparsed', model=self._model_name, responses=responses, answer=text)
+                    raise language_model.InvalidResponseError(
+                        f'Answer {text!r} does not match any of {responses}')
+                distribution = [float(i == idx) for i in range(len(responses))]
+                debug = {'method': method, 'raw_answer': text}
+            debug['distribution'] = dict(zip(responses, distribution))
+            debug['requests'] = self.requests_made() - first_request
+            emit_event(
+                'choice_scored',
+                method=method,
+                model=self._model_name,
+                answer=responses[idx],
+                distribution=debug['distribution'],
+            )
+            return idx, responses[idx], debug
+        raise language_model.InvalidResponseError('No choice scoring method available')
+
+    def _request(self, method: str, **kwargs: Any) -> Any:
+        try:
+            response = self._client.chat.completions.create(model=self._model_name, **kwargs)
+        except Exception as e:
+            # Providers answer unsupported parameters with 400; anything else
+            # (rate limits, timeouts) is left to the caller's retries.
+            if getattr(e, 'status_code', None) == 400:
+                self._disable(method, repr(e))
+                return None
+            raise
+        self._count_request()
+        return response
+
+    def _score_logprobs(self, prompt: str, responses: List[str], seed: Optional[int]) -> Optional[Tuple[List[float], float]]:
+        response = self._request(
+            'logprobs',
+            messages=[{'role': 'user', 'content': prompt + _options_suffix(responses)}],
+            max_tokens=1,
+            temperature=0.0,
+            logprobs=True,
+            top_logprobs=self._top_logprobs,
+            seed=seed,
+        )
+        if response is None:
+            return None
+        logprobs = getattr(response.choices[0], 'logprobs', None)
+        content = getattr(logprobs, 'content', None)
+        if not content:
+            self._disable('logprobs', 'response has no logprobs')
+            return None
+        first = content[0]
+        alternatives = [(t.token, t.logprob) for t in (first.top_logprobs or [])]
+        alternatives = alternatives or [(first.token, first.logprob)]
+        distribution, covered = distribution_from_logprobs(alternatives, responses)
+        if covered <= 0:
+            # The model opened with something else (e.g. 'The'); let the
+            # constrained methods answer this one.
+            emit_event('choice_logprobs_unmatched', model=self._model_name, responses=responses,
+                       tokens=[t for t, _ in alternatives])
+            return None
+        return distribution, covered
+
+    def _constrained_choice(self, prompt: str, responses: List[str], seed: Optional[int]) -> Optional[int]:
+        schema = {
+            'type': 'object',
+            'properties': {'answer': {'type': 'string', 'enum': responses}},
+            'required': ['answer'],
+            'additionalProperties': False,
+        }
+        response = self._request(
+            'schema',
+            messages=[{'role': 'user', 'content': prompt + _options_suffix(responses)}],
+            temperature=0.0,
+            max_tokens=16 + max(len(r) for r in responses),
+            response_format={'type': 'json_schema', 'json_schema': {'name': 'choice', 'strict': True, 'schema': schema}},
+            seed=seed,
+        )
+        if response is None:
+            return None
+        content = response.choices[0].message.content or ''
+        match = re.search(r'"answer"\s*:\s*"((?:[^"\\]|\\.)*)"', content)
+        answer = match.group(1) if match else content
+        return match_choice(answer, responses)
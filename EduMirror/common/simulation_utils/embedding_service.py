@@ -0,0 +1,400 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-host embedding service shared by all workers.
+
+Parallel branches and scenario workers embed the same shared memories, scene
+premises and rubric texts over and over, each with its own embedder. An
+`EmbeddingServer` runs once per host and owns the only embedder:
+
+- Workers connect over a Unix socket (`multiprocessing.connection`, socket
+  file mode 0600).
+- Requests arriving within `batch_window` seconds are merged, deduplicated and
+  embedded in one call to `batch_embedder` (e.g. one OpenAI embeddings request
+  for many texts).
+- Every vector is stored once, as a float32 row of a shared-memory slab.
+  Replies carry only row numbers; clients return read-only numpy views into
+  the slab, so vectors are never copied between processes.
+- The slab grows in segments of `chunk_rows` rows, each reserved in full
+  when it is created, so a small /dev/shm (common in containers) fails at
+  that point instead of crashing a later write. Vectors beyond `capacity`,
+  or that no segment could be reserved for, are sent over the socket instead.
+
+Start the service, then point workers at it:
+    python -m common.simulation_utils.embedding_service --socket /tmp/edumirror_embed.sock --embedder openai
+    embedder = model_setup.create_service_embedder('/tmp/edumirror_embed.sock')
+"""
+
+import argparse
+import hashlib
+import os
+import queue
+import threading
+import time
+from multiprocessing import connection, resource_tracker, shared_memory
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EMBEDDING_SOCKET_ENV = 'EDUMIRROR_EMBEDDING_SOCKET'
+DEFAULT_SOCKET = '/tmp/edumirror_embed.sock'
+
+
+def _key(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# Names of the segments created by servers in this process; a client in the
+# same process must leave their resource-tracker registration alone.
+_OWNED_SEGMENTS: set = set()
+
+
+def _reserve(shm: shared_memory.SharedMemory) -> None:
+    # ftruncate leaves tmpfs pages unallocated, and a full /dev/shm then
+    # raises SIGBUS on the first write; allocating now raises OSError instead.
+    fd = getattr(shm, '_fd', -1)
+    if fd >= 0 and hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, shm.size)
+
+
+class _Slab:
+    """Float32 matrix in shared memory, grown in segments of `chunk_rows` rows."""
+
+    def __init__(self, dim: int, capacity: int, chunk_rows: int):
+        self.dim = dim
+        self.capacity = capacity
+        self.chunk_rows = chunk_rows
+        self.segments: List[shared_memory.SharedMemory] = []
+        self._blocks: List[np.ndarray] = []
+        self.used = 0
+
+    @property
+    def names(self) -> List[str]:
+        return [shm.name for shm in self.segments]
+
+    def _grow(self) -> bool:
+        rows = min(self.chunk_rows, self.capacity - len(self.segments) * self.chunk_rows)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, self.dim * rows * 4))
+        try:
+            _reserve(shm)
+        except OSError as e:
+            shm.close()
+            shm.unlink()
+            print(f'[Embedding Service] shared memory full after {self.used} vectors ({e}); '
+                  'sending further vectors inline')
+            self.capacity = self.used
+            return False
+        _OWNED_SEGMENTS.add(shm.name)
+        self.segments.append(shm)
+        self._blocks.append(np.ndarray((rows, self.dim), dtype=np.float32, buffer=shm.buf))
+        return True
+
+    def append(self, vector: np.ndarray) -> Optional[int]:
+        if self.used >= self.capacity:
+            return None
+        if self.used >= len(self.segments) * self.chunk_rows and not self._grow():
+            return None
+        self._blocks[-1][self.used % self.chunk_rows] = vector
+        self.used += 1
+        return self.used - 1
+
+    def close(self) -> None:
+        self._blocks = []
+        for shm in self.segments:
+            _OWNED_SEGMENTS.discard(shm.name)
+            shm.close()
+            shm.unlink()
+        self.segments = []
+
+
+class EmbeddingServer:
+    """Serves embeddings from one deduplicated cache to local clients."""
+
+    def __init__(
+        self,
+        embedder: Optional[Callable[[str], np.ndarray]] = None,
+        socket_path: str = DEFAULT_SOCKET,
+        batch_embedder: Optional[Callable[[List[str]], Sequence[np.ndarray]]] = None,
+        capacity: int = 200_000,
+        batch_window: float = 0.005,
+        max_batch: int = 256,
+        chunk_rows: int = 4096,
+    ):
+        """Initialize the server.
+
+        Args:
+            embedder: Embedding function for single texts
+            socket_path: Unix socket the clients connect to
+            batch_embedder: Embeds a list of texts in one call; defaults to
+                calling `embedder` per text
+            capacity: Most vectors kept in shared memory
+            batch_window: Seconds to wait for more requests before embedding
+            max_batch: Most texts embedded in one call
+            chunk_rows: Vectors per shared-memory segment; the slab grows by
+                one segment at a time
+        """
+        if embedder is None and batch_embedder is None:
+            raise ValueError('EmbeddingServer needs an embedder or a batch_embedder')
+        self.socket_path = socket_path
+        self._embed_batch = batch_embedder or (lambda texts: [embedder(t) for t in texts])
+        self._capacity = capacity
+        self._chunk_rows = max(1, chunk_rows)
+        self._batch_window = batch_window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._overflow: Dict[str, np.ndarray] = {}
+        self._slab: Optional[_Slab] = None
+        self._requests: 'queue.Queue[Tuple[List[str], queue.Queue]]' = queue.Queue()
+        self._listener: Optional[connection.Listener] = None
+        self._closed = threading.Event()
+        self.requests = 0
+        self.texts = 0
+        self.embedded = 0
+        self.batches = 0
+
+    def start(self) -> 'EmbeddingServer':
+        """Listen on the socket and serve from background threads."""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._listener = connection.Listener(self.socket_path, family='AF_UNIX')
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        print(f'[Embedding Service] listening on {self.socket_path}')
+        return self
+
+    def serve_forever(self) -> None:
+        self.start()
+        try:
+            while not self._closed.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop serving and free the shared memory."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._listener is not None:
+            self._listener.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        with self._lock:
+            if self._slab is not None:
+                self._slab.close()
+                self._slab = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            cached = len(self._rows) + len(self._overflow)
+        return {'requests': self.requests, 'texts': self.texts, 'embedded': self.embedded,
+                'batches': self.batches, 'cached': cached}
+
+    def _accept_loop(self) -> None:
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn: connection.Connection) -> None:
+        with conn:
+            while not self._closed.is_set():
+                try:
+                    command, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if command == 'stats':
+                    conn.send(('ok', self.stats()))
+                    continue
+                reply: 'queue.Queue' = queue.Queue(maxsize=1)
+                self._requests.put((list(payload), reply))
+                try:
+                    conn.send(reply.get())
+                except OSError:
+                    return
+
+    def _batch_loop(self) -> None:
+        while not self._closed.is_set():
+            try:
+                pending = [self._requests.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self._batch_window
+            while sum(len(texts) for texts, _ in pending) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.requests += len(pending)
+            try:
+                self._embed_missing([t for texts, _ in pending for t in texts])
+            except Exception as e:
+                for _, reply in pending:
+                    reply.put(('error', repr(e)))
+                continue
+            for texts, reply in pending:
+                reply.put(self._lookup(texts))
+
+    def _embed_missing(self, texts: List[str]) -> None:
+        self.texts += len(texts)
+        with self._lock:
+            missing = list({_key(t): t for t in texts
+                            if _key(t) not in self._rows and _key(t) not in self._overflow}.values())
+        for start in range(0, len(missing), self._max_batch):
+            chunk = missing[start:start + self._max_batch]
+            vectors = self._embed_batch(chunk)
+            self.batches += 1
+            self.embedded += len(chunk)
+            with self._lock:
+                for text, vector in zip(chunk, vectors):
+                    vector = np.asarray(vector, dtype=np.float32).ravel()
+                    if self._slab is None:
+                        self._slab = _Slab(vector.shape[0], self._capacity, self._chunk_rows)
+                    row = self._slab.append(vector) if vector.shape[0] == self._slab.dim else None
+                    if row is None:
+                        self._overflow[_key(text)] = vector
+                    else:
+                        self._rows[_key(text)] = row
+
+    def _lookup(self, texts: List[str]) -> Tuple:
+        with self._lock:
+            if self._slab is None:
+                return ('ok', [], 0, 0, [], {})
+            rows, inline = [], {}
+            for i, text in enumerate(texts):
+                key = _key(text)
+                if key in self._rows:
+                    rows.append(self._rows[key])
+                else:
+                    rows.append(-1)
+                    inline[i] = self._overflow[key]
+            return ('ok', self._slab.names, self._slab.dim, self._slab.chunk_rows, rows, inline)
+
+
+class EmbeddingServiceClient:
+    """Embedder backed by an `EmbeddingServer`; returns views into its shared memory."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = 10.0):
+        """Connect to the service.
+
+        Args:
+            socket_path: The server's Unix socket
+            timeout: Seconds to keep retrying while the server starts
+
+        Raises:
+            ConnectionError: If no server answers on `socket_path`
+        """
+        self.socket_path = socket_path
+        self.__name__ = f'embedding_service_{os.path.basename(socket_path)}'
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._conn = connection.Client(socket_path, family='AF_UNIX')
+                break
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f'No embedding service at {socket_path}') from e
+                time.sleep(0.1)
+        self._lock = threading.Lock()
+        self._segments: List[shared_memory.SharedMemory] = []
+        self._blocks: List[np.ndarray] = []
+        self._local: Dict[str, np.ndarray] = {}
+
+    def __call__(self, text: str) -> np.ndarray:
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Embed `texts` in one request; repeated texts are answered locally."""
+        keys = [_key(t) for t in texts]
+        with self._lock:
+            missing = list({k: t for k, t in zip(keys, texts) if k not in self._local}.values())
+            if missing:
+                self._conn.send(('embed', missing))
+                reply = self._conn.recv()
+                if reply[0] != 'ok':
+                    raise RuntimeError(f'Embedding service error: {reply[1]}')
+                _, names, dim, chunk_rows, rows, inline = reply
+                for name in names[len(self._segments):]:
+                    self._attach(name, dim)
+                for i, (text, row) in enumerate(zip(missing, rows)):
+                    vector = inline[i] if row < 0 else self._blocks[row // chunk_rows][row % chunk_rows]
+                    vector.flags.writeable = False
+                    self._local[_key(text)] = vector
+            return [self._local[k] for k in keys]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._conn.send(('stats', None))
+            return self._conn.recv()[1]
+
+    def _attach(self, shm_name: str, dim: int) -> None:
+        # Before Python 3.13, attaching registers the segment with this
+        # process's resource tracker, which would unlink it at exit; the
+        # server owns it. A server in this process shares that tracker
+        # entry, and unlinks the segment itself.
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            if shm_name not in _OWNED_SEGMENTS:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        self._segments.append(shm)
+        self._blocks.append(np.ndarray((shm.size // (4 * dim), dim), dtype=np.float32, buffer=shm.buf))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _openai_batch_embedder(model_name: str) -> Callable[[List[str]], List[np.ndarray]]:
+    import openai
+    client = openai.OpenAI()
+
+    def embed(texts: List[str]) -> List[np.ndarray]:
+        response = client.embeddings.create(model=model_name, input=texts)
+        return [np.asarray(item.embedding) for item in sorted(response.data, key=lambda d: d.index)]
+
+    return embed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Per-host embedding service')
+    parser.add_argument('--socket', default=os.getenv(EMBEDDING_SOCKET_ENV, DEFAULT_SOCKET))
+    parser.add_argument('--embedder', choices=('simple', 'openai'), default='simple')
+    parser.add_argument('--model', default='text-embedding-3-small', help='OpenAI embedding model')
+    parser.add_argument('--dim', type=int, default=384, help='Dimension of the simple embedder')
+    parser.add_argument('--capacity', type=int, default=200_000, help='Most vectors kept in shared memory')
+    parser.add_argument('--chunk-rows', type=int, default=4096, help='Vectors per shared-memory segment')
+    args = parser.parse_args(argv)
+    if args.embedder == 'openai':
+        server = EmbeddingServer(batch_embedder=_openai_batch_embedder(args.model),
+                                 socket_path=args.socket, capacity=args.capacity, chunk_rows=args.chunk_rows)
+    else:
+        from .model_setup import create_simple_embedder
+        server = EmbeddingServer(create_simple_embedder(args.dim), socket_path=args.socket,
+                                 capacity=args.capacity, chunk_rows=args.chunk_rows)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk cache for the formative-memories initializer.
+
+Every scenario rebuilds and reruns concordia's formative-memories initializer
+for the baseline and again for each intervention branch. Each run regenerates
+the same LLM backstories and re-embeds the same memories. This module
+persists both:
+
+- `InitializerCache` stores the generated backstory episodes of each player
+  under a hash of everything that shapes the generation prompt (player name,
+  shared memories, player context, generation settings and model). A rebuilt
+  initializer replays them into fresh agents through its usual observation
+  queue instead of calling the model.
+- `CachedEmbedder` wraps an embedder with a persistent text -> vector store, so
+  replayed memories are not embedded again.
+
+`SceneBuilder(..., initializer_cache_dir=...)` turns both on for game masters,
+`AgentFactory(..., embedding_cache_dir=...)` for agents. The
+`EDUMIRROR_INITIALIZER_CACHE` environment variable turns them on everywhere.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+INITIALIZER_CACHE_ENV = 'EDUMIRROR_INITIALIZER_CACHE'
+
+# Bump when the cached format or the key derivation changes.
+_CACHE_VERSION = 1
+
+
+def _digest(payload: Any) -> str:
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _write_atomic(path: str, write: Callable[[Any], None], mode: str = 'w') -> None:
+    tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+    kwargs = {'encoding': 'utf-8'} if 'b' not in mode else {}
+    with open(tmp_path, mode, **kwargs) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def model_identity(model: Any) -> str:
+    """Return a label for `model` that separates caches of different models.
+
+    Looks through wrappers (`_model`) for a `model_name` or concordia's
+    `_model_name`. Pass the configured name to `InitializerCache.attach`
+    where neither exists.
+    """
+    current = model
+    while current is not None:
+        name = getattr(current, 'model_name', None) or getattr(current, '_model_name', None)
+        if isinstance(name, str) and name:
+            return name
+        current = getattr(current, '_model', None)
+    return type(model).__name__
+
+
+class InitializerCache:
+    """Persistent store of initializer-generated backstory episodes."""
+
+    def __init__(self, cache_dir: str):
+        """Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding the cache (created if missing)
+        """
+        self.cache_dir = cache_dir
+        self._backstory_dir = os.path.join(cache_dir, 'backstories')
+        os.makedirs(self._backstory_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def backstory_key(
+        self,
+        player_name: str,
+        params: Mapping[str, Any],
+        model_label: str,
+    ) -> str:
+        return _digest({
+            'version': _CACHE_VERSION,
+            'player': player_name,
+            'shared_memories': list(params.get('shared_memories', [])),
+            'player_context': params.get('player_specific_context', {}).get(player_name, ''),
+            'delimiter_symbol': params.get('delimiter_symbol', '***'),
+            'sentences_per_episode': params.get('sentences_per_episode', 5),
+            'model': model_label,
+        })
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._backstory_dir, f'{key}.json')
+
+    def get_episodes(self, key: str) -> Optional[list]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                episodes = json.load(f)['episodes']
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return episodes
+
+    def put_episodes(self, key: str, player_name: str, episodes: Sequence[str]) -> None:
+        _write_atomic(
+            self._path(key),
+            lambda f: json.dump({'player': player_name, 'episodes': list(episodes)}, f, ensure_ascii=False),
+        )
+
+    def attach(
+        self,
+        game_master: Any,
+        params: Mapping[str, Any],
+        model: Any,
+        model_name: Optional[str] = None,
+    ) -> bool:
+        """Make `game_master`'s initializer component read and fill the cache.
+
+        Args:
+            game_master: A game master built from concordia's
+                formative-memories initializer prefab
+            params: The initializer params
+            model: The model the initializer generates with
+            model_name: The configured model name, keying the cache; if None,
+                it is read from `model` (see `model_identity`)
+
+        Returns:
+            True if an initializer component was found and wrapped
+        """
+        component = _find_initializer_component(game_master)
+        if component is None:
+            return False
+        generate = component.generate_backstory_episodes
+        model_label = model_name or model_identity(model)
+
+        def cached_generate(player_name: str) -> Sequence[str]:
+            key = self.backstory_key(player_name, params, model_label)
+            episodes = self.get_episodes(key)
+            if episodes is None:
+                episodes = list(generate(player_name))
+                self.put_episodes(key, player_name, episodes)
+            return episodes
+
+        # The component calls self.generate_backstory_episodes(name), so an
+        # instance attribute takes precedence over the method.
+        component.generate_backstory_episodes = cached_generate
+        return True
+
+
+def _find_initializer_component(game_master: Any) -> Any:
+    for component in game_master.get_all_context_components().values():
+        if hasattr(component, 'generate_backstory_episodes'):
+            return component
+    return None
+
+
+class CachedEmbedder:
+    """Embedder wrapper backed by a persistent text -> vector store.
+
+    New vectors are kept in memory and written to `<cache_dir>/embeddings_<namespace>.npz`
+    every `flush_every` additions, on `flush()` and at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        embedder: Callable[[str], np.ndarray],
+        cache_dir: str,
+        namespace: str = 'default',
+        flush_every: int = 256,
+    ):
+        """Initialize the embedder.
+
+        Args:
+            embedder: The wrapped embedding function
+            cache_dir: Directory holding the cache (created if missing)
+            namespace: Separates stores of different embedding models
+            flush_every: Number of new vectors after which the store is saved
+        """
+        self._embedder = embedder
+        os.makedirs(cache_dir, exist_ok=True)
+        self._path = os.path.join(cache_dir, f'embeddings_{namespace}.npz')
+        self._flush_every = flush_every
+        self._lock = threading.Lock()
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._pending = 0
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(self._path):
+            try:
+                with np.load(self._path) as data:
+                    self._vectors = {key: data[key] for key in data.files}
+            except (OSError, ValueError):
+                self._vectors = {}
+        atexit.register(self.flush)
+
+    def __call__(self, text: str) -> np.ndarray:
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self.hits += 1
+                return vector
+        vector = np.asarray(self._embedder(text))
+        with self._lock:
+            self.misses += 1
+            self._vectors[key] = vector
+            self._pending += 1
+            should_flush = self._pending >= self._flush_every
+        if should_flush:
+            self.flush()
+        return vector
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            vectors = dict(self._vectors)
+            self._pending = 0
+        # Keep vectors another process saved in the meantime.
+        if os.path.exists(self._path):
+            try:
+                with np.load(self._path) as data:
+                    for key in data.files:
+                        vectors.setdefault(key, data[key])
+            except (OSError, ValueError):
+                pass
+        _write_atomic(self._path, lambda f: np.savez(f, **vectors), mode='wb')
+
+
+_embedders: Dict[tuple, CachedEmbedder] = {}
+_embedders_lock = threading.Lock()
+
+
+def embedder_namespace(embedder: Callable[[str], np.ndarray]) -> str:
+    """Return the store name of `embedder`: its `__name__`, made file-safe.
+
+    `create_simple_embedder` and `create_openai_embedder` name their functions
+    after the dimension and the model, so different embedders get different
+    stores. Give custom embedders a distinguishing `__name__` likewise.
+    """
+    name = getattr(embedder, '__name__', type(embedder).__name__)
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def cached_embedder(embedder: Callable[[str], np.ndarray], cache_dir: Optional[str] = None) -> Callable[[str], np.ndarray]:
+    """Wrap `embedder` in the shared `CachedEmbedder` for its store.
+
+    Agents and game masters of one run receive the same wrapper for the same
+    embedder, so their vectors end up in one store. The store is named by
+    `embedder_namespace`; another embedder never shares a wrapper.
+
+    Args:
+        embedder: The embedding function
+        cache_dir: Cache directory; defaults to `EDUMIRROR_INITIALIZER_CACHE`
+
+    Returns:
+        The cached embedder, or `embedder` itself when no cache is configured
+    """
+    cache_dir = cache_dir or os.getenv(INITIALIZER_CACHE_ENV)
+    if not cache_dir or isinstance(embedder, CachedEmbedder):
+        return embedder
+    namespace = embedder_namespace(embedder)
+    # Keyed by the embedder itself (the wrapper keeps it alive, so its id is
+    # not reused): an equally named embedder gets its own wrapper.
+    key = (os.path.abspath(cache_dir), namespace, id(embedder))
+    with _embedders_lock:
+        if key not in _embedders:
+            _embedders[key] = CachedEmbedder(embedder, cache_dir, namespace=namespace)
+        return _embedders[key]
@@ -2,10 +2,19 @@ from __future__ import annotations
 
 import os
 import json
-from typing import Any, Dict, List, Sequence
+import time
+from typing import Any, Dict, List, Optional, Sequence
 
 from concordia.typing import scene as scene_lib
-from .scene_builder import SceneBuilder
+from .budget_guard import get_active_budget
+from .scene_builder import (
+    SEQUENTIAL_ENGINE, SceneBuilder, SceneEndPredicate, end_marker_predicate, scene_engine,
+)
+
+
+# Written to output_root, under an active budget guard, after every finished
+# branch and when the guard pauses the run.
+CHECKPOINT_FILE = 'runner_checkpoint.json'
 
 
 class InterventionSpec:
@@ -22,14 +31,30 @@ class InterventionScenarioRunner:
         entities: Sequence[Any],
         initializer_params: Dict[str, Any],
         output_root: str,
+        scene_end_predicate: Optional[SceneEndPredicate] = end_marker_predicate,
+        co_present_only: bool = False,
     ) -> None:
+        # scene_end_predicate=None restores fixed-length scenes (num_rounds each).
+        # Scenes built with SceneBuilder.make_scene(..., engine='simultaneous')
+        # run with all participants acting in parallel each round.
+        # co_present_only limits each scene to its participants (population mode).
+        # A run paused by the active budget guard leaves a checkpoint in
+        # output_root; a rerun with the same output_root skips the branches
+        # that had finished. The shipped scenarios neither use this runner
+        # nor a stable output_root, so their reruns start over.
         self._builder = builder
+        self._scene_end_predicate = scene_end_predicate
+        self._co_present_only = co_present_only
         self._entities = list(entities)
         self._initializer_params = dict(initializer_params)
         self._output_root = output_root
         self._pre_scenes: List[scene_lib.SceneSpec] = []
         self._post_scenes: List[scene_lib.SceneSpec] = []
         self._interventions: List[InterventionSpec] = []
+        self._finished: Dict[str, Dict[str, Any]] = {}
+        self._current: Optional[str] = None
+        self._pause_hooked = False
+        self._resumed = self._load_checkpoint()
 
     def set_pipeline(
         self,
@@ -61,18 +86,112 @@ class InterventionScenarioRunner:
     def _sum_rounds(self, scenes: Sequence[scene_lib.SceneSpec]) -> int:
         return sum(s.num_rounds for s in scenes)
 
-    def _make_windows(self, scenes: Sequence[scene_lib.SceneSpec]) -> List[tuple[int, int, str, List[str]]]:
+    def _make_windows(
+        self,
+        scenes: Sequence[scene_lib.SceneSpec],
+        step_counts: Optional[Sequence[int]] = None,
+        first_step: int = 1,
+        last_step: Optional[int] = None,
+    ) -> List[tuple[int, int, str, List[str]]]:
+        # Nominal windows use num_rounds; pass step_counts for actual lengths,
+        # or last_step to cut them at the last logged step.
+        if step_counts is None:
+            step_counts = [s.num_rounds for s in scenes]
         windows: List[tuple[int, int, str, List[str]]] = []
-        current = 1
-        for s in scenes:
+        current = first_step
+        for s, count in zip(scenes, step_counts):
             start = current
-            end = current + s.num_rounds - 1
+            end = current + count - 1
+            if last_step is not None:
+                if start > last_step:
+                    break
+                end = min(end, last_step)
             name = s.scene_type.name
             parts = list(s.participants)
             windows.append((start, end, name, parts))
             current = end + 1
         return windows
 
+    def _run_phase(
+        self,
+        scenes: Sequence[scene_lib.SceneSpec],
+        leading_game_masters: Sequence[Any],
+        log: List[Dict[str, Any]],
+        verbose: bool,
+    ) -> List[tuple[int, int, str, List[str]]]:
+        first_step = len(log) + 1
+        per_scene = self._scene_end_predicate is not None or self._co_present_only or any(
+            scene_engine(s) != SEQUENTIAL_ENGINE for s in scenes
+        )
+        if per_scene:
+            windows = self._builder.run_scenes_with_early_termination(
+                scenes=scenes,
+                entities=self._entities,
+                leading_game_masters=leading_game_masters,
+                end_predicate=self._scene_end_predicate,
+                verbose=verbose,
+                log=log,
+                co_present_only=self._co_present_only,
+            )
+            step_counts = [end - start + 1 for start, end, _, _ in windows]
+            return self._make_windows(scenes, step_counts, first_step)
+        self._builder.run_with_sequential_engine(
+            game_masters=[*leading_game_masters, self._build_dialogic_gm('conversation rules', scenes)],
+            entities=self._entities,
+            premise='',
+            max_steps=self._sum_rounds(scenes),
+            verbose=verbose,
+            log=log,
+        )
+        # One game master runs all scenes, so only the total is known: the
+        # scenes fill the logged steps in order and the run may stop short.
+        return self._make_windows(scenes, first_step=first_step, last_step=len(log))
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self._output_root, CHECKPOINT_FILE)
+
+    def _load_checkpoint(self) -> Dict[str, Dict[str, Any]]:
+        # Only a paused run is resumed; a finished one is simply rerun.
+        try:
+            with open(self._checkpoint_path(), 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not checkpoint.get('paused'):
+            return {}
+        finished = {
+            label: branch for label, branch in checkpoint.get('finished', {}).items()
+            if os.path.exists(os.path.join(branch['output_dir'], 'simulation_events.jsonl'))
+        }
+        print(f'[Intervention Runner] resuming paused run; finished branches: {sorted(finished)}')
+        return finished
+
+    def save_checkpoint(self, paused: bool = False) -> str:
+        """Write the finished branches (and the one in progress) to output_root.
+
+        Returns:
+            The checkpoint path
+        """
+        os.makedirs(self._output_root, exist_ok=True)
+        path = self._checkpoint_path()
+        tmp_path = f'{path}.tmp.{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'paused': paused,
+                'saved_at': time.time(),
+                'in_progress': self._current,
+                'finished': {**self._resumed, **self._finished},
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def _hook_budget(self, budget: Any) -> None:
+        if budget is None or self._pause_hooked:
+            return
+        budget.on_pause(lambda: print(
+            f'[Intervention Runner] paused; checkpoint saved to {self.save_checkpoint(paused=True)}'))
+        self._pause_hooked = True
+
     def _write_log(self, log: List[Dict[str, Any]], windows: List[tuple[int, int, str, List[str]]], out_file: str) -> None:
         os.makedirs(os.path.dirname(out_file), exist_ok=True)
         with open(out_file, 'w', encoding='utf-8') as f:
@@ -100,53 +219,32 @@ class InterventionScenarioRunner:
 
     def run_pre_and_checkpoint(self, verbose: bool = True) -> Dict[str, Any]:
         initializer = self._build_initializer()
-        pre_gm = self._build_dialogic_gm('conversation rules', self._pre_scenes)
         log: List[Dict[str, Any]] = []
-        self._builder.run_with_sequential_engine(
-            game_masters=[initializer, pre_gm],
-            entities=self._entities,
-            premise='',
-            max_steps=self._sum_rounds(self._pre_scenes),
-            verbose=verbose,
-            log=log,
-        )
-        return {'log': log}
+        windows = self._run_phase(self._pre_scenes, [initializer], log, verbose)
+        return {'log': log, 'windows': windows}
 
     def run_branch(self, intervention: InterventionSpec, verbose: bool = True) -> Dict[str, Any]:
+        out_dir = os.path.join(self._output_root, f'condition_{intervention.output_label}')
+        if intervention.output_label in self._resumed:
+            print(f'[Intervention Runner] {intervention.output_label} finished before the pause; skipped')
+            return {'log': [], 'windows': self._resumed[intervention.output_label]['windows'],
+                    'output_dir': out_dir, 'resumed': True}
+        budget = get_active_budget()
+        if budget is not None:
+            budget.set_context(condition=intervention.output_label)
+        self._hook_budget(budget)
+        self._current = intervention.output_label
         initializer = self._build_initializer()
-        pre_gm = self._build_dialogic_gm('conversation rules', self._pre_scenes)
-        mid_gm = self._build_dialogic_gm('conversation rules', intervention.scenes)
-        post_gm = self._build_dialogic_gm('conversation rules', self._post_scenes)
-        all_scenes = [*self._pre_scenes, *intervention.scenes, *self._post_scenes]
         log: List[Dict[str, Any]] = []
-        self._builder.run_with_sequential_engine(
-            game_masters=[initializer, pre_gm],
-            entities=self._entities,
-            premise='',
-            max_steps=self._sum_rounds(self._pre_scenes),
-            verbose=verbose,
-            log=log,
-        )
-        self._builder.run_with_sequential_engine(
-            game_masters=[mid_gm],
-            entities=self._entities,
-            premise='',
-            max_steps=self._sum_rounds(intervention.scenes),
-            verbose=verbose,
-            log=log,
-        )
-        self._builder.run_with_sequential_engine(
-            game_masters=[post_gm],
-            entities=self._entities,
-            premise='',
-            max_steps=self._sum_rounds(self._post_scenes),
-            verbose=verbose,
-            log=log,
-        )
-        windows = self._make_windows(all_scenes)
-        out_dir = os.path.join(self._output_root, f'condition_{intervention.output_label}')
+        windows = self._run_phase(self._pre_scenes, [initializer], log, verbose)
+        windows += self._run_phase(intervention.scenes, [], log, verbose)
+        windows += self._run_phase(self._post_scenes, [], log, verbose)
         out_file = os.path.join(out_dir, 'simulation_events.jsonl')
         self._write_log(log, windows, out_file)
+        self._finished[intervention.output_label] = {'windows': windows, 'output_dir': out_dir}
+        self._current = None
+        if self._pause_hooked:
+            self.save_checkpoint()
         return {'log': log, 'windows': windows, 'output_dir': out_dir}
 
     def run_all_branches(self, verbose: bool = True) -> List[Dict[str, Any]]:
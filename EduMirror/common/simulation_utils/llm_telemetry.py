@@ -0,0 +1,357 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-call-site telemetry for language model calls.
+
+`InstrumentedLanguageModel` wraps the model returned by
+`create_language_model` and records one entry per call in an `LLMTelemetry`
+recorder: the agent and component that made the call, the simulation step,
+prompt and completion token counts, latency and retries. Components can also
+publish structured events to the same recorder with `emit_event`.
+
+Each call record also carries `cached_prefix_tokens` and `prefix_fingerprint`:
+the length and hash of the prompt prefix shared with the previous prompt from
+the same call site. Prompts that put their static instructions first keep
+this prefix long, which is what provider-side prompt caching bills at a
+discount.
+
+Example:
+    telemetry = LLMTelemetry()
+    model = create_language_model(config, telemetry=telemetry)
+    ...  # build agents and run the simulation
+    telemetry.write_jsonl('results/llm_profile.jsonl')
+    print(telemetry.format_summary_table())
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from concordia.language_model import language_model
+from concordia.typing import entity_component
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    _ENCODING = None
+
+UNATTRIBUTED = '<unattributed>'
+
+_active_telemetry: Optional['LLMTelemetry'] = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, else ~4 characters per token."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _find_call_site() -> Tuple[str, str]:
+    """Return (agent name, component class) of the nearest calling component.
+
+    The stack is walked from the caller outwards; the first frame whose `self`
+    is a concordia component determines the call site. This also works inside
+    the worker threads used by `concurrency.run_tasks`, because those frames
+    start from the component method that was scheduled.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, entity_component.BaseComponent):
+            try:
+                agent = owner.get_entity().name
+            except Exception:
+                agent = UNATTRIBUTED
+            return agent, owner.__class__.__name__
+        frame = frame.f_back
+    return UNATTRIBUTED, UNATTRIBUTED
+
+
+def get_active_telemetry() -> Optional['LLMTelemetry']:
+    """Returns the recorder that `emit_event` publishes to, if any."""
+    return _active_telemetry
+
+
+def set_active_telemetry(telemetry: Optional['LLMTelemetry']) -> None:
+    """Sets the recorder that `emit_event` publishes to."""
+    global _active_telemetry
+    _active_telemetry = telemetry
+
+
+def emit_event(event: str, **fields: Any) -> None:
+    """Publish a structured event to the active telemetry recorder.
+
+    Does nothing when no recorder is active, so components can call it
+    unconditionally.
+
+    Args:
+        event: Short event name, e.g. 'svo_computed'
+        **fields: JSON-serializable payload; 'agent' and 'step' override the
+            values inferred from the call site
+    """
+    telemetry = _active_telemetry
+    if telemetry is None:
+        return
+    agent, component = _find_call_site()
+    telemetry.record({
+        'type': 'event',
+        'event': event,
+        'agent': fields.pop('agent', agent),
+        'component': component,
+        'step': fields.pop('step', telemetry.step),
+        'time': time.time(),
+        'data': fields,
+    })
+
+
+class LLMTelemetry:
+    """Thread-safe recorder for model calls and component events."""
+
+    def __init__(self, run_name: str = 'run'):
+        """Initialize an empty recorder.
+
+        Args:
+            run_name: Label written into every record
+        """
+        self.run_name = run_name
+        self.step = 0
+        self._records: List[Dict[str, Any]] = []
+        self._last_prompts: Dict[Tuple[str, ...], str] = {}
+        self._lock = threading.Lock()
+
+    def set_step(self, step: int) -> None:
+        """Set the simulation step attached to subsequent records."""
+        self.step = step
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Append one record."""
+        entry.setdefault('run', self.run_name)
+        with self._lock:
+            self._records.append(entry)
+
+    def track_prefix(self, call_site: Tuple[str, ...], prompt: str) -> Tuple[str, int]:
+        """Compare `prompt` with the previous prompt from `call_site`.
+
+        Args:
+            call_site: Key of the caller, e.g. (agent, component, method)
+            prompt: The prompt about to be sent
+
+        Returns:
+            (fingerprint, tokens) of the shared prefix; ('', 0) if none
+        """
+        with self._lock:
+            previous = self._last_prompts.get(call_site, '')
+            self._last_prompts[call_site] = prompt
+        shared = os.path.commonprefix([previous, prompt])
+        if not shared:
+            return '', 0
+        return hashlib.sha1(shared.encode('utf-8')).hexdigest()[:12], count_tokens(shared)
+
+    def get_records(self, record_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return a copy of all records, optionally filtered by type ('call' or 'event')."""
+        with self._lock:
+            records = list(self._records)
+        if record_type is None:
+            return records
+        return [r for r in records if r['type'] == record_type]
+
+    def reset(self) -> None:
+        """Drop all records and reset the step counter."""
+        with self._lock:
+            self._records = []
+            self._last_prompts = {}
+        self.step = 0
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        """Aggregate model calls by (agent, component).
+
+        Returns:
+            One row per call site, sorted by total latency in descending order
+        """
+        rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for r in self.get_records('call'):
+            key = (r['agent'], r['component'])
+            row = rows.setdefault(key, {
+                'agent': key[0],
+                'component': key[1],
+                'calls': 0,
+                'errors': 0,
+                'retries': 0,
+                'prompt_tokens': 0,
+                'cached_prefix_tokens': 0,
+                'completion_tokens': 0,
+                'latency_s': 0.0,
+            })
+            row['calls'] += 1
+            row['errors'] += int(r['error'] is not None)
+            row['retries'] += r['retries']
+            row['prompt_tokens'] += r['prompt_tokens']
+            row['cached_prefix_tokens'] += r.get('cached_prefix_tokens', 0)
+            row['completion_tokens'] += r['completion_tokens']
+            row['latency_s'] += r['latency_s']
+        for row in rows.values():
+            row['mean_latency_s'] = row['latency_s'] / row['calls']
+        return sorted(rows.values(), key=lambda row: row['latency_s'], reverse=True)
+
+    def format_summary_table(self) -> str:
+        """Render `summarize()` as a fixed-width text table."""
+        columns = ('agent', 'component', 'calls', 'errors', 'retries', 'prompt_tokens',
+                   'cached_prefix_tokens', 'completion_tokens', 'latency_s', 'mean_latency_s')
+        rows = self.summarize()
+        cells = [[f'{row[c]:.2f}' if isinstance(row[c], float) else str(row[c])
+                  for c in columns] for row in rows]
+        widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+        lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths))]
+        lines.append('  '.join('-' * w for w in widths))
+        for r in cells:
+            lines.append('  '.join(v.ljust(w) for v, w in zip(r, widths)))
+        return '\n'.join(lines)
+
+    def write_jsonl(self, path: str) -> str:
+        """Write every record as one JSON line.
+
+        Args:
+            path: Output file; parent directories are created
+
+        Returns:
+            The path written to
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for r in self.get_records():
+                f.write(json.dumps(r, ensure_ascii=False, default=str) + '\n')
+        return path
+
+    def write_summary(self, path: str) -> str:
+        """Write the per-call-site summary table as text."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.format_summary_table() + '\n')
+        return path
+
+
+class InstrumentedLanguageModel(language_model.LanguageModel):
+    """Wraps a language model and records every call in an `LLMTelemetry`."""
+
+    def __init__(
+        self,
+        model: language_model.LanguageModel,
+        telemetry: LLMTelemetry,
+        model_name: str = '',
+        max_retries: int = 0,
+        retry_delay: float = 1.0,
+        retry_on_exceptions: Collection[Type[Exception]] = (Exception,),
+    ):
+        """Wrap `model`.
+
+        Args:
+            model: The language model to instrument
+            telemetry: Recorder receiving one record per call
+            model_name: Model label written into each record
+            max_retries: Number of retries after a failed call
+            retry_delay: Initial delay between retries, doubled on each retry
+            retry_on_exceptions: Exceptions that trigger a retry
+        """
+        self._model = model
+        self.telemetry = telemetry
+        self._model_name = model_name
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._retry_on_exceptions = tuple(retry_on_exceptions)
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def _call(self, method: str, prompt: str, prompt_tokens: int, fn) -> Any:
+        agent, component = _find_call_site()
+        step = self.telemetry.step
+        fingerprint, cached_tokens = self.telemetry.track_prefix((agent, component, method), prompt)
+        start = time.perf_counter()
+        retries = 0
+        error = None
+        result = None
+        try:
+            while True:
+                try:
+                    result = fn()
+                    break
+                except self._retry_on_exceptions as e:
+                    if retries >= self._max_retries:
+                        error = repr(e)
+                        raise
+                    time.sleep(self._retry_delay * (2 ** retries))
+                    retries += 1
+        finally:
+            if method == 'sample_choice' and result is not None:
+                completion = result[1]
+            else:
+                completion = result or ''
+            self.telemetry.record({
+                'type': 'call',
+                'method': method,
+                'model': self._model_name,
+                'agent': agent,
+                'component': component,
+                'step': step,
+                'prompt_tokens': prompt_tokens,
+                'cached_prefix_tokens': cached_tokens,
+                'prefix_fingerprint': fingerprint,
+                'completion_tokens': count_tokens(completion),
+                'latency_s': time.perf_counter() - start,
+                'retries': retries,
+                'error': error,
+                'time': time.time(),
+            })
+        return result
+
+    def sample_text(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = language_model.DEFAULT_MAX_TOKENS,
+        terminators: Collection[str] = language_model.DEFAULT_TERMINATORS,
+        temperature: float = language_model.DEFAULT_TEMPERATURE,
+        timeout: float = language_model.DEFAULT_TIMEOUT_SECONDS,
+        seed: int | None = None,
+    ) -> str:
+        return self._call('sample_text', prompt, count_tokens(prompt), lambda: self._model.sample_text(
+            prompt,
+            max_tokens=max_tokens,
+            terminators=terminators,
+            temperature=temperature,
+            timeout=timeout,
+            seed=seed,
+        ))
+
+    def sample_choice(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        *,
+        seed: int | None = None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        prompt_tokens = count_tokens(prompt) + sum(count_tokens(r) for r in responses)
+        return self._call('sample_choice', prompt, prompt_tokens, lambda: self._model.sample_choice(
+            prompt, responses, seed=seed,
+        ))
@@ -2,9 +2,11 @@ import json
 import os
 import base64
 import requests
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Mapping, Optional
 from PIL import Image, ImageDraw
 from .model_setup import ModelConfig, create_language_model
+from .batch_jobs import BatchJob
+from .model_router import model_route
 
 
 class LogToComicGenerator:
@@ -31,10 +33,31 @@ class LogToComicGenerator:
     def structure_narrative(self, events: List[Dict[str, Any]]) -> Dict[str, Any]:
         prompt = self._build_structuring_prompt(events)
         try:
-            output = self.text_model.sample_text(prompt)
+            with model_route('narration'):
+                output = self.text_model.sample_text(prompt)
         except Exception:
             return self._heuristic_structure(events)
-        data = self._safe_json_parse(output)
+        return self._structure_from_output(events, output)
+
+    def structure_narratives(self, event_logs: Mapping[str, List[Dict[str, Any]]], batch: BatchJob) -> Dict[str, Dict[str, Any]]:
+        """Structure several event logs (name -> events) in one batch job.
+
+        Logs whose answer is missing or malformed get the heuristic structure,
+        as in `structure_narrative`.
+        """
+        for name, events in event_logs.items():
+            batch.add(f"comic:{name}", self._build_structuring_prompt(events), max_tokens=2000)
+        try:
+            outputs = batch.run()
+        except Exception:
+            outputs = {}
+        return {
+            name: self._structure_from_output(events, outputs.get(f"comic:{name}"))
+            for name, events in event_logs.items()
+        }
+
+    def _structure_from_output(self, events: List[Dict[str, Any]], output: Optional[str]) -> Dict[str, Any]:
+        data = self._safe_json_parse(output or "")
         panels = data.get("panels", [])
         if not isinstance(panels, list) or len(panels) != 4:
             return self._heuristic_structure(events)
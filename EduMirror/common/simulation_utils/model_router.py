@@ -0,0 +1,205 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-call-site routing of language model calls.
+
+Agents and game masters share one model, so a two-token yes/no judgment costs
+as much as a dialogue turn. `RoutedLanguageModel` sends each call to the model
+configured for its call-site tag and falls back to the default (strong) model:
+
+- components mark their calls with `with model_route('desire_check'): ...`
+- calls without a tag are tagged from the calling component's class
+  (`component_tags`, e.g. game-master `EventResolution` -> 'gm_resolution')
+
+When a routed model's answer cannot be used, because it raises
+`InvalidResponseError`/`ValueError` or fails the tag's validator, the call is
+repeated on the escalation model and an `model_route_escalated` event is
+emitted.
+
+Routes are configured on `ModelConfig`:
+    config = ModelConfig(model_name='gpt-4.1', routes={
+        'desire_check': 'gpt-4.1-nano',
+        'desire_update': 'gpt-4.1-mini',
+        'survey': ModelConfig(api_type='openai', model_name='local', base_url='http://localhost:8000/v1'),
+    })
+    model = create_language_model(config)
+"""
+
+import collections
+import contextlib
+import re
+import threading
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from concordia.language_model import language_model
+
+from .llm_telemetry import _find_call_site, emit_event
+
+ROUTE_TAGS = ('act', 'imagine', 'desire_update', 'desire_check', 'gm_resolution', 'survey', 'rating')
+
+DEFAULT_COMPONENT_TAGS = {
+    'MCTSActComponent': 'act',
+    'ConcatActComponent': 'act',
+    'EventResolution': 'gm_resolution',
+    'NextActing': 'gm_resolution',
+    'NextActingFromSceneSpec': 'gm_resolution',
+    'Questionnaire': 'survey',
+}
+
+Validator = Callable[[str], bool]
+
+_YES_NO = re.compile(r'\(a\)|\(b\)|\byes\b|\bno\b', re.IGNORECASE)
+
+
+def is_yes_no_answer(text: str) -> bool:
+    """Whether `text` answers a '(a) Yes. (b) No.' question."""
+    return bool(_YES_NO.search(text or ''))
+
+
+DEFAULT_VALIDATORS: Dict[str, Validator] = {
+    'desire_check': is_yes_no_answer,
+}
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def model_route(tag: str, validate: Optional[Validator] = None) -> Iterator[None]:
+    """Tag the model calls made inside the block with `tag`.
+
+    Args:
+        tag: Call-site tag, one of `ROUTE_TAGS` or a custom one
+        validate: Returns False for answers that should be escalated;
+            overrides the router's validator for `tag`
+    """
+    stack = _local.__dict__.setdefault('routes', [])
+    stack.append((tag, validate))
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def current_route() -> Tuple[Optional[str], Optional[Validator]]:
+    """Return the innermost (tag, validator) set by `model_route` in this thread."""
+    stack = getattr(_local, 'routes', None)
+    return stack[-1] if stack else (None, None)
+
+
+class RoutedLanguageModel(language_model.LanguageModel):
+    """Dispatches each call to the model configured for its call-site tag."""
+
+    def __init__(
+        self,
+        default: language_model.LanguageModel,
+        routes: Mapping[str, language_model.LanguageModel],
+        escalate_to: Optional[language_model.LanguageModel] = None,
+        component_tags: Mapping[str, str] = DEFAULT_COMPONENT_TAGS,
+        validators: Mapping[str, Validator] = DEFAULT_VALIDATORS,
+    ):
+        """Initialize the router.
+
+        Args:
+            default: Model for untagged calls and tags without a route
+            routes: Tag -> model
+            escalate_to: Model retried when a routed answer is unusable;
+                defaults to `default`
+            component_tags: Component class name -> tag for untagged calls
+            validators: Tag -> answer check for `sample_text` calls
+        """
+        self._default = default
+        self._routes = dict(routes)
+        self._escalate_to = escalate_to or default
+        self._component_tags = dict(component_tags)
+        self._validators = dict(validators)
+        self._lock = threading.Lock()
+        self.calls: collections.Counter = collections.Counter()
+        self.escalations: collections.Counter = collections.Counter()
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self._default, 'model_name', '')
+
+    def set_routes(
+        self,
+        routes: Mapping[str, language_model.LanguageModel],
+        default: Optional[language_model.LanguageModel] = None,
+    ) -> None:
+        """Replace the routes, and the default and escalation model if given.
+
+        Used by the budget guard to switch to cheaper models mid-run.
+        """
+        with self._lock:
+            self._routes = dict(routes)
+            if default is not None:
+                self._default = default
+                self._escalate_to = default
+
+    def _route(self) -> Tuple[Optional[str], language_model.LanguageModel, Optional[Validator]]:
+        tag, validate = current_route()
+        if tag is None:
+            _, component = _find_call_site()
+            tag = self._component_tags.get(component)
+        model = self._routes.get(tag, self._default)
+        with self._lock:
+            self.calls[tag] += 1
+        return tag, model, validate or self._validators.get(tag)
+
+    def _escalate(self, tag: Optional[str], method: str, reason: str) -> language_model.LanguageModel:
+        with self._lock:
+            self.escalations[tag] += 1
+        emit_event('model_route_escalated', tag=tag, method=method, reason=reason)
+        return self._escalate_to
+
+    def sample_text(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = language_model.DEFAULT_MAX_TOKENS,
+        terminators: Collection[str] = language_model.DEFAULT_TERMINATORS,
+        temperature: float = language_model.DEFAULT_TEMPERATURE,
+        timeout: float = language_model.DEFAULT_TIMEOUT_SECONDS,
+        seed: int | None = None,
+    ) -> str:
+        kwargs = dict(max_tokens=max_tokens, terminators=terminators,
+                      temperature=temperature, timeout=timeout, seed=seed)
+        tag, model, validate = self._route()
+        if model is self._escalate_to:
+            return model.sample_text(prompt, **kwargs)
+        try:
+            text = model.sample_text(prompt, **kwargs)
+        except (language_model.InvalidResponseError, ValueError) as e:
+            reason = repr(e)
+        else:
+            if validate is None or validate(text):
+                return text
+            reason = 'validation failed'
+        return self._escalate(tag, 'sample_text', reason).sample_text(prompt, **kwargs)
+
+    def sample_choice(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        *,
+        seed: int | None = None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        tag, model, _ = self._route()
+        if model is self._escalate_to:
+            return model.sample_choice(prompt, responses, seed=seed)
+        try:
+            return model.sample_choice(prompt, responses, seed=seed)
+        except (language_model.InvalidResponseError, ValueError) as e:
+            reason = repr(e)
+        return self._escalate(tag, 'sample_choice', reason).sample_choice(prompt, responses, seed=seed)
@@ -19,12 +19,18 @@ language models and embedding functions that can be reused across all
 EduSim simulation scenarios.
 """
 
+import copy
 import os
 import numpy as np
-from typing import Callable, Optional
+from typing import Any, Callable, Dict, Mapping, Optional, Union
 from concordia.language_model import language_model
 from concordia.language_model import utils
 from .config import get_api_key, get_base_url, get_default_model_config, get_current_environment
+from .llm_telemetry import InstrumentedLanguageModel, LLMTelemetry, set_active_telemetry
+from .model_router import RoutedLanguageModel
+from .budget_guard import BudgetGuard, BudgetedLanguageModel, get_active_budget
+from .request_scheduler import RequestScheduler, ScheduledLanguageModel, get_active_scheduler
+from .choice_scoring import CHOICE_SCORING_MODES, ChoiceScoringLanguageModel
 
 
 class ModelConfig:
@@ -37,7 +43,9 @@ class ModelConfig:
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         device: Optional[str] = None,
-        disable_language_model: bool = False
+        disable_language_model: bool = False,
+        routes: Optional[Mapping[str, Union['ModelConfig', str, Mapping[str, Any]]]] = None,
+        choice_scoring: Optional[str] = None,
     ):
         """Initialize model configuration.
         
@@ -48,7 +56,16 @@ class ModelConfig:
             base_url: The base URL for the API (if None, will auto-load from config)
             device: The device to use for model processing (if supported)
             disable_language_model: If True, use a mock model for testing
+            routes: Call-site tag (see model_router.ROUTE_TAGS) -> model for
+                those calls; a model name (same API and endpoint), a dict of
+                ModelConfig arguments or a ModelConfig. This model is the
+                default and the escalation target.
+            choice_scoring: 'logprobs' or 'constrained' answers multiple-choice
+                questions in one short request (see choice_scoring.py); None
+                keeps the backend's own sample_choice
         """
+        if choice_scoring is not None and choice_scoring not in CHOICE_SCORING_MODES:
+            raise ValueError(f'choice_scoring must be one of {CHOICE_SCORING_MODES}, got {choice_scoring!r}')
         self.api_type = api_type
         self.model_name = model_name
         # Auto-load API key from config if not provided
@@ -57,6 +74,30 @@ class ModelConfig:
         self.base_url = base_url or get_base_url(api_type)
         self.device = device
         self.disable_language_model = disable_language_model
+        self.routes = dict(routes or {})
+        self.choice_scoring = choice_scoring
+
+    def route_configs(self) -> Dict[str, 'ModelConfig']:
+        """Return the routes as ModelConfigs."""
+        configs = {}
+        for tag, route in self.routes.items():
+            if isinstance(route, ModelConfig):
+                configs[tag] = route
+                continue
+            if isinstance(route, str):
+                route = {'model_name': route}
+            kwargs = {
+                'api_type': self.api_type,
+                'device': self.device,
+                'disable_language_model': self.disable_language_model,
+                'choice_scoring': self.choice_scoring,
+                **route,
+            }
+            if kwargs['api_type'] == self.api_type:
+                kwargs.setdefault('api_key', self.api_key)
+                kwargs.setdefault('base_url', self.base_url)
+            configs[tag] = ModelConfig(**kwargs)
+        return configs
 
 
 def create_model_config_from_environment(
@@ -99,7 +140,11 @@ def create_model_config_from_environment(
 
 
 def create_language_model(
-    config: Optional[ModelConfig] = None
+    config: Optional[ModelConfig] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    max_retries: int = 0,
+    budget: Optional[BudgetGuard] = None,
+    scheduler: Optional[RequestScheduler] = None,
 ) -> language_model.LanguageModel:
     """Create and configure a language model using standardized settings.
     
@@ -108,6 +153,16 @@ def create_language_model(
     
     Args:
         config: ModelConfig instance. If None, uses environment-based default.
+        telemetry: If given, the model is wrapped in an InstrumentedLanguageModel
+                   that records every call, and the recorder becomes the
+                   target of component events (see llm_telemetry.emit_event)
+        max_retries: Retries per call made by the telemetry wrapper
+        budget: Guard charged for every call, which can switch the routes
+                to its `degrade_routes` and pause the run (see
+                budget_guard.py); defaults to the active guard
+        scheduler: Rate limiter whose slots go to critical-path calls first
+                   (see request_scheduler.py); defaults to the active
+                   scheduler. Share one across models on the same limits.
         
     Returns:
         Configured language model instance
@@ -130,11 +185,84 @@ def create_language_model(
             model_name='gpt-4'
         )
         model = create_language_model(config)
+        
+        # Record per-call tokens and latency
+        telemetry = LLMTelemetry()
+        model = create_language_model(config, telemetry=telemetry)
+
+        # Send small judgments to a cheaper model (see model_router.py)
+        config = ModelConfig(model_name='gpt-4.1', routes={'desire_check': 'gpt-4.1-nano'})
+        model = create_language_model(config)
+
+        # Answer multiple-choice questions from token logprobs
+        config = ModelConfig(model_name='gpt-4.1-mini', choice_scoring='logprobs')
+        model = create_language_model(config)
+
+        # Stop at $5, moving every call to a nano model at 80% of it
+        guard = BudgetGuard(limit_usd=5.0, degrade_routes={'default': 'gpt-4.1-nano'})
+        model = create_language_model(config, budget=guard)
+
+        # At most 8 calls in flight, acting and resolution calls first
+        scheduler = RequestScheduler(max_concurrent=8, requests_per_minute=500)
+        model = create_language_model(config, scheduler=scheduler)
     """
     if config is None:
         config = create_model_config_from_environment()
+    if budget is None:
+        budget = get_active_budget()
+    if scheduler is None:
+        scheduler = get_active_scheduler()
     
-    return utils.language_model_setup(
+    model = _setup_single_model(config, telemetry, max_retries, budget, scheduler)
+    routes = {
+        tag: _setup_single_model(route_config, telemetry, max_retries, budget, scheduler)
+        for tag, route_config in config.route_configs().items()
+    }
+    if telemetry is not None:
+        set_active_telemetry(telemetry)
+    if budget is not None and budget.degrade_routes:
+        router = RoutedLanguageModel(model, routes)
+        budget.on_degrade(lambda: _degrade_routes(router, routes, config, telemetry, max_retries, budget, scheduler))
+        return router
+    if not routes:
+        return model
+    return RoutedLanguageModel(model, routes)
+
+
+def _degrade_routes(
+    router: RoutedLanguageModel,
+    routes: Mapping[str, language_model.LanguageModel],
+    config: ModelConfig,
+    telemetry: Optional[LLMTelemetry],
+    max_retries: int,
+    budget: BudgetGuard,
+    scheduler: Optional[RequestScheduler],
+) -> None:
+    """Point `router` at the budget's cheaper routes; models are built on first use.
+
+    A degraded 'default' also replaces the model of every configured tag the
+    degrade routes do not name, so no tag keeps an expensive model.
+    """
+    cheap_config = copy.copy(config)
+    cheap_config.routes = dict(budget.degrade_routes)
+    cheap = {
+        tag: _setup_single_model(route_config, telemetry, max_retries, budget, scheduler)
+        for tag, route_config in cheap_config.route_configs().items()
+    }
+    default = cheap.pop('default', None)
+    kept = dict(routes) if default is None else {tag: default for tag in routes}
+    router.set_routes({**kept, **cheap}, default)
+    print(f'[Budget Guard] routes degraded to {budget.degrade_routes}')
+
+
+def _setup_single_model(
+    config: ModelConfig,
+    telemetry: Optional[LLMTelemetry],
+    max_retries: int,
+    budget: Optional[BudgetGuard] = None,
+    scheduler: Optional[RequestScheduler] = None,
+) -> language_model.LanguageModel:
+    model = utils.language_model_setup(
         api_type=config.api_type,
         model_name=config.model_name,
         api_key=config.api_key,
@@ -142,6 +270,43 @@ def create_language_model(
         device=config.device,
         disable_language_model=config.disable_language_model
     )
+    if config.choice_scoring and not config.disable_language_model:
+        model = ChoiceScoringLanguageModel(
+            model,
+            client=_openai_client(config),
+            model_name=config.model_name,
+            mode=config.choice_scoring,
+        )
+    if scheduler is not None and not config.disable_language_model:
+        # Innermost, so each telemetry retry waits for its own slot.
+        model = ScheduledLanguageModel(model, scheduler, model_name=config.model_name)
+    if telemetry is not None:
+        model = InstrumentedLanguageModel(
+            model,
+            telemetry,
+            model_name=config.model_name,
+            max_retries=max_retries,
+        )
+    if budget is not None:
+        # Outside the telemetry wrapper, so a paused budget is not retried.
+        model = BudgetedLanguageModel(
+            model,
+            budget,
+            model_name=config.model_name,
+            price=(0.0, 0.0) if config.disable_language_model else None,
+        )
+    return model
+
+
+def _openai_client(config: ModelConfig) -> Any:
+    """Return an OpenAI client for `config`'s endpoint, or None for other APIs."""
+    if config.api_type != 'openai':
+        return None
+    try:
+        import openai
+    except ImportError:
+        return None
+    return openai.OpenAI(api_key=config.api_key, base_url=config.base_url)
 
 
 def create_simple_embedder(embedding_dim: int = 384) -> Callable[[str], np.ndarray]:
@@ -175,6 +340,8 @@ def create_simple_embedder(embedding_dim: int = 384) -> Callable[[str], np.ndarr
         # Convert to a simple vector with values between 0 and 1
         return np.array([float((hash_value + i) % 1000) / 1000.0 for i in range(embedding_dim)])
     
+    # Names the embedding cache store (see initializer_cache.cached_embedder).
+    simple_embedder.__name__ = f'simple_embedder_{embedding_dim}'
     return simple_embedder
 
 
@@ -231,9 +398,50 @@ def create_openai_embedder(
         )
         return np.array(response.data[0].embedding)
     
+    # Names the embedding cache store (see initializer_cache.cached_embedder).
+    openai_embedder.__name__ = f'openai_embedder_{model_name}'
     return openai_embedder
 
 
+def create_service_embedder(
+    socket_path: Optional[str] = None,
+    fallback: Optional[Callable[[str], np.ndarray]] = None,
+    timeout: float = 10.0,
+) -> Callable[[str], np.ndarray]:
+    """Create an embedder that uses the per-host embedding service.
+    
+    Every worker on the host shares the service's embedder, batches and cache
+    (see `embedding_service.py`). Returned vectors are read-only float32
+    views into the service's shared memory.
+    
+    Args:
+        socket_path: The service's Unix socket (default: EDUMIRROR_EMBEDDING_SOCKET
+            or /tmp/edumirror_embed.sock)
+        fallback: Embedder returned when no service is running; if None, a
+            missing service raises
+        timeout: Seconds to wait for the service to come up
+        
+    Returns:
+        Embedding function that takes text and returns numpy array
+        
+    Raises:
+        ConnectionError: If no service answers and there is no fallback
+        
+    Example:
+        embedder = create_service_embedder(fallback=create_simple_embedder())
+    """
+    from .embedding_service import DEFAULT_SOCKET, EMBEDDING_SOCKET_ENV, EmbeddingServiceClient
+    
+    socket_path = socket_path or os.getenv(EMBEDDING_SOCKET_ENV, DEFAULT_SOCKET)
+    try:
+        return EmbeddingServiceClient(socket_path, timeout=timeout if fallback is None else 0.0)
+    except ConnectionError:
+        if fallback is None:
+            raise
+        print(f'[Embedding Service] not reachable at {socket_path}; using the local embedder')
+        return fallback
+
+
 # Predefined configurations for common use cases
 # These now automatically use the configured API keys
 DEFAULT_CONFIG = create_model_config_from_environment('development')
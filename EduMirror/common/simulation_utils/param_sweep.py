@@ -0,0 +1,507 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parameter sweeps over scenario settings.
+
+Scenario variants used to be hand edits of `AGENT_DEFS`, `AGENT_MEMORIES`,
+scene lengths and the `predefined_setting` of value agents. A
+`ParameterSpace` describes those settings as parameters, generates designs
+(full grid, Latin hypercube, Sobol) and a `ParameterSweep` turns each design
+point into work-queue jobs (see `work_queue.py`). Configs are deduplicated by
+`config_hash`, so overlapping designs and reruns add no jobs, and
+`outcomes_table` joins every finished job's parameters and measured outcomes
+into one data frame.
+
+Parameter names select what a value changes while the scenario runs:
+
+- `agent.<name>.traits` / `agent.<name>.goal`: the agent's `AGENT_DEFS` entry
+- `agent.<name>.memories`: its `AGENT_MEMORIES` list
+- `agent.<name>.desire.<desire>`: initial desire value (0-10) in the
+  `predefined_setting` of a value agent
+- `agent.<name>.svo`: social personality of a social value agent
+  ('Altruistic', 'Prosocial', 'Individualistic', 'Competitive')
+- `num_rounds`: length of every scene
+- `intervention`: 'baseline', or the name of the one `InterventionSpec` run by
+  `run_interventions()` (scenarios using `InterventionScenarioRunner`; other
+  scenarios run all their interventions)
+
+Other names are kept in the job config for custom job functions.
+`ParameterSweep` refuses parameters that cannot change the target scenario's
+runs (see `ineffective_params`), e.g. desire values for a scenario without
+value agents.
+
+Limitation: no shipped scenario builds value agents or runs its
+interventions through `InterventionScenarioRunner.set_interventions`, so
+`agent.<name>.desire.<desire>`, `agent.<name>.svo` and `intervention` are
+refused for all of them today. Only `agent.<name>.traits`/`goal`/`memories`
+and `num_rounds` can be swept there. The other three apply to scenarios
+that are written with value agents or the runner.
+
+Usage:
+    space = ParameterSpace([
+        choice('agent.Mia.traits', [['jealous', 'impulsive'], ['calm', 'kind']]),
+        integer('num_rounds', 3, 8),
+    ])
+    sweep = ParameterSweep(space, 'the_spread_of_gossip', seeds=range(3))
+    sweep.enqueue(open_queue('sweep.db'), method='lhs', n=32)
+    # ... run workers ...
+    df = sweep.outcomes_table('sweep_runs')
+"""
+
+import contextlib
+import copy
+import dataclasses
+import glob
+import hashlib
+import importlib
+import itertools
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .adaptive_replicates import replicate_outcomes
+from .work_queue import SCENARIOS_DIR, Job, WorkQueue, run_scenario
+
+DESIGN_METHODS = ('grid', 'lhs', 'sobol')
+
+
+@dataclasses.dataclass(frozen=True)
+class Parameter:
+    """One swept setting: a list of choices or a numeric range."""
+    name: str
+    values: Optional[Sequence[Any]] = None
+    low: Optional[float] = None
+    high: Optional[float] = None
+    integer: bool = False
+
+    def from_unit(self, u: float) -> Any:
+        """Map `u` in [0, 1) to a value."""
+        if self.values is not None:
+            return self.values[min(int(u * len(self.values)), len(self.values) - 1)]
+        if self.integer:
+            return int(min(self.low + int(u * (self.high - self.low + 1)), self.high))
+        return float(self.low + u * (self.high - self.low))
+
+    def to_unit(self, value: Any) -> float:
+        """Map a value back into [0, 1] (choices by position)."""
+        if self.values is not None:
+            return (list(self.values).index(value) + 0.5) / len(self.values)
+        if self.high == self.low:
+            return 0.5
+        return (float(value) - self.low) / (self.high - self.low)
+
+    def levels(self, count: int) -> List[Any]:
+        """Grid values: every choice, or `count` evenly spaced range values."""
+        if self.values is not None:
+            return list(self.values)
+        points = np.linspace(self.low, self.high, count)
+        if self.integer:
+            return sorted({int(round(p)) for p in points})
+        return [float(p) for p in points]
+
+
+def choice(name: str, values: Sequence[Any]) -> Parameter:
+    return Parameter(name, values=list(values))
+
+
+def integer(name: str, low: int, high: int) -> Parameter:
+    return Parameter(name, low=low, high=high, integer=True)
+
+
+def real(name: str, low: float, high: float) -> Parameter:
+    return Parameter(name, low=low, high=high)
+
+
+def config_hash(config: Dict[str, Any]) -> str:
+    """Stable short hash of a config (key order does not matter)."""
+    data = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:12]
+
+
+def _halton(n: int, dim: int, seed: int) -> np.ndarray:
+    primes = [p for p in range(2, 1000) if all(p % q for q in range(2, int(p ** 0.5) + 1))][:dim]
+    points = np.zeros((n, dim))
+    for j, base in enumerate(primes):
+        for i in range(n):
+            f, r, k = 1.0, 0.0, i + 1
+            while k > 0:
+                f /= base
+                r += f * (k % base)
+                k //= base
+            points[i, j] = r
+    # Random shift keeps the low discrepancy and varies the design with `seed`.
+    return (points + np.random.default_rng(seed).random(dim)) % 1.0
+
+
+class ParameterSpace:
+    """A set of parameters and the designs over them."""
+
+    def __init__(self, parameters: Sequence[Parameter]):
+        names = [p.name for p in parameters]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Duplicate parameter names in {names}')
+        self.parameters = list(parameters)
+
+    @property
+    def names(self) -> List[str]:
+        return [p.name for p in self.parameters]
+
+    def grid(self, levels: int = 3) -> List[Dict[str, Any]]:
+        """Full factorial design; ranges contribute `levels` values each."""
+        axes = [p.levels(levels) for p in self.parameters]
+        return [dict(zip(self.names, combo)) for combo in itertools.product(*axes)]
+
+    def latin_hypercube(self, n: int, seed: int = 0) -> List[Dict[str, Any]]:
+        """`n` points with every parameter's range split into `n` strata, one point each."""
+        rng = np.random.default_rng(seed)
+        unit = np.empty((n, len(self.parameters)))
+        for j in range(len(self.parameters)):
+            unit[:, j] = (rng.permutation(n) + rng.random(n)) / n
+        return self.from_unit(unit)
+
+    def sobol(self, n: int, seed: int = 0) -> List[Dict[str, Any]]:
+        """`n` scrambled Sobol points (a shifted Halton sequence without scipy)."""
+        try:
+            from scipy.stats import qmc
+            unit = qmc.Sobol(d=len(self.parameters), scramble=True, seed=seed).random(n)
+        except ImportError:
+            unit = _halton(n, len(self.parameters), seed)
+        return self.from_unit(unit)
+
+    def design(self, method: str = 'lhs', n: Optional[int] = None, seed: int = 0,
+               levels: int = 3) -> List[Dict[str, Any]]:
+        """Dispatch to `grid` (ignores `n`), `latin_hypercube` or `sobol`."""
+        if method not in DESIGN_METHODS:
+            raise ValueError(f'method must be one of {DESIGN_METHODS}, got {method!r}')
+        if method == 'grid':
+            return self.grid(levels)
+        if n is None:
+            raise ValueError(f'{method} designs need n')
+        return self.latin_hypercube(n, seed) if method == 'lhs' else self.sobol(n, seed)
+
+    def from_unit(self, unit: np.ndarray) -> List[Dict[str, Any]]:
+        return [{p.name: p.from_unit(u) for p, u in zip(self.parameters, row)} for row in unit]
+
+    def encode(self, configs: Iterable[Dict[str, Any]]) -> np.ndarray:
+        """Configs as rows of unit-scaled features, in parameter order."""
+        return np.array([[p.to_unit(c[p.name]) for p in self.parameters] for c in configs], dtype=float)
+
+
+# -- applying a config to a scenario run --------------------------------------
+
+def _agent_params(params: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    by_agent: Dict[str, Dict[str, Any]] = {}
+    for key, value in params.items():
+        if not key.startswith('agent.'):
+            continue
+        rest = key[len('agent.'):]
+        if '.desire.' in rest:
+            name, desire = rest.split('.desire.', 1)
+            by_agent.setdefault(name, {}).setdefault('desire', {})[desire] = value
+        else:
+            # rpartition keeps dotted names such as 'Mrs. Baker' whole.
+            name, _, field = rest.rpartition('.')
+            by_agent.setdefault(name, {})[field] = value
+    return by_agent
+
+
+@contextlib.contextmanager
+def applied_params(params: Dict[str, Any], scenario: Optional[str] = None) -> Iterator[None]:
+    """Apply `params` to scenario runs inside the block, then restore everything.
+
+    Patches the scenario's `agents` module (`AGENT_DEFS`, `AGENT_MEMORIES`),
+    the value-agent constructors of `AgentFactory`, concordia's `SceneSpec`
+    (for `num_rounds`) and `InterventionScenarioRunner.set_interventions`.
+    """
+    from concordia.typing import scene as scene_lib
+    from ..agent.agent_factory import AgentFactory
+    from .intervention_runner import InterventionScenarioRunner
+
+    by_agent = _agent_params(params)
+    restore: List[Any] = []
+
+    def patch(owner: Any, attr: str, value: Any) -> None:
+        restore.append((owner, attr, getattr(owner, attr)))
+        setattr(owner, attr, value)
+
+    if scenario is not None and by_agent:
+        try:
+            agents_module = importlib.import_module(f'scenarios.{scenario}.agents')
+        except ImportError:
+            agents_module = None
+        if agents_module is not None:
+            defs = copy.deepcopy(getattr(agents_module, 'AGENT_DEFS', []))
+            for spec in defs:
+                for field in ('traits', 'goal'):
+                    if field in by_agent.get(spec.get('name'), {}):
+                        spec[field] = by_agent[spec['name']][field]
+            memories = copy.deepcopy(getattr(agents_module, 'AGENT_MEMORIES', {}))
+            for name, fields in by_agent.items():
+                if 'memories' in fields:
+                    memories[name] = list(fields['memories'])
+            # Mutated in place: scenario mains import these names directly.
+            if hasattr(agents_module, 'AGENT_DEFS'):
+                original_defs = list(agents_module.AGENT_DEFS)
+                agents_module.AGENT_DEFS[:] = defs
+                restore.append((agents_module.AGENT_DEFS, slice(None), original_defs))
+            if hasattr(agents_module, 'AGENT_MEMORIES'):
+                original_memories = dict(agents_module.AGENT_MEMORIES)
+                agents_module.AGENT_MEMORIES.clear()
+                agents_module.AGENT_MEMORIES.update(memories)
+                restore.append((agents_module.AGENT_MEMORIES, None, original_memories))
+
+    if any('desire' in f or 'svo' in f for f in by_agent.values()):
+        create_individual = AgentFactory.create_value_agent_individual
+        create_social = AgentFactory.create_value_agent_social
+
+        def with_overrides(kwargs: Dict[str, Any], name: str) -> Dict[str, Any]:
+            fields = by_agent.get(name, {})
+            if 'desire' in fields:
+                kwargs['predefined_setting'] = {**kwargs.get('predefined_setting', {}), **fields['desire']}
+            return kwargs
+
+        def individual(self, name, *args, **kwargs):
+            return create_individual(self, name, *args, **with_overrides(kwargs, name))
+
+        def social(self, name, *args, **kwargs):
+            kwargs = with_overrides(kwargs, name)
+            if 'svo' in by_agent.get(name, {}):
+                kwargs['social_personality'] = by_agent[name]['svo']
+            return create_social(self, name, *args, **kwargs)
+
+        patch(AgentFactory, 'create_value_agent_individual', individual)
+        patch(AgentFactory, 'create_value_agent_social', social)
+
+    if 'num_rounds' in params:
+        rounds = int(params['num_rounds'])
+        base_spec = scene_lib.SceneSpec
+
+        class FixedRoundsSceneSpec(base_spec):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                object.__setattr__(self, 'num_rounds', rounds)
+
+        patch(scene_lib, 'SceneSpec', FixedRoundsSceneSpec)
+
+    intervention = params.get('intervention')
+    if intervention not in (None, 'baseline'):
+        set_interventions = InterventionScenarioRunner.set_interventions
+
+        def only_selected(self, interventions):
+            selected = [i for i in interventions if intervention in (i.name, i.output_label)]
+            if not selected:
+                raise ValueError(f'Unknown intervention {intervention!r}')
+            return set_interventions(self, selected)
+
+        patch(InterventionScenarioRunner, 'set_interventions', only_selected)
+
+    try:
+        yield
+    finally:
+        for owner, attr, value in reversed(restore):
+            if attr is None:
+                owner.clear()
+                owner.update(value)
+            elif isinstance(attr, slice):
+                owner[attr] = value
+            else:
+                setattr(owner, attr, value)
+
+
+def _scenario_source(scenario: str) -> str:
+    sources = []
+    for path in sorted(glob.glob(os.path.join(SCENARIOS_DIR, scenario, '*.py'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            sources.append(f.read())
+    return '\n'.join(sources)
+
+
+def ineffective_params(scenario: str, names: Iterable[str]) -> Dict[str, str]:
+    """Return the parameters among `names` that `applied_params` cannot apply to `scenario`.
+
+    Checks the scenario's code for what each parameter patches: value agents
+    for `.desire.` (and social ones for `.svo`), `InterventionScenarioRunner`
+    for `intervention`, and an `AGENT_DEFS` entry for `agent.<name>.*`.
+
+    Returns:
+        Parameter name -> reason it has no effect
+    """
+    source = _scenario_source(scenario)
+    try:
+        agent_defs = importlib.import_module(f'scenarios.{scenario}.agents').AGENT_DEFS
+        agent_names = {spec.get('name') for spec in agent_defs}
+    except (ImportError, AttributeError):
+        agent_names = None
+    reasons: Dict[str, str] = {}
+    for name in names:
+        if name == 'intervention' and '.set_interventions(' not in source:
+            reasons[name] = 'the scenario does not run its interventions through InterventionScenarioRunner'
+        if not name.startswith('agent.'):
+            continue
+        rest = name[len('agent.'):]
+        agent = rest.split('.desire.', 1)[0] if '.desire.' in rest else rest.rpartition('.')[0]
+        if agent_names is not None and agent not in agent_names:
+            reasons[name] = f'{agent!r} is not in the scenario\'s AGENT_DEFS'
+        elif '.desire.' in name and 'create_value_agent_' not in source:
+            reasons[name] = 'the scenario builds no value agents'
+        elif name.endswith('.svo') and 'create_value_agent_social' not in source:
+            reasons[name] = 'the scenario builds no social value agents'
+    return reasons
+
+
+def collect_run_outcomes(output_dir: str) -> Dict[str, float]:
+    """Flatten the measurement files under `output_dir`.
+
+    Survey results become `<prefix>:<player>:survey:<dimension>`, rater
+    results `<prefix>:rubric:<rubric>:<item>`, where `<prefix>` is the file
+    name the scenario saved them under. `DesireStore.to_parquet` files
+    contribute each agent's final desire deltas as
+    `<prefix>:<agent>:desire:<desire>`.
+    """
+    outcomes: Dict[str, float] = {}
+    for path in sorted(glob.glob(os.path.join(output_dir, '**', '*.parquet'), recursive=True)):
+        prefix = os.path.basename(path)[:-len('.parquet')]
+        try:
+            df = pd.read_parquet(path)
+        except (ImportError, ValueError, OSError):
+            continue
+        if not {'agent', 'step', 'desire', 'delta'} <= set(df.columns):
+            continue
+        final = df.sort_values('step').groupby(['agent', 'desire'])['delta'].last()
+        for (agent, desire), delta in final.items():
+            outcomes[f'{prefix}:{agent}:desire:{desire}'] = float(delta)
+    for path in sorted(glob.glob(os.path.join(output_dir, '**', '*_results.csv'), recursive=True)):
+        prefix = os.path.basename(path)[:-len('_results.csv')]
+        df = pd.read_csv(path)
+        if {'rubric', 'item_id', 'score'} <= set(df.columns):
+            flat = {f'{prefix}:{k}': v for k, v in replicate_outcomes(rating_df=df).items()}
+        else:
+            df = df.set_index(df.columns[0])
+            flat = {}
+            for player in df.index:
+                for key, value in replicate_outcomes(survey_df=df, player=player).items():
+                    flat[f'{prefix}:{player}:{key}'] = value
+        outcomes.update(flat)
+    return outcomes
+
+
+def run_sweep_job(job: Job, output_dir: str) -> Dict[str, Any]:
+    """Work-queue target: run one scenario config and return its outcomes."""
+    scenario = job.config['scenario']
+    params = job.config.get('params', {})
+    with applied_params(params, scenario):
+        run_scenario(scenario, job.condition, job.config.get('model_config'))
+    return {
+        'scenario': scenario,
+        'params': params,
+        'config_hash': job.config.get('config_hash', config_hash(params)),
+        'outcomes': collect_run_outcomes(output_dir),
+    }
+
+
+class ParameterSweep:
+    """Expands designs over a `ParameterSpace` into deduplicated scenario jobs."""
+
+    def __init__(
+        self,
+        space: ParameterSpace,
+        scenario: str,
+        seeds: Iterable[int] = (0,),
+        fixed: Optional[Dict[str, Any]] = None,
+        model_config: Optional[Dict[str, Any]] = None,
+    ):
+        """Initialize the sweep.
+
+        Args:
+            space: The swept parameters
+            scenario: Scenario directory under `scenarios/`
+            seeds: Replicates run for every config
+            fixed: Parameters set to the same value in every config
+            model_config: `create_model_config_from_environment` overrides
+
+        Raises:
+            ValueError: If a swept or fixed parameter has no effect on
+                `scenario` (see `ineffective_params`)
+        """
+        ineffective = ineffective_params(scenario, [*space.names, *(fixed or {})])
+        if ineffective:
+            details = '; '.join(f'{name}: {reason}' for name, reason in ineffective.items())
+            raise ValueError(f'Parameters with no effect on {scenario}: {details}')
+        self.space = space
+        self.scenario = scenario
+        self.seeds = list(seeds)
+        self.fixed = dict(fixed or {})
+        self.model_config = dict(model_config or {})
+
+    def configs(self, method: str = 'lhs', n: Optional[int] = None, seed: int = 0,
+                levels: int = 3) -> List[Dict[str, Any]]:
+        """Design points with the fixed parameters, without duplicate configs."""
+        unique: Dict[str, Dict[str, Any]] = {}
+        for point in self.space.design(method, n, seed, levels):
+            config = {**self.fixed, **point}
+            unique.setdefault(config_hash(config), config)
+        return list(unique.values())
+
+    def jobs(self, configs: Iterable[Dict[str, Any]]) -> List[Job]:
+        """One job per config and seed; the condition follows `intervention`."""
+        jobs = []
+        for params in configs:
+            condition = 'baseline' if params.get('intervention', 'baseline') == 'baseline' else 'interventions'
+            payload = {'scenario': self.scenario, 'params': params, 'config_hash': config_hash(params)}
+            if self.model_config:
+                payload['model_config'] = self.model_config
+            for seed in self.seeds:
+                jobs.append(Job(target='common.simulation_utils.param_sweep:run_sweep_job',
+                                condition=condition, seed=seed, config=payload))
+        return jobs
+
+    def enqueue(self, queue: WorkQueue, method: str = 'lhs', n: Optional[int] = None, seed: int = 0,
+                levels: int = 3) -> int:
+        """Enqueue a design; returns the number of new jobs (known configs are skipped)."""
+        return queue.enqueue_many(self.jobs(self.configs(method, n, seed, levels)))
+
+    def outcomes_table(self, work_root: str, path: Optional[str] = None) -> pd.DataFrame:
+        """One row per finished job of this scenario: ids, seed, parameters and outcomes.
+
+        Args:
+            work_root: The workers' `work_root`
+            path: Also write the table to this CSV file
+        """
+        rows = []
+        for result_file in sorted(glob.glob(os.path.join(work_root, '*', 'result.json'))):
+            with open(result_file, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            result = record.get('result') or {}
+            if not isinstance(result, dict) or result.get('scenario') != self.scenario:
+                continue
+            with open(os.path.join(os.path.dirname(result_file), 'job.json'), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+            row = {'job_id': record['job_id'], 'config_hash': result.get('config_hash'),
+                   'condition': job.get('condition'), 'seed': job.get('seed')}
+            row.update({f'param:{k}': _cell(v) for k, v in result.get('params', {}).items()})
+            row.update(result.get('outcomes', {}))
+            rows.append(row)
+        df = pd.DataFrame(rows)
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            df.to_csv(path, index=False)
+        return df
+
+
+def _cell(value: Any) -> Any:
+    # Trait lists and other structured values become one readable cell.
+    return value if isinstance(value, (int, float, str, bool)) or value is None else json.dumps(value)
@@ -0,0 +1,420 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Large-population classroom mode.
+
+Scenarios hand-define 3-6 agents in `AGENT_DEFS`. This module generates whole
+classes (30-200 students) from role templates, connects them through a sparse
+social graph (friend groups, seating neighbours, a few random cross-group
+ties) and schedules scenes over small interaction neighbourhoods of that
+graph. Combined with `SceneBuilder.run_scenes_with_early_termination(...,
+co_present_only=True)`, only the agents of the current neighbourhood observe
+and act, so per-step cost scales with the active participants rather than the
+class size.
+
+Example:
+    population = generate_population(
+        [AgentTemplate(role='student', goals=[...], traits=[...])], size=60)
+    entities = population.create_agents(AgentFactory(model, embedder))
+    scheduler = NeighbourhoodScheduler(population.graph, group_size=4)
+    scenes = scheduler.make_scenes(builder, break_type, num_scenes=20, num_rounds=6)
+    builder.run_scenes_with_early_termination(
+        scenes, entities, leading_game_masters=[initializer], co_present_only=True)
+"""
+
+import dataclasses
+import itertools
+import json
+import random
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from concordia.typing import scene as scene_lib
+
+from .scene_builder import SEQUENTIAL_ENGINE, SceneBuilder
+
+
+DEFAULT_NAME_POOL = (
+    'Ava', 'Ben', 'Chloe', 'Daniel', 'Ella', 'Finn', 'Grace', 'Henry', 'Isla', 'Jack',
+    'Kai', 'Lily', 'Mason', 'Nora', 'Owen', 'Priya', 'Quinn', 'Ruby', 'Sam', 'Tara',
+    'Umar', 'Vera', 'Wyatt', 'Xin', 'Yara', 'Zane', 'Aria', 'Blake', 'Cora', 'Dylan',
+    'Emma', 'Felix', 'Gia', 'Hugo', 'Ivy', 'Jonah', 'Kira', 'Liam', 'Maya', 'Nico',
+)
+
+FRIEND_TIE = 'friend'
+SEAT_TIE = 'seat'
+RANDOM_TIE = 'acquaintance'
+
+
+@dataclasses.dataclass(frozen=True)
+class AgentTemplate:
+    """Role template from which population members are sampled.
+
+    `memories` may contain a `{name}` placeholder for the member's name.
+    """
+
+    role: str
+    goals: Sequence[str]
+    traits: Sequence[str]
+    traits_per_agent: int = 3
+    memories: Sequence[str] = ()
+    memories_per_agent: int = 2
+    weight: float = 1.0
+
+
+class SocialGraph:
+    """Undirected social graph with typed ties between agent names."""
+
+    def __init__(self, names: Sequence[str]):
+        """Initialize a graph without ties.
+
+        Args:
+            names: Agent names (the graph's nodes)
+        """
+        self._adjacency: Dict[str, Dict[str, set]] = {name: {} for name in names}
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._adjacency)
+
+    def add_tie(self, a: str, b: str, kind: str = FRIEND_TIE) -> None:
+        if a == b:
+            return
+        self._adjacency[a].setdefault(b, set()).add(kind)
+        self._adjacency[b].setdefault(a, set()).add(kind)
+
+    def neighbours(self, name: str, kinds: Optional[Sequence[str]] = None) -> List[str]:
+        ties = self._adjacency[name]
+        if kinds is None:
+            return sorted(ties)
+        return sorted(other for other, tie_kinds in ties.items() if tie_kinds.intersection(kinds))
+
+    def tie_kinds(self, a: str, b: str) -> List[str]:
+        return sorted(self._adjacency[a].get(b, ()))
+
+    def degree(self, name: str) -> int:
+        return len(self._adjacency[name])
+
+    def num_ties(self) -> int:
+        return sum(len(ties) for ties in self._adjacency.values()) // 2
+
+    def density(self) -> float:
+        n = len(self._adjacency)
+        return 2 * self.num_ties() / (n * (n - 1)) if n > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        ties = [
+            [a, b, sorted(kinds)]
+            for a, others in self._adjacency.items()
+            for b, kinds in others.items()
+            if a < b
+        ]
+        return {'names': self.names, 'ties': ties}
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> 'SocialGraph':
+        graph = cls(data['names'])
+        for a, b, kinds in data['ties']:
+            for kind in kinds:
+                graph.add_tie(a, b, kind)
+        return graph
+
+
+def build_classroom_graph(
+    names: Sequence[str],
+    friend_group_size: int = 4,
+    seats_per_row: int = 6,
+    cross_group_tie_prob: float = 0.1,
+    seed: int = 0,
+) -> SocialGraph:
+    """Build a sparse classroom graph.
+
+    Args:
+        names: Agent names, in seating order (row-major)
+        friend_group_size: Size of the random, fully connected friend groups
+        seats_per_row: Seats per row; left/right and front/back neighbours are tied
+        cross_group_tie_prob: Per-agent probability of one extra random acquaintance
+        seed: Random seed
+
+    Returns:
+        The social graph
+    """
+    rng = random.Random(seed)
+    graph = SocialGraph(names)
+
+    shuffled = list(names)
+    rng.shuffle(shuffled)
+    for start in range(0, len(shuffled), friend_group_size):
+        for a, b in itertools.combinations(shuffled[start:start + friend_group_size], 2):
+            graph.add_tie(a, b, FRIEND_TIE)
+
+    if seats_per_row > 0:
+        for index, name in enumerate(names):
+            if index % seats_per_row != seats_per_row - 1 and index + 1 < len(names):
+                graph.add_tie(name, names[index + 1], SEAT_TIE)
+            if index + seats_per_row < len(names):
+                graph.add_tie(name, names[index + seats_per_row], SEAT_TIE)
+
+    if len(names) > 1:
+        for name in names:
+            if rng.random() < cross_group_tie_prob:
+                other = rng.choice([n for n in names if n != name])
+                graph.add_tie(name, other, RANDOM_TIE)
+    return graph
+
+
+@dataclasses.dataclass
+class ClassroomPopulation:
+    """Generated agents in the scenarios' `AGENT_DEFS` / `AGENT_MEMORIES` format."""
+
+    agent_defs: List[Dict[str, Any]]
+    agent_memories: Dict[str, List[str]]
+    graph: SocialGraph
+
+    @property
+    def names(self) -> List[str]:
+        return [spec['name'] for spec in self.agent_defs]
+
+    def player_specific_context(self) -> Dict[str, str]:
+        """Return the initializer's `player_specific_context` (name -> role)."""
+        return {spec['name']: spec['role'] for spec in self.agent_defs}
+
+    def known_agents(self, name: str) -> List[str]:
+        """Return `name` and its graph neighbours.
+
+        Pass this as `agent_names` to `AgentFactory.create_value_agent_social`
+        so the social value tracker only models the agent's neighbourhood.
+        """
+        return [name, *self.graph.neighbours(name)]
+
+    def create_agents(self, factory: Any, **kwargs) -> List[Any]:
+        """Build one basic agent per member with `factory`.
+
+        Each agent is seeded with its `agent_memories` as formative memories.
+
+        Args:
+            factory: An `AgentFactory`
+            **kwargs: Extra arguments for the factory's create_* methods
+
+        Returns:
+            The agents, in population order
+        """
+        agents: List[Any] = []
+        for spec in self.agent_defs:
+            common = dict(
+                name=spec['name'],
+                goal=spec['goal'],
+                traits=spec['traits'],
+                formative_memories=list(self.agent_memories.get(spec['name'], [])),
+                **kwargs,
+            )
+            if spec['role'] == 'student':
+                agents.append(factory.create_student(**common))
+            elif spec['role'] == 'teacher':
+                agents.append(factory.create_teacher(**common))
+            else:
+                agents.append(factory.create_custom_agent(role_description=spec['role'], **common))
+        return agents
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'agent_defs': self.agent_defs,
+                'agent_memories': self.agent_memories,
+                'graph': self.graph.to_dict(),
+            }, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'ClassroomPopulation':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(
+            agent_defs=data['agent_defs'],
+            agent_memories=data['agent_memories'],
+            graph=SocialGraph.from_dict(data['graph']),
+        )
+
+
+def _member_names(size: int, name_pool: Sequence[str]) -> List[str]:
+    names: List[str] = []
+    for index in range(size):
+        base = name_pool[index % len(name_pool)]
+        cycle = index // len(name_pool)
+        names.append(base if cycle == 0 else f'{base} {cycle + 1}')
+    return names
+
+
+def generate_population(
+    templates: Sequence[AgentTemplate],
+    size: int,
+    seed: int = 0,
+    name_pool: Sequence[str] = DEFAULT_NAME_POOL,
+    fixed_agents: Sequence[Mapping[str, Any]] = (),
+    **graph_kwargs,
+) -> ClassroomPopulation:
+    """Sample a population from role templates.
+
+    Args:
+        templates: Role templates, sampled proportionally to their weight
+        size: Number of generated members
+        seed: Random seed for sampling and the social graph
+        name_pool: First names; reused with a numeric suffix when exhausted
+        fixed_agents: Hand-defined `AGENT_DEFS` entries (e.g. the teacher or
+            the scenario's main characters) placed before the generated ones
+        **graph_kwargs: Forwarded to `build_classroom_graph`
+
+    Returns:
+        The population and its social graph
+    """
+    rng = random.Random(seed)
+    taken = {spec['name'] for spec in fixed_agents}
+    pool = [n for n in _member_names(size + len(taken), name_pool) if n not in taken]
+    weights = [t.weight for t in templates]
+
+    agent_defs: List[Dict[str, Any]] = [dict(spec) for spec in fixed_agents]
+    agent_memories: Dict[str, List[str]] = {}
+    for name in pool[:size]:
+        template = rng.choices(templates, weights=weights)[0]
+        agent_defs.append({
+            'name': name,
+            'role': template.role,
+            'goal': rng.choice(list(template.goals)),
+            'traits': rng.sample(list(template.traits), min(template.traits_per_agent, len(template.traits))),
+        })
+        memories = rng.sample(list(template.memories), min(template.memories_per_agent, len(template.memories)))
+        agent_memories[name] = [m.format(name=name) for m in memories]
+
+    graph = build_classroom_graph([spec['name'] for spec in agent_defs], seed=seed, **graph_kwargs)
+    return ClassroomPopulation(agent_defs=agent_defs, agent_memories=agent_memories, graph=graph)
+
+
+class NeighbourhoodScheduler:
+    """Picks small interaction groups from a social graph.
+
+    Each group is seeded by the member who has been inactive longest, plus
+    that member's least recently active neighbours. Over a run every member
+    is activated, while each scene stays neighbourhood-sized.
+    """
+
+    def __init__(
+        self,
+        graph: SocialGraph,
+        group_size: int = 4,
+        seed: int = 0,
+        always_include: Sequence[str] = (),
+        tie_kinds: Optional[Sequence[str]] = None,
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            graph: The population's social graph
+            group_size: Maximum number of graph members per group
+            seed: Random seed for tie-breaking
+            always_include: Members added to every group (e.g. the teacher)
+            tie_kinds: Only follow these tie kinds (default: all)
+        """
+        self._graph = graph
+        self._group_size = group_size
+        self._rng = random.Random(seed)
+        self._always_include = list(always_include)
+        self._tie_kinds = tie_kinds
+        self._last_active: Dict[str, int] = {
+            name: -1 for name in graph.names if name not in self._always_include
+        }
+        self._turn = 0
+
+    def _least_recent(self, names: Sequence[str]) -> List[str]:
+        keyed = [(self._last_active[name], self._rng.random(), name) for name in names]
+        return [name for _, _, name in sorted(keyed)]
+
+    def next_group(self) -> List[str]:
+        focal = self._least_recent(list(self._last_active))[0]
+        neighbours = [
+            n for n in self._graph.neighbours(focal, self._tie_kinds) if n in self._last_active
+        ]
+        group = [focal, *self._least_recent(neighbours)[:self._group_size - 1]]
+        for name in group:
+            self._last_active[name] = self._turn
+        self._turn += 1
+        return [*self._always_include, *group]
+
+    def schedule(self, num_groups: int) -> List[List[str]]:
+        return [self.next_group() for _ in range(num_groups)]
+
+    def make_scenes(
+        self,
+        builder: SceneBuilder,
+        scene_type: scene_lib.SceneTypeSpec,
+        num_scenes: int,
+        num_rounds: int,
+        premise_fn: Optional[Callable[[str, Sequence[str]], Sequence[str]]] = None,
+        engine: str = SEQUENTIAL_ENGINE,
+    ) -> List[scene_lib.SceneSpec]:
+        """Schedule `num_scenes` scenes of `scene_type` over successive groups.
+
+        Args:
+            builder: Scene builder used to create the scene specs
+            scene_type: Scene type; leave `possible_participants` unset
+            num_scenes: Number of scenes (groups) to schedule
+            num_rounds: Rounds per scene
+            premise_fn: Optional `(name, group) -> premise lines` for each
+                participant; defaults to the scene type's premise for the
+                names it lists and a generated line naming the group for the
+                others
+            engine: Engine for every scene (see `SceneBuilder.make_scene`)
+
+        Returns:
+            The scene specs, in order
+        """
+        scenes: List[scene_lib.SceneSpec] = []
+        for group in self.schedule(num_scenes):
+            if premise_fn is not None:
+                premise = {name: list(premise_fn(name, group)) for name in group}
+            else:
+                premise = _default_premise(scene_type, group)
+            scenes.append(builder.make_scene(
+                scene_type=scene_type,
+                participants=group,
+                num_rounds=num_rounds,
+                premise=premise,
+                engine=engine,
+            ))
+        return scenes
+
+
+def _default_premise(
+    scene_type: scene_lib.SceneTypeSpec,
+    group: Sequence[str],
+) -> Dict[str, List[str]]:
+    # The scene tracker looks up every participant's premise, but a scene
+    # type's default premise only lists the names it was written for.
+    defaults = scene_type.default_premise or {}
+    setting = scene_type.name.replace('_', ' ')
+    premise: Dict[str, List[str]] = {}
+    for name in group:
+        if name in defaults:
+            premise[name] = list(defaults[name])
+            continue
+        others = [other for other in group if other != name]
+        with_others = f' with {", ".join(others)}' if others else ''
+        premise[name] = [f'{name} is at the {setting}{with_others}.']
+    return premise
+
+
+def activation_counts(scenes: Sequence[scene_lib.SceneSpec]) -> List[Tuple[str, int]]:
+    """Return (name, number of scenes) for everybody scheduled in `scenes`."""
+    counts: Dict[str, int] = {}
+    for scene in scenes:
+        for name in scene.participants:
+            counts[name] = counts.get(name, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
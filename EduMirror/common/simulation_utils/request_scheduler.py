@@ -0,0 +1,432 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Priority scheduling of language model calls under a shared rate limit.
+
+Agents, game masters, branches and measurement share one client. When its
+limits are reached, the calls that block the simulation (the acting agent's
+`get_action_attempt`, the game master's resolution) should not wait behind
+rubric judging, comic narration or memory summaries.
+
+`RequestScheduler` admits calls within `max_concurrent` in-flight requests
+and optional requests- and tokens-per-minute buckets. Calls that cannot start
+wait in one queue per priority class, and the classes share the free slots by
+weight (weighted fair queuing): with the default weights, a saturated
+scheduler gives 8 of every 11 slots to 'critical' calls, but 'low' calls
+still progress. When nothing waits, calls start at once.
+
+A call's class comes from, in order:
+- `with model_priority('low'): ...` around the call
+- its call-site tag (see model_router.py): 'act', 'imagine' and
+  'gm_resolution' are critical; 'rating', 'narration' and 'summary' are low
+- the calling component's class (`ObservationSummary`,
+  `MemoryConsolidation` are low)
+- 'normal' otherwise
+
+A call failing with a rate-limit error (HTTP 429) stops all dispatch for its
+`Retry-After` (or an exponential backoff) and is queued again, so the
+critical calls are the first to go out after it.
+
+A scheduler only sees its own process. Processes on one quota (the jobs of
+all work-queue workers) pass the same `shared_path`: the per-minute buckets
+and 429 pauses then live in that SQLite file, so together they stay within
+the limits. `max_concurrent` still applies per process.
+
+Example:
+    scheduler = RequestScheduler(max_concurrent=8, requests_per_minute=500)
+    model = create_language_model(config, scheduler=scheduler)
+    ...  # build agents and run the simulation
+    print(scheduler.stats())
+"""
+
+import contextlib
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from collections.abc import Collection, Mapping, Sequence
+from typing import Any, Dict, Iterator, Optional
+
+from concordia.language_model import language_model
+
+from .llm_telemetry import _find_call_site, count_tokens, emit_event
+from .model_router import DEFAULT_COMPONENT_TAGS, current_route
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+LOW = 'low'
+PRIORITY_CLASSES = (CRITICAL, NORMAL, LOW)
+
+DEFAULT_WEIGHTS = {CRITICAL: 8.0, NORMAL: 2.0, LOW: 1.0}
+
+DEFAULT_TAG_PRIORITIES = {
+    'act': CRITICAL,
+    'imagine': CRITICAL,
+    'gm_resolution': CRITICAL,
+    'rating': LOW,
+    'narration': LOW,
+    'summary': LOW,
+}
+
+DEFAULT_COMPONENT_PRIORITIES = {
+    'ObservationSummary': LOW,
+    'MemoryConsolidation': LOW,
+}
+
+_local = threading.local()
+_active_scheduler: Optional['RequestScheduler'] = None
+
+
+def get_active_scheduler() -> Optional['RequestScheduler']:
+    """Returns the scheduler `create_language_model` uses when given none."""
+    return _active_scheduler
+
+
+def set_active_scheduler(scheduler: Optional['RequestScheduler']) -> None:
+    """Sets the scheduler `create_language_model` uses when given none."""
+    global _active_scheduler
+    _active_scheduler = scheduler
+
+
+@contextlib.contextmanager
+def model_priority(priority: str) -> Iterator[None]:
+    """Schedule the model calls made inside the block in class `priority`."""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f'priority must be one of {PRIORITY_CLASSES}, got {priority!r}')
+    stack = _local.__dict__.setdefault('priorities', [])
+    stack.append(priority)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether `error` is a provider rate-limit response (HTTP 429)."""
+    return (type(error).__name__ == 'RateLimitError'
+            or getattr(error, 'status_code', None) == 429
+            or getattr(getattr(error, 'response', None), 'status_code', None) == 429)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Ticket:
+    __slots__ = ('priority', 'tokens', 'start', 'finish', 'enqueued')
+
+    def __init__(self, priority: str, tokens: int, start: float, finish: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.start = start
+        self.finish = finish
+        self.enqueued = time.monotonic()
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute / 60` per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` (capped at the capacity) is available."""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+        need = min(amount, self.capacity)
+        return 0.0 if self.level >= need else (need - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+
+class _SharedLimits:
+    """Rate buckets and pauses kept in a SQLite file shared by processes.
+
+    Uses wall-clock time, which processes (and hosts) share. A delay check
+    and the following take are separate transactions, so processes admitted
+    together can overdraw a bucket; the debt then delays everybody's next
+    calls.
+    """
+
+    def __init__(self, path: str):
+        # isolation_level=None lets BEGIN IMMEDIATE take the write lock up front.
+        self._conn = sqlite3.connect(path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL, updated REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS pauses (name TEXT PRIMARY KEY, until REAL)')
+
+    def refill_and_take(self, name: str, capacity: float, rate: float, amount: float) -> float:
+        """Refill bucket `name`, take `amount` from it; returns the level before taking."""
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._conn.execute('SELECT level, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+            now = time.time()
+            level = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            self._conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (name, level - amount, now))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return level
+
+    def pause(self, seconds: float) -> None:
+        until = time.time() + seconds
+        self._conn.execute('INSERT INTO pauses VALUES (?, ?) ON CONFLICT(name) DO UPDATE '
+                           'SET until = MAX(until, excluded.until)', ('all', until))
+
+    def paused_for(self) -> float:
+        row = self._conn.execute('SELECT until FROM pauses WHERE name = ?', ('all',)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
+
+
+class _SharedBucket:
+    """`_Bucket` whose level lives in `_SharedLimits`."""
+
+    def __init__(self, limits: _SharedLimits, name: str, per_minute: float):
+        self._limits = limits
+        self._name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+
+    def delay(self, amount: float) -> float:
+        level = self._limits.refill_and_take(self._name, self.capacity, self.rate, 0.0)
+        need = min(amount, self.capacity)
+        return 0.0 if level >= need else (need - level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._limits.refill_and_take(self._name, self.capacity, self.rate, amount)
+
+
+class RequestScheduler:
+    """Admits model calls by priority class under concurrency and rate limits."""
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        weights: Mapping[str, float] = DEFAULT_WEIGHTS,
+        tag_priorities: Mapping[str, str] = DEFAULT_TAG_PRIORITIES,
+        component_priorities: Mapping[str, str] = DEFAULT_COMPONENT_PRIORITIES,
+        rate_limit_retries: int = 5,
+        backoff: float = 2.0,
+        shared_path: Optional[str] = None,
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            max_concurrent: Calls in flight at once
+            requests_per_minute: Request rate limit; None for no limit
+            tokens_per_minute: Token rate limit, counting each call's prompt
+                and `max_tokens` as providers do; None for no limit
+            weights: Priority class -> share of the slots while calls wait
+            tag_priorities: Call-site tag -> priority class
+            component_priorities: Component class name -> priority class,
+                for untagged calls
+            rate_limit_retries: Times a call rejected with HTTP 429 is queued
+                again before the error is raised
+            backoff: Initial pause after a 429 without `Retry-After`,
+                doubled per retry of the same call
+            shared_path: SQLite file holding the per-minute buckets and 429
+                pauses, for schedulers in several processes on one quota
+        """
+        self.max_concurrent = max_concurrent
+        self._weights = {c: float(weights.get(c, DEFAULT_WEIGHTS[c])) for c in PRIORITY_CLASSES}
+        self._tag_priorities = dict(tag_priorities)
+        self._component_priorities = dict(component_priorities)
+        self.rate_limit_retries = rate_limit_retries
+        self._backoff = backoff
+        self._shared = _SharedLimits(shared_path) if shared_path else None
+        if self._shared is not None:
+            self._requests = _SharedBucket(self._shared, 'requests', requests_per_minute) if requests_per_minute else None
+            self._tokens = _SharedBucket(self._shared, 'tokens', tokens_per_minute) if tokens_per_minute else None
+        else:
+            self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+            self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._cond = threading.Condition()
+        self._waiting: list = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._last_finish = {c: 0.0 for c in PRIORITY_CLASSES}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._stats = {c: {'calls': 0, 'waited': 0, 'wait_s': 0.0, 'max_wait_s': 0.0, 'rate_limited': 0}
+                       for c in PRIORITY_CLASSES}
+
+    @property
+    def tokens_limited(self) -> bool:
+        return self._tokens is not None
+
+    def priority_of_call(self) -> str:
+        """Priority class of a call made from the current stack and thread."""
+        stack = getattr(_local, 'priorities', None)
+        if stack:
+            return stack[-1]
+        tag, _ = current_route()
+        if tag is None:
+            _, component = _find_call_site()
+            if component in self._component_priorities:
+                return self._component_priorities[component]
+            tag = DEFAULT_COMPONENT_TAGS.get(component)
+        return self._tag_priorities.get(tag, NORMAL)
+
+    def _admit_delay(self, ticket: _Ticket) -> Optional[float]:
+        """0 if `ticket` may start now, else seconds to wait (None: until a call ends)."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._shared is not None:
+            paused = self._shared.paused_for()
+            if paused > 0:
+                return paused
+        if self._in_flight >= self.max_concurrent:
+            return None
+        delay = 0.0
+        if self._requests is not None:
+            delay = max(delay, self._requests.delay(1))
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.delay(ticket.tokens))
+        return delay
+
+    @contextlib.contextmanager
+    def slot(self, priority: str, tokens: int = 0) -> Iterator[None]:
+        """Wait for the turn of a call of class `priority`; the call runs in the block."""
+        with self._cond:
+            # Start-time fair queuing: each class advances its own virtual
+            # clock by 1/weight per call, and the earliest finish goes first.
+            start = max(self._vtime, self._last_finish[priority])
+            ticket = _Ticket(priority, tokens, start, start + 1.0 / self._weights[priority])
+            self._last_finish[priority] = ticket.finish
+            entry = (ticket.finish, PRIORITY_CLASSES.index(priority), next(self._seq), ticket)
+            heapq.heappush(self._waiting, entry)
+            while True:
+                delay = self._admit_delay(ticket) if self._waiting[0] is entry else None
+                if delay == 0:
+                    break
+                self._cond.wait(delay)
+            heapq.heappop(self._waiting)
+            self._vtime = ticket.start
+            self._in_flight += 1
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(tokens)
+            wait = time.monotonic() - ticket.enqueued
+            stats = self._stats[priority]
+            stats['calls'] += 1
+            stats['wait_s'] += wait
+            stats['max_wait_s'] = max(stats['max_wait_s'], wait)
+            if wait > 0.001:
+                stats['waited'] += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def pause(self, seconds: float, priority: str = NORMAL) -> None:
+        """Stop dispatching for `seconds` after a rate-limit response."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            if self._shared is not None:
+                self._shared.pause(seconds)
+            self._stats[priority]['rate_limited'] += 1
+            self._cond.notify_all()
+        emit_event('rate_limited', priority=priority, pause_s=seconds)
+
+    def retry_delay(self, error: BaseException, attempt: int) -> float:
+        return _retry_after(error) or self._backoff * (2 ** attempt)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per class: calls, calls that waited, total and max wait, 429s."""
+        with self._cond:
+            return {c: {**s, 'mean_wait_s': s['wait_s'] / s['calls'] if s['calls'] else 0.0}
+                    for c, s in self._stats.items()}
+
+
+class ScheduledLanguageModel(language_model.LanguageModel):
+    """Wraps a language model so every call waits for a `RequestScheduler` slot."""
+
+    def __init__(self, model: language_model.LanguageModel, scheduler: RequestScheduler, model_name: str = ''):
+        """Wrap `model`.
+
+        Args:
+            model: The language model whose calls are scheduled
+            scheduler: Scheduler shared by all models on the same limits
+            model_name: Model label
+        """
+        self._model = model
+        self.scheduler = scheduler
+        self._model_name = model_name
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def _call(self, tokens: int, fn) -> Any:
+        priority = self.scheduler.priority_of_call()
+        attempt = 0
+        while True:
+            with self.scheduler.slot(priority, tokens):
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.scheduler.rate_limit_retries:
+                        raise
+                    delay = self.scheduler.retry_delay(e, attempt)
+            self.scheduler.pause(delay, priority)
+            attempt += 1
+
+    def sample_text(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = language_model.DEFAULT_MAX_TOKENS,
+        terminators: Collection[str] = language_model.DEFAULT_TERMINATORS,
+        temperature: float = language_model.DEFAULT_TEMPERATURE,
+        timeout: float = language_model.DEFAULT_TIMEOUT_SECONDS,
+        seed: int | None = None,
+    ) -> str:
+        tokens = count_tokens(prompt) + max_tokens if self.scheduler.tokens_limited else 0
+        return self._call(tokens, lambda: self._model.sample_text(
+            prompt,
+            max_tokens=max_tokens,
+            terminators=terminators,
+            temperature=temperature,
+            timeout=timeout,
+            seed=seed,
+        ))
+
+    def sample_choice(
+        self,
+        prompt: str,
+        responses: Sequence[str],
+        *,
+        seed: int | None = None,
+    ) -> tuple[int, str, Mapping[str, Any]]:
+        tokens = 0
+        if self.scheduler.tokens_limited:
+            tokens = count_tokens(prompt) + sum(count_tokens(r) for r in responses)
+        return self._call(tokens, lambda: self._model.sample_choice(prompt, responses, seed=seed))
@@ -1,35 +1,229 @@
-from typing import Any, Mapping, Sequence
+import dataclasses
+import os
+from typing import Any, Callable, Mapping, Sequence
 from datetime import datetime
 
 from concordia.associative_memory import basic_associative_memory
 from concordia.prefabs.game_master import dialogic_and_dramaturgic as dialogic_gm
 from concordia.prefabs.game_master import formative_memories_initializer as initializer_gm
+from concordia.components.game_master import scene_tracker as scene_tracker_lib
 from concordia.environment.engines.sequential import Sequential
+from concordia.environment.engines.simultaneous import Simultaneous
+from concordia.typing import entity as entity_lib
 from concordia.typing import scene as scene_lib
 
+from .initializer_cache import INITIALIZER_CACHE_ENV, InitializerCache, cached_embedder
+
+
+END_MARKER = '[END]'
+
+# Bookkeeping entries written by concordia's SceneTracker into the game
+# master's memory; the tracker counts them to locate the current scene.
+_SCENE_TRACKER_TAGS = ('[scene counter]', '[scene type]', '[scene participants]')
+
+SceneEndPredicate = Callable[[Sequence[str]], bool]
+
+
+def end_marker_predicate(events: Sequence[str]) -> bool:
+    return bool(events) and END_MARKER in events[-1]
+
+
+SEQUENTIAL_ENGINE = 'sequential'
+SIMULTANEOUS_ENGINE = 'simultaneous'
+ENGINES = (SEQUENTIAL_ENGINE, SIMULTANEOUS_ENGINE)
+
+
+@dataclasses.dataclass(frozen=True)
+class EngineSceneSpec(scene_lib.SceneSpec):
+    # SceneSpec that also says which engine runs it. Plain SceneSpecs run
+    # with the sequential engine.
+    engine: str = SEQUENTIAL_ENGINE
+
+    def __post_init__(self):
+        if self.engine not in ENGINES:
+            raise ValueError(f'Unknown engine {self.engine!r}; expected one of {ENGINES}')
+
+
+def scene_engine(scene: scene_lib.SceneSpec) -> str:
+    return getattr(scene, 'engine', SEQUENTIAL_ENGINE)
+
+
+def _never_end(events: Sequence[str]) -> bool:
+    return False
+
+
+class _SceneEndDetection:
+    # Ends the run as soon as `end_predicate` holds for the actions taken so
+    # far, in addition to the game master's own termination check. Logged
+    # steps are shifted by `step_offset`, so consecutive runs into one log
+    # keep numbering 'Step' by position.
+    def __init__(self, end_predicate: SceneEndPredicate | None = None, *args, step_offset: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._end_predicate = end_predicate or _never_end
+        self._step_offset = step_offset
+        self.scene_events: list[str] = []
+        self.ended_early = False
+
+    def _log(self, log, steps, *args, **kwargs):
+        super()._log(log, steps + self._step_offset, *args, **kwargs)
+
+    def resolve(self, game_master, putative_event, verbose=False):
+        self.scene_events.append(putative_event)
+        return super().resolve(game_master=game_master, putative_event=putative_event, verbose=verbose)
+
+    def terminate(self, game_master, verbose=False):
+        if self.scene_events and self._end_predicate(self.scene_events):
+            self.ended_early = True
+            return True
+        return super().terminate(game_master, verbose)
+
+
+class _CoPresentEntities(Sequence):
+    # The entities an engine iterates over each step: everyone while
+    # `present` is None, otherwise only the named ones.
+    def __init__(self, entities: Sequence[Any]):
+        self._entities = list(entities)
+        self.present: set[str] | None = None
+
+    def _visible(self) -> list[Any]:
+        if self.present is None:
+            return self._entities
+        return [e for e in self._entities if e.name in self.present]
+
+    def __getitem__(self, index):
+        return self._visible()[index]
+
+    def __len__(self) -> int:
+        return len(self._visible())
+
+    def __iter__(self):
+        return iter(self._visible())
+
+
+class _CoPresence:
+    # Restricts observations and actions to the entities co-present with the
+    # active game master. `co_present` maps game master names to entity
+    # names; game masters not listed (e.g. the initializer) see everybody.
+    def __init__(self, *args, co_present: Mapping[str, Sequence[str]] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._co_present = co_present
+        self._view: _CoPresentEntities | None = None
+
+    def run_loop(self, game_masters, entities, **kwargs):
+        if self._co_present is not None:
+            entities = self._view = _CoPresentEntities(entities)
+        return super().run_loop(game_masters=game_masters, entities=entities, **kwargs)
+
+    def next_game_master(self, game_master, game_masters, verbose=False):
+        game_master = super().next_game_master(game_master, game_masters, verbose)
+        if self._view is not None:
+            present = self._co_present.get(game_master.name)
+            self._view.present = set(present) if present is not None else None
+        return game_master
+
+
+class SceneTerminatingSequential(_CoPresence, _SceneEndDetection, Sequential):
+    pass
+
+
+class ParallelSceneSimultaneous(_CoPresence, _SceneEndDetection, Simultaneous):
+    # Every participant of the current scene acts in each step, in parallel,
+    # and the game master resolves the joined actions once. The dialogic game
+    # master only ever names one actor, so the participants and their action
+    # specs are read from its scene tracker instead; game masters without a
+    # tracker (e.g. the initializer) are asked as usual.
+    def next_acting(self, game_master, entities, log_entry=None, log=None):
+        tracker = self._scene_tracker(game_master)
+        if tracker is None or tracker.is_done():
+            return super().next_acting(game_master, entities, log_entry=log_entry, log=log)
+        entities_by_name = {entity.name: entity for entity in entities}
+        participants = [name for name in tracker.get_participants() if name in entities_by_name]
+        if not participants:
+            return super().next_acting(game_master, entities, log_entry=log_entry, log=log)
+        # Still ask the game master once: event resolution attributes the
+        # joined actions to its currently active player.
+        game_master.act(action_spec=entity_lib.ActionSpec(
+            call_to_action=self._call_to_next_acting,
+            output_type=entity_lib.OutputType.NEXT_ACTING,
+            options=tuple(participants),
+        ))
+        if log is not None and hasattr(game_master, 'get_last_log'):
+            log_entry['next_acting'] = game_master.get_last_log()
+        action_spec = tracker.get_current_scene_type().action_spec
+        specs = []
+        for name in participants:
+            spec = action_spec.get(name) if isinstance(action_spec, Mapping) else action_spec
+            specs.append(spec if spec is not None else entity_lib.DEFAULT_ACTION_SPEC)
+        return [entities_by_name[name] for name in participants], specs
+
+    def _scene_tracker(self, game_master) -> scene_tracker_lib.SceneTracker | None:
+        for component in game_master.get_all_context_components().values():
+            if isinstance(component, scene_tracker_lib.SceneTracker):
+                return component
+        return None
+
+    def _log(self, log, steps, *args, **kwargs):
+        # Simultaneous summaries carry no event text; add the joined actions
+        # in the sequential engine's 'Step N gm --- event' form.
+        super()._log(log, steps, *args, **kwargs)
+        if self.scene_events:
+            log[-1]['Summary'] = f"{log[-1]['Summary']} --- {self.scene_events[-1]}"
+
 
 class SceneBuilder:
-    def __init__(self, model: Any, embedder_model: Any):
+    def __init__(
+        self,
+        model: Any,
+        embedder_model: Any,
+        initializer_cache_dir: str | None = None,
+        model_name: str | None = None,
+    ):
+        # With a cache directory (argument or EDUMIRROR_INITIALIZER_CACHE),
+        # initializer backstories and game-master embeddings are read from
+        # and written to disk, so reruns skip regenerating them. Cached
+        # backstories are keyed by `model_name` (the configured model).
         self._model = model
-        self._embedder_model = embedder_model
+        self._model_name = model_name
+        cache_dir = initializer_cache_dir or os.getenv(INITIALIZER_CACHE_ENV)
+        self._initializer_cache = InitializerCache(cache_dir) if cache_dir else None
+        self._embedder_model = cached_embedder(embedder_model, cache_dir)
 
     def _create_memory_bank(self) -> basic_associative_memory.AssociativeMemoryBank:
         return basic_associative_memory.AssociativeMemoryBank(
             sentence_embedder=self._embedder_model
         )
 
+    def _carry_over_memory_bank(
+        self,
+        previous: basic_associative_memory.AssociativeMemoryBank,
+    ) -> basic_associative_memory.AssociativeMemoryBank:
+        # New bank with the previous game master's memories (embeddings
+        # reused) minus scene-tracker bookkeeping, so the next scene's tracker
+        # starts counting from zero.
+        data = previous.get_data_frame()
+        kept = data[~data['text'].str.startswith(_SCENE_TRACKER_TAGS)].reset_index(drop=True)
+        bank = self._create_memory_bank()
+        bank.set_state({
+            'stored_hashes': [hash((text,)) for text in kept['text']],
+            'memory_bank': kept.to_json(),
+        })
+        return bank
+
     def build_dialogic_and_dramaturgic_game_master(
         self,
         name: str,
         entities: Sequence[Any],
         scenes: Sequence[scene_lib.SceneSpec],
+        memory_bank: basic_associative_memory.AssociativeMemoryBank | None = None,
     ) -> Any:
         params = {
             'name': name,
             'scenes': scenes,
         }
         prefab = dialogic_gm.GameMaster(params=params, entities=entities)
-        return prefab.build(model=self._model, memory_bank=self._create_memory_bank())
+        if memory_bank is None:
+            memory_bank = self._create_memory_bank()
+        return prefab.build(model=self._model, memory_bank=memory_bank)
 
     def build_initializer_game_master(
         self,
@@ -45,7 +239,10 @@ class SceneBuilder:
             'player_specific_memories': params.get('player_specific_memories', {}),
         }
         prefab = initializer_gm.GameMaster(params=gm_params, entities=entities)
-        return prefab.build(model=self._model, memory_bank=self._create_memory_bank())
+        game_master = prefab.build(model=self._model, memory_bank=self._create_memory_bank())
+        if self._initializer_cache is not None:
+            self._initializer_cache.attach(game_master, gm_params, self._model, model_name=self._model_name)
+        return game_master
 
     def make_scene_type(
         self,
@@ -70,15 +267,26 @@ class SceneBuilder:
         num_rounds: int,
         start_time: datetime | None = None,
         premise: Mapping[str, Sequence[str]] | None = None,
+        engine: str = SEQUENTIAL_ENGINE,
     ) -> scene_lib.SceneSpec:
-        return scene_lib.SceneSpec(
+        return EngineSceneSpec(
             scene_type=scene_type,
             participants=participants,
             num_rounds=num_rounds,
             start_time=start_time,
             premise=premise,
+            engine=engine,
         )
 
+    def _telemetry_step_callback(self):
+        # Steps restart at 0 in every run_loop; keep the telemetry step
+        # increasing across consecutive runs.
+        telemetry = getattr(self._model, 'telemetry', None)
+        if telemetry is None:
+            return None
+        base_step = telemetry.step
+        return lambda steps: telemetry.set_step(base_step + steps)
+
     def run_with_sequential_engine(
         self,
         game_masters: Sequence[Any],
@@ -96,4 +304,85 @@ class SceneBuilder:
             max_steps=max_steps,
             verbose=verbose,
             log=log,
-        )
\ No newline at end of file
+            checkpoint_callback=self._telemetry_step_callback(),
+        )
+
+    def run_with_simultaneous_engine(
+        self,
+        game_masters: Sequence[Any],
+        entities: Sequence[Any],
+        premise: str = '',
+        max_steps: int = 200,
+        verbose: bool = False,
+        log: list[Mapping[str, Any]] | None = None,
+    ) -> None:
+        # One step is one round in which all participants of the current
+        # scene act concurrently, so a step costs the slowest agent rather
+        # than the sum of all agents.
+        engine = ParallelSceneSimultaneous()
+        engine.run_loop(
+            game_masters=game_masters,
+            entities=entities,
+            premise=premise,
+            max_steps=max_steps,
+            verbose=verbose,
+            log=log,
+            checkpoint_callback=self._telemetry_step_callback(),
+        )
+
+    def run_scenes_with_early_termination(
+        self,
+        scenes: Sequence[scene_lib.SceneSpec],
+        entities: Sequence[Any],
+        leading_game_masters: Sequence[Any] = (),
+        game_master_name: str = 'conversation rules',
+        end_predicate: SceneEndPredicate | None = end_marker_predicate,
+        verbose: bool = False,
+        log: list[Mapping[str, Any]] | None = None,
+        co_present_only: bool = False,
+    ) -> list[tuple[int, int, str, list[str]]]:
+        # Runs each scene with its own game master, on the engine named by
+        # scene_engine(scene), for at most num_rounds steps, moving on as soon
+        # as `end_predicate` holds (None: never early). Each game master
+        # starts from the previous one's memories. Returns the actual (start,
+        # end, scene, participants) windows as 1-based positions in `log`.
+        # With co_present_only, each scene's game master knows only the
+        # scene's participants and nobody else observes or acts during it;
+        # leading game masters still reach every entity.
+        if log is None:
+            log = []
+        memory_bank = self._create_memory_bank()
+        windows: list[tuple[int, int, str, list[str]]] = []
+        for index, scene in enumerate(scenes):
+            if index > 0:
+                memory_bank = self._carry_over_memory_bank(memory_bank)
+            co_present = None
+            scene_entities = entities
+            if co_present_only:
+                co_present = {game_master_name: list(scene.participants)}
+                scene_entities = [e for e in entities if e.name in scene.participants]
+            game_master = self.build_dialogic_and_dramaturgic_game_master(
+                name=game_master_name,
+                entities=scene_entities,
+                scenes=[scene],
+                memory_bank=memory_bank,
+            )
+            game_masters = [*leading_game_masters, game_master] if index == 0 else [game_master]
+            start = len(log) + 1
+            if scene_engine(scene) == SIMULTANEOUS_ENGINE:
+                engine = ParallelSceneSimultaneous(end_predicate, co_present=co_present, step_offset=start - 1)
+            else:
+                engine = SceneTerminatingSequential(end_predicate, co_present=co_present, step_offset=start - 1)
+            engine.run_loop(
+                game_masters=game_masters,
+                entities=entities,
+                premise='',
+                max_steps=scene.num_rounds,
+                verbose=verbose,
+                log=log,
+                checkpoint_callback=self._telemetry_step_callback(),
+            )
+            if verbose and engine.ended_early:
+                print(f'[Scene] {scene.scene_type.name} ended after {len(log) - start + 1} of {scene.num_rounds} rounds')
+            windows.append((start, len(log), scene.scene_type.name, list(scene.participants)))
+        return windows
@@ -0,0 +1,915 @@
+# Copyright 2024 EduMirror Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coordinator/worker execution of scenario sweeps through a durable queue.
+
+A coordinator enqueues (target, condition, seed, config) jobs. Any number of
+worker processes, on any node that sees the queue, lease jobs one at a time,
+run each in a subprocess and write its outputs to `<work_root>/<job_id>/`.
+There is no broker; the queue is either
+
+- `SQLiteWorkQueue`: one SQLite file (local disk, or shared storage with
+  working POSIX locks)
+- `FileWorkQueue`: one JSON file per job moved between `queued/`, `leased/`,
+  `done/` and `failed/` directories with atomic renames (works on NFS)
+
+A leased job carries an expiry that the worker keeps pushing forward while
+the job runs. A job whose worker died is put back in the queue once the
+lease expires, up to `max_attempts` leases. Job ids hash the job contents, so
+enqueuing the same sweep twice adds nothing.
+
+Targets:
+- `scenario:<name>`: runs `run_<condition>()` of `scenarios/<name>/main.py`
+  (conditions 'baseline', 'interventions'); `config` entries override the
+  scenario's `create_model_config_from_environment` arguments
+- `<module>:<function>`: calls `function(job, output_dir)` and stores what it
+  returns in `result.json`
+
+Workers started with `--prewarm` fork each job from a forkserver that has
+already imported concordia, pandas and the EduMirror modules, instead of
+starting a fresh interpreter per job. `result.json` records the job's
+startup time either way; the `startup` command compares the two.
+
+Workers started with `--budget` run every job under a `BudgetGuard` sharing
+`<work_root>/spend/` (see budget_guard.py). A job paused by the shared
+budget goes back to the queue, the worker stops once that budget is spent and
+`<work_root>/spend_report.csv` sums the spend per scenario and condition. A
+job that spent only its `job_limit_usd` fails that attempt like any other
+error, and the worker keeps leasing. A rerun starts the job over: the
+scenario mains write to timestamped `results/<scenario>/run_<ts>/`
+directories and run their own branch loops, so no finished branch is reused.
+With `--scheduler` each job's model calls go through a `RequestScheduler`
+(see request_scheduler.py) that serves the critical path first. The
+per-minute limits are shared through `<work_root>/rate_limits.sqlite` by
+every job of every worker on that work root, so they hold for the whole
+sweep; `max_concurrent` applies per job.
+
+Usage (from the `EduMirror` directory):
+    python -m common.simulation_utils.work_queue enqueue --queue sweep.db \\
+        --target scenario:the_spread_of_gossip --conditions baseline,interventions --seeds 0-9
+    python -m common.simulation_utils.work_queue worker --queue sweep.db --work-root sweep_runs --prewarm
+    python -m common.simulation_utils.work_queue worker --queue sweep.db --work-root sweep_runs \\
+        --budget '{"limit_usd": 20, "degrade_routes": {"default": "gpt-4.1-nano"}}'
+    python -m common.simulation_utils.work_queue status --queue sweep.db
+    python -m common.simulation_utils.work_queue startup --work-root /tmp/startup
+"""
+
+import abc
+import argparse
+import dataclasses
+import hashlib
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import traceback
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+EDUMIRROR_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SCENARIOS_DIR = os.path.join(EDUMIRROR_ROOT, 'scenarios')
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+STATUSES = (QUEUED, LEASED, DONE, FAILED)
+
+# Exit code of a job paused by its budget guard (EX_TEMPFAIL).
+BUDGET_PAUSED_EXIT = 75
+
+
+@dataclasses.dataclass
+class Job:
+    """One unit of sweep work."""
+    target: str
+    condition: str = ''
+    seed: int = 0
+    config: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    job_id: str = ''
+    attempts: int = 0
+    worker: Optional[str] = None
+    lease_expires: Optional[float] = None
+    error: Optional[str] = None
+
+    def __post_init__(self):
+        if not self.job_id:
+            self.job_id = job_id_for(self.target, self.condition, self.seed, self.config)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Job':
+        fields = {f.name for f in dataclasses.fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in fields})
+
+
+def job_id_for(target: str, condition: str, seed: int, config: Dict[str, Any]) -> str:
+    payload = json.dumps([target, condition, seed, config], sort_keys=True, default=str)
+    name = f'{target.split(":")[-1]}_{condition}_{seed}'.replace('/', '_')
+    return f'{name}_{hashlib.sha1(payload.encode("utf-8")).hexdigest()[:10]}'
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+class WorkQueue(abc.ABC):
+    """Durable job queue with leases."""
+
+    def __init__(self, lease_seconds: float = 300.0, max_attempts: int = 3):
+        """Initialize the queue.
+
+        Args:
+            lease_seconds: How long a lease lasts without a heartbeat
+            max_attempts: Leases per job before it is marked failed
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue_many(self, jobs: Iterable[Job]) -> int:
+        """Add `jobs`; returns how many were new."""
+        return sum(int(self.enqueue(job)) for job in jobs)
+
+    @abc.abstractmethod
+    def enqueue(self, job: Job) -> bool:
+        """Add `job` unless a job with its id exists; returns whether it was added."""
+
+    @abc.abstractmethod
+    def lease(self, worker_id: str) -> Optional[Job]:
+        """Lease the oldest queued job to `worker_id`, first re-queuing expired leases."""
+
+    @abc.abstractmethod
+    def heartbeat(self, job: Job, worker_id: str) -> bool:
+        """Extend the lease; returns False if the worker no longer holds it."""
+
+    @abc.abstractmethod
+    def complete(self, job: Job, worker_id: str) -> bool:
+        """Mark the leased job done; returns False if the lease was lost."""
+
+    @abc.abstractmethod
+    def fail(self, job: Job, worker_id: str, error: str) -> bool:
+        """Re-queue the leased job, or mark it failed after `max_attempts`."""
+
+    @abc.abstractmethod
+    def release(self, job: Job, worker_id: str, reason: str) -> bool:
+        """Re-queue the leased job without counting the lease as an attempt."""
+
+    @abc.abstractmethod
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        """Return the jobs, optionally only those with `status`."""
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in STATUSES}
+        for status in STATUSES:
+            counts[status] = len(self.jobs(status))
+        return counts
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue kept in one SQLite file."""
+
+    def __init__(self, path: str, lease_seconds: float = 300.0, max_attempts: int = 3):
+        super().__init__(lease_seconds, max_attempts)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' job_id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_expires REAL,'
+                ' created REAL NOT NULL, updated REAL NOT NULL, error TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None lets BEGIN IMMEDIATE take the write lock up front.
+        return sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+
+    def _transaction(self, fn):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        job = Job.from_dict(json.loads(row[0]))
+        job.attempts, job.worker, job.lease_expires, job.error = row[1], row[2], row[3], row[4]
+        return job
+
+    def enqueue(self, job: Job) -> bool:
+        now = time.time()
+        payload = json.dumps({k: v for k, v in job.to_dict().items()
+                              if k in ('target', 'condition', 'seed', 'config', 'job_id')})
+
+        def insert(conn):
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO jobs (job_id, payload, status, created, updated) VALUES (?, ?, ?, ?, ?)',
+                (job.job_id, payload, QUEUED, now, now))
+            return cursor.rowcount > 0
+
+        return self._transaction(insert)
+
+    def _requeue_expired(self, conn, now: float) -> None:
+        conn.execute(
+            'UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,'
+            " worker = NULL, lease_expires = NULL, updated = ?, error = 'lease expired'"
+            ' WHERE status = ? AND lease_expires < ?',
+            (self.max_attempts, FAILED, QUEUED, now, LEASED, now))
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        def take(conn):
+            now = time.time()
+            self._requeue_expired(conn, now)
+            row = conn.execute(
+                'SELECT job_id FROM jobs WHERE status = ? ORDER BY created, job_id LIMIT 1', (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, updated = ?'
+                ' WHERE job_id = ?',
+                (LEASED, worker_id, now + self.lease_seconds, now, row[0]))
+            return self._row_to_job(conn.execute(
+                'SELECT payload, attempts, worker, lease_expires, error FROM jobs WHERE job_id = ?',
+                (row[0],)).fetchone())
+
+        return self._transaction(take)
+
+    def _update_owned(self, job: Job, worker_id: str, sql: str, params: tuple) -> bool:
+        def update(conn):
+            cursor = conn.execute(
+                f'UPDATE jobs SET {sql} WHERE job_id = ? AND status = ? AND worker = ?',
+                params + (job.job_id, LEASED, worker_id))
+            return cursor.rowcount > 0
+
+        return self._transaction(update)
+
+    def heartbeat(self, job: Job, worker_id: str) -> bool:
+        now = time.time()
+        return self._update_owned(job, worker_id, 'lease_expires = ?, updated = ?', (now + self.lease_seconds, now))
+
+    def complete(self, job: Job, worker_id: str) -> bool:
+        return self._update_owned(job, worker_id, 'status = ?, lease_expires = NULL, updated = ?, error = NULL',
+                                  (DONE, time.time()))
+
+    def fail(self, job: Job, worker_id: str, error: str) -> bool:
+        status = FAILED if job.attempts >= self.max_attempts else QUEUED
+        return self._update_owned(job, worker_id, 'status = ?, worker = NULL, lease_expires = NULL, updated = ?, error = ?',
+                                  (status, time.time(), error))
+
+    def release(self, job: Job, worker_id: str, reason: str) -> bool:
+        return self._update_owned(
+            job, worker_id,
+            'status = ?, worker = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0), updated = ?, error = ?',
+            (QUEUED, time.time(), reason))
+
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        conn = self._connect()
+        try:
+            query = 'SELECT payload, attempts, worker, lease_expires, error FROM jobs'
+            rows = conn.execute(query + ' WHERE status = ? ORDER BY created' if status else query + ' ORDER BY created',
+                                (status,) if status else ()).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_job(row) for row in rows]
+
+
+class FileWorkQueue(WorkQueue):
+    """Work queue kept as one JSON file per job under `root`.
+
+    A job's state is the directory holding its file. Leasing renames the file
+    from `queued/` to `leased/`, which only one worker can do. The lease
+    expiry is the leased file's modification time plus `lease_seconds`, and
+    heartbeats touch the file.
+    """
+
+    def __init__(self, root: str, lease_seconds: float = 300.0, max_attempts: int = 3):
+        super().__init__(lease_seconds, max_attempts)
+        self.root = root
+        for status in STATUSES:
+            os.makedirs(os.path.join(root, status), exist_ok=True)
+
+    def _path(self, status: str, job_id: str) -> str:
+        return os.path.join(self.root, status, f'{job_id}.json')
+
+    def _read(self, path: str) -> Optional[Job]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return Job.from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: str, job: Job) -> None:
+        tmp = f'{path}.tmp.{uuid.uuid4().hex[:8]}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp, path)
+
+    def _move(self, job_id: str, src: str, dst: str) -> bool:
+        try:
+            os.rename(self._path(src, job_id), self._path(dst, job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def enqueue(self, job: Job) -> bool:
+        if any(os.path.exists(self._path(status, job.job_id)) for status in STATUSES):
+            return False
+        # Written under a temporary name and renamed, so lease() never sees a partial file.
+        self._write(self._path(QUEUED, job.job_id), Job.from_dict({**job.to_dict(), 'attempts': 0}))
+        return True
+
+    def _requeue_expired(self) -> None:
+        now = time.time()
+        for name in os.listdir(os.path.join(self.root, LEASED)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.root, LEASED, name)
+            try:
+                expires = os.path.getmtime(path) + self.lease_seconds
+            except FileNotFoundError:
+                continue
+            if expires >= now:
+                continue
+            job = self._read(path)
+            if job is None:
+                continue
+            # Claim the expired lease by renaming it aside first, so only one
+            # worker re-queues it.
+            claimed = f'{path}.expired.{uuid.uuid4().hex[:8]}'
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            if os.path.getmtime(claimed) + self.lease_seconds >= time.time():
+                # A heartbeat landed in between; hand the lease back.
+                os.rename(claimed, path)
+                continue
+            job.worker, job.lease_expires, job.error = None, None, 'lease expired'
+            status = FAILED if job.attempts >= self.max_attempts else QUEUED
+            self._write(self._path(status, job.job_id), job)
+            os.remove(claimed)
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        self._requeue_expired()
+        queued_dir = os.path.join(self.root, QUEUED)
+        names = [n for n in os.listdir(queued_dir) if n.endswith('.json')]
+        names.sort(key=lambda n: (self._mtime(os.path.join(queued_dir, n)), n))
+        for name in names:
+            job_id = name[:-len('.json')]
+            if not self._move(job_id, QUEUED, LEASED):
+                continue
+            path = self._path(LEASED, job_id)
+            # rename keeps the enqueue mtime; refresh it before anyone sees an expired lease.
+            os.utime(path)
+            job = self._read(path)
+            job.attempts += 1
+            job.worker = worker_id
+            job.lease_expires = time.time() + self.lease_seconds
+            self._write(path, job)
+            return job
+        return None
+
+    @staticmethod
+    def _mtime(path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            return float('inf')
+
+    def _owned(self, job: Job, worker_id: str) -> bool:
+        current = self._read(self._path(LEASED, job.job_id))
+        return current is not None and current.worker == worker_id
+
+    def heartbeat(self, job: Job, worker_id: str) -> bool:
+        if not self._owned(job, worker_id):
+            return False
+        try:
+            os.utime(self._path(LEASED, job.job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, job: Job, worker_id: str) -> bool:
+        return self._owned(job, worker_id) and self._move(job.job_id, LEASED, DONE)
+
+    def fail(self, job: Job, worker_id: str, error: str) -> bool:
+        if not self._owned(job, worker_id):
+            return False
+        job.error = error
+        job.worker, job.lease_expires = None, None
+        status = FAILED if job.attempts >= self.max_attempts else QUEUED
+        self._write(self._path(LEASED, job.job_id), job)
+        return self._move(job.job_id, LEASED, status)
+
+    def release(self, job: Job, worker_id: str, reason: str) -> bool:
+        if not self._owned(job, worker_id):
+            return False
+        job.error = reason
+        job.worker, job.lease_expires = None, None
+        job.attempts = max(job.attempts - 1, 0)
+        self._write(self._path(LEASED, job.job_id), job)
+        return self._move(job.job_id, LEASED, QUEUED)
+
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        jobs = []
+        for s in ([status] if status else STATUSES):
+            directory = os.path.join(self.root, s)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.json'):
+                    job = self._read(os.path.join(directory, name))
+                    if job is not None:
+                        jobs.append(job)
+        return jobs
+
+
+def open_queue(location: str, lease_seconds: float = 300.0, max_attempts: int = 3) -> WorkQueue:
+    """Open a `SQLiteWorkQueue` for `*.db`/`*.sqlite` paths, else a `FileWorkQueue` directory."""
+    if location.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteWorkQueue(location, lease_seconds, max_attempts)
+    return FileWorkQueue(location, lease_seconds, max_attempts)
+
+
+def sweep_jobs(target: str, conditions: Iterable[str], seeds: Iterable[int],
+               configs: Iterable[Dict[str, Any]] = ({},)) -> List[Job]:
+    """Return the cross product of conditions, seeds and configs as jobs."""
+    configs = list(configs)
+    return [Job(target=target, condition=c, seed=s, config=dict(cfg))
+            for cfg in configs for c in conditions for s in seeds]
+
+
+# -- running jobs -------------------------------------------------------------
+
+# Imported once by the forkserver of a `Worker(prewarm=True)`; the agent
+# factory import also loads both value-agent modules. Model clients are not
+# created before forking (their connection pools do not survive a fork).
+PREWARM_MODULES = (
+    'numpy',
+    'pandas',
+    'openai',
+    'concordia.prefabs.entity.basic_with_plan',
+    'common',
+    'common.simulation_utils.work_queue',
+)
+
+
+def _import_modules(modules: Iterable[str]) -> None:
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # Same as the forkserver preload: a module that fails to import is
+            # left to the job, which reports the real error.
+            pass
+
+
+def run_scenario(name: str, condition: str, model_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Run `run_<condition>()` of `scenarios/<name>/main.py` in this process.
+
+    `model_config` entries override the arguments of the scenario's
+    `create_model_config_from_environment` calls.
+    """
+    path = os.path.join(SCENARIOS_DIR, name, 'main.py')
+    spec = importlib.util.spec_from_file_location(f'queued_scenario_{name.replace("-", "_")}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if model_config and hasattr(module, 'create_model_config_from_environment'):
+        make_config = module.create_model_config_from_environment
+
+        def configured(*args, **kwargs):
+            return make_config(*args, **{**kwargs, **model_config})
+
+        # Scenario mains build their config through this module-level name.
+        module.create_model_config_from_environment = configured
+    entry = getattr(module, f'run_{condition}')
+    entry()
+    return {'scenario': name, 'entry': entry.__name__}
+
+
+def noop(job: Job, output_dir: str) -> Dict[str, Any]:
+    """Job target that does nothing; used to measure worker startup."""
+    return {}
+
+
+def run_job(job: Job, output_dir: str) -> Any:
+    """Run `job` in this process and return its JSON-serializable result."""
+    random.seed(job.seed)
+    try:
+        import numpy as np
+        np.random.seed(job.seed)
+    except ImportError:
+        pass
+    if job.target.startswith('scenario:'):
+        return run_scenario(job.target.split(':', 1)[1], job.condition, job.config)
+    module_name, _, function_name = job.target.partition(':')
+    function = getattr(importlib.import_module(module_name), function_name)
+    return function(job, output_dir)
+
+
+class _ForkedJob:
+    """`subprocess.Popen`-like handle of a job forked from the forkserver."""
+
+    def __init__(self, process: Any):
+        self._process = process
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.exitcode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        self._process.join(timeout)
+        if self._process.exitcode is None:
+            raise subprocess.TimeoutExpired('forked job', timeout)
+        return self._process.exitcode
+
+    def kill(self) -> None:
+        self._process.kill()
+
+
+def _forked_job_main(job_file: str, output_dir: str, modules: List[str]) -> None:
+    os.chdir(output_dir)
+    log = open(os.path.join(output_dir, 'output.log'), 'a', encoding='utf-8')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.exit(_run_job_main(job_file, output_dir, modules))
+
+
+class Worker:
+    """Leases jobs from a queue and runs each in a fresh process.
+
+    By default every job gets a new interpreter (`python -m ...`), which pays
+    for importing concordia, pandas and the value agents each time. With
+    `prewarm=True` a forkserver imports `PREWARM_MODULES` once and each job
+    is forked from it, so a job starts with everything already loaded. As
+    with any forkserver use, a script creating a prewarmed worker needs an
+    `if __name__ == '__main__':` guard.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        work_root: str,
+        worker_id: Optional[str] = None,
+        heartbeat_interval: Optional[float] = None,
+        poll_interval: float = 5.0,
+        job_timeout: Optional[float] = None,
+        prewarm: bool = False,
+        prewarm_modules: Iterable[str] = PREWARM_MODULES,
+        budget: Optional[Dict[str, Any]] = None,
+        scheduler: Optional[Dict[str, Any]] = None,
+    ):
+        """Initialize the worker.
+
+        Args:
+            queue: The shared queue
+            work_root: Parent of the per-job output directories
+            worker_id: Name recorded on leases; defaults to host-pid-random
+            heartbeat_interval: Seconds between lease renewals; defaults to a
+                third of the queue's lease
+            poll_interval: Seconds to wait when the queue is empty
+            job_timeout: Seconds after which a job's process is killed
+            prewarm: Fork jobs from a forkserver that preloaded
+                `prewarm_modules`; falls back to fresh interpreters where
+                forkserver is unavailable (Windows)
+            prewarm_modules: Modules imported before each job starts, by the
+                forkserver or by the fresh interpreter
+            budget: `BudgetGuard` arguments for every job; the ledger defaults
+                to `<work_root>/spend`
+            scheduler: `RequestScheduler` arguments for every job; the
+                rate limits are shared through `<work_root>/rate_limits.sqlite`
+                unless `shared_path` is given
+        """
+        self.queue = queue
+        self.work_root = work_root
+        self.worker_id = worker_id or default_worker_id()
+        self._heartbeat_interval = heartbeat_interval or queue.lease_seconds / 3
+        self._poll_interval = poll_interval
+        self._job_timeout = job_timeout
+        self._prewarm_modules = list(prewarm_modules)
+        self._context = None
+        if prewarm:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                self._context = multiprocessing.get_context('forkserver')
+                self._context.set_forkserver_preload(self._prewarm_modules)
+            else:
+                print('[Work Queue] forkserver unavailable, starting each job cold')
+        self._budget = None
+        if budget is not None:
+            self._budget = dict(budget)
+            self._budget['ledger_dir'] = os.path.abspath(
+                self._budget.get('ledger_dir') or os.path.join(work_root, 'spend'))
+        self._scheduler = None
+        if scheduler is not None:
+            self._scheduler = dict(scheduler)
+            self._scheduler['shared_path'] = os.path.abspath(
+                self._scheduler.get('shared_path') or os.path.join(work_root, 'rate_limits.sqlite'))
+        self.completed: List[str] = []
+        self.failed: List[str] = []
+        self.startup_times: List[float] = []
+        self.paused = False
+
+    @property
+    def start_mode(self) -> str:
+        return 'warm' if self._context is not None else 'cold'
+
+    def start(self) -> float:
+        """Start the forkserver now (no-op when cold); returns seconds taken."""
+        start = time.time()
+        if self._context is not None:
+            # The server imports the preload modules in the background; a
+            # first fork waits until it has.
+            process = self._context.Process(target=_import_modules, args=([],))
+            process.start()
+            process.join()
+        return time.time() - start
+
+    def run(self, max_jobs: Optional[int] = None, exit_when_empty: bool = True) -> None:
+        """Process jobs until the queue is empty (or forever) or `max_jobs` ran."""
+        guard = None
+        if self._budget is not None:
+            from .budget_guard import BudgetGuard
+            guard = BudgetGuard(**{**self._budget, 'job_id': f'{self.worker_id}-monitor'})
+        processed = 0
+        try:
+            while (max_jobs is None or processed < max_jobs) and not self.paused:
+                if guard is not None and guard.exhausted():
+                    self.paused = True
+                    break
+                job = self.queue.lease(self.worker_id)
+                if job is None:
+                    if exit_when_empty and not self.queue.jobs(LEASED):
+                        return
+                    time.sleep(self._poll_interval)
+                    continue
+                self.process(job)
+                processed += 1
+        finally:
+            if self.paused:
+                print(f'[Work Queue] {self.worker_id}: budget spent, no more jobs leased')
+            if self._budget is not None:
+                from .budget_guard import write_spend_report
+                write_spend_report(self._budget['ledger_dir'], os.path.join(self.work_root, 'spend_report.csv'))
+
+    def process(self, job: Job) -> bool:
+        """Run one leased job, keeping its lease alive; returns whether it succeeded."""
+        output_dir = os.path.join(self.work_root, job.job_id)
+        os.makedirs(output_dir, exist_ok=True)
+        job_file = os.path.join(output_dir, 'job.json')
+        result_file = os.path.join(output_dir, 'result.json')
+        if os.path.exists(result_file):
+            os.remove(result_file)
+        with open(job_file, 'w', encoding='utf-8') as f:
+            json.dump({**job.to_dict(), 'dispatched_at': time.time(), 'start_mode': self.start_mode,
+                       'budget': self._budget, 'scheduler': self._scheduler}, f, indent=2)
+
+        start = time.time()
+        proc = self._launch(job_file, output_dir)
+        lost_lease = self._wait_with_heartbeat(job, proc, start)
+
+        if lost_lease:
+            self.failed.append(job.job_id)
+            return False
+        if proc.returncode == BUDGET_PAUSED_EXIT:
+            self.queue.release(job, self.worker_id, 'paused by the budget guard')
+            self.paused = True
+            return False
+        if proc.returncode == 0 and os.path.exists(result_file):
+            with open(result_file, 'r', encoding='utf-8') as f:
+                startup = json.load(f).get('startup_s')
+            if startup is not None:
+                self.startup_times.append(startup)
+            if self.queue.complete(job, self.worker_id):
+                self.completed.append(job.job_id)
+                return True
+            return False
+        error = self._last_error(output_dir, proc.returncode)
+        self.queue.fail(job, self.worker_id, error)
+        self.failed.append(job.job_id)
+        return False
+
+    def _launch(self, job_file: str, output_dir: str) -> Any:
+        if self._context is not None:
+            process = self._context.Process(
+                target=_forked_job_main, args=(job_file, output_dir, self._prewarm_modules))
+            process.start()
+            return _ForkedJob(process)
+        cmd = [sys.executable, '-m', 'common.simulation_utils.work_queue', 'run-job', job_file, output_dir,
+               '--modules', ','.join(self._prewarm_modules)]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            p for p in (EDUMIRROR_ROOT, os.environ.get('PYTHONPATH')) if p))
+        with open(os.path.join(output_dir, 'output.log'), 'a', encoding='utf-8') as log:
+            return subprocess.Popen(cmd, cwd=output_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    def _wait_with_heartbeat(self, job: Job, proc: Any, start: float) -> bool:
+        while True:
+            try:
+                proc.wait(timeout=self._heartbeat_interval)
+                return False
+            except subprocess.TimeoutExpired:
+                pass
+            if self._job_timeout is not None and time.time() - start > self._job_timeout:
+                proc.kill()
+                proc.wait()
+                return False
+            if not self.queue.heartbeat(job, self.worker_id):
+                # The lease expired and another worker owns the job now.
+                proc.kill()
+                proc.wait()
+                return True
+
+    @staticmethod
+    def _last_error(output_dir: str, returncode: Optional[int]) -> str:
+        try:
+            with open(os.path.join(output_dir, 'output.log'), 'r', encoding='utf-8') as f:
+                lines = [line.rstrip() for line in f if line.strip()]
+        except OSError:
+            lines = []
+        return lines[-1] if lines else f'exit code {returncode}'
+
+
+def _job_scenario(job: Job) -> str:
+    if job.target.startswith('scenario:'):
+        return job.target.split(':', 1)[1]
+    return job.config.get('scenario', job.target)
+
+
+def _run_job_main(job_file: str, output_dir: str, modules: Iterable[str] = ()) -> int:
+    _import_modules(modules)
+    with open(job_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    job = Job.from_dict(data)
+    start = time.time()
+    # Dispatch to here: interpreter start and imports when cold, a fork when warm.
+    startup = start - data['dispatched_at'] if 'dispatched_at' in data else None
+    guard = None
+    if data.get('budget'):
+        from .budget_guard import BudgetGuard, set_active_budget
+        guard = BudgetGuard(**{**data['budget'], 'job_id': job.job_id,
+                               'scenario': _job_scenario(job), 'condition': job.condition})
+        set_active_budget(guard)
+    if data.get('scheduler'):
+        from .request_scheduler import RequestScheduler, set_active_scheduler
+        set_active_scheduler(RequestScheduler(**data['scheduler']))
+    try:
+        result = run_job(job, output_dir)
+    except Exception:
+        traceback.print_exc()
+        if guard is None:
+            return 1
+        if not guard.paused:
+            guard.close()
+            return 1
+    spend = guard.close() if guard is not None else None
+    if guard is not None and guard.paused:
+        # Also when the scenario swallowed the error: its outputs are incomplete.
+        print(f'[Work Queue] {job.job_id}: {guard.pause_reason}')
+        if guard.pause_scope == 'job' and not guard.exhausted():
+            # Only this job's limit is spent: a failed attempt, not a sweep pause.
+            return 1
+        return BUDGET_PAUSED_EXIT
+    with open(os.path.join(output_dir, 'result.json'), 'w', encoding='utf-8') as f:
+        json.dump({'job_id': job.job_id, 'start_mode': data.get('start_mode'), 'startup_s': startup,
+                   'wall_time_s': time.time() - start, 'result': result, 'spend': spend},
+                  f, indent=2, default=str)
+    return 0
+
+
+def measure_startup(work_root: str, runs: int = 5, modules: Iterable[str] = PREWARM_MODULES) -> Dict[str, Any]:
+    """Time `runs` no-op jobs started cold and warm.
+
+    Returns:
+        Per mode the median and individual startup seconds; 'warm' also has
+        the one-off forkserver start ('server_start_s')
+    """
+    report: Dict[str, Any] = {}
+    for mode in ('cold', 'warm'):
+        queue = FileWorkQueue(os.path.join(work_root, f'{mode}_queue'))
+        worker = Worker(queue, os.path.join(work_root, f'{mode}_runs'), prewarm=(mode == 'warm'),
+                        prewarm_modules=modules, heartbeat_interval=1.0)
+        server_start = worker.start()
+        for i in range(runs):
+            queue.enqueue(Job('common.simulation_utils.work_queue:noop', mode, i, {'nonce': uuid.uuid4().hex}))
+            worker.process(queue.lease(worker.worker_id))
+        times = sorted(worker.startup_times)
+        report[worker.start_mode] = {
+            'median_s': times[len(times) // 2] if times else None,
+            'startup_s': worker.startup_times,
+            'failed': len(worker.failed),
+        }
+        if worker.start_mode == 'warm':
+            report['warm']['server_start_s'] = server_start
+    return report
+
+
+def _parse_seeds(text: str) -> List[int]:
+    seeds: List[int] = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            seeds.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            seeds.append(int(part))
+    return seeds
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Durable work queue for scenario sweeps')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = sub.add_parser('enqueue', help='Add sweep jobs')
+    enqueue.add_argument('--queue', required=True, help='SQLite file (*.db) or queue directory')
+    enqueue.add_argument('--target', required=True, help='scenario:<name> or module:function')
+    enqueue.add_argument('--conditions', default='baseline', help='Comma-separated conditions')
+    enqueue.add_argument('--seeds', default='0', help='Seeds, e.g. 0-9 or 1,5,7')
+    enqueue.add_argument('--config', action='append', default=[], help='JSON config overrides; repeat for several')
+
+    worker = sub.add_parser('worker', help='Lease and run jobs')
+    worker.add_argument('--queue', required=True)
+    worker.add_argument('--work-root', required=True, help='Parent of the per-job directories')
+    worker.add_argument('--lease-seconds', type=float, default=300.0)
+    worker.add_argument('--max-attempts', type=int, default=3)
+    worker.add_argument('--max-jobs', type=int, default=None)
+    worker.add_argument('--job-timeout', type=float, default=None)
+    worker.add_argument('--wait', action='store_true', help='Keep polling when the queue is empty')
+    worker.add_argument('--prewarm', action='store_true', help='Fork jobs from a forkserver with preloaded modules')
+    worker.add_argument('--budget', default=None, help='JSON BudgetGuard arguments, e.g. \'{"limit_usd": 20}\'')
+    worker.add_argument('--scheduler', default=None,
+                        help='JSON RequestScheduler arguments, e.g. \'{"max_concurrent": 8, "requests_per_minute": 500}\'')
+
+    status = sub.add_parser('status', help='Show job counts')
+    status.add_argument('--queue', required=True)
+    status.add_argument('--failed', action='store_true', help='List failed jobs with their errors')
+
+    startup = sub.add_parser('startup', help='Measure cold and warm job start times')
+    startup.add_argument('--work-root', required=True)
+    startup.add_argument('--runs', type=int, default=5)
+
+    run = sub.add_parser('run-job', help=argparse.SUPPRESS)
+    run.add_argument('job_file')
+    run.add_argument('output_dir')
+    run.add_argument('--modules', default='')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run-job':
+        return _run_job_main(args.job_file, args.output_dir, [m for m in args.modules.split(',') if m])
+    if args.command == 'startup':
+        print(json.dumps(measure_startup(args.work_root, args.runs), indent=2))
+        return 0
+    if args.command == 'enqueue':
+        queue = open_queue(args.queue)
+        configs = [json.loads(c) for c in args.config] or [{}]
+        jobs = sweep_jobs(args.target, [c.strip() for c in args.conditions.split(',') if c.strip()],
+                          _parse_seeds(args.seeds), configs)
+        added = queue.enqueue_many(jobs)
+        print(f'[Work Queue] {added} of {len(jobs)} jobs added to {args.queue}')
+        return 0
+    if args.command == 'worker':
+        queue = open_queue(args.queue, args.lease_seconds, args.max_attempts)
+        w = Worker(queue, args.work_root, job_timeout=args.job_timeout, prewarm=args.prewarm,
+                   budget=json.loads(args.budget) if args.budget else None,
+                   scheduler=json.loads(args.scheduler) if args.scheduler else None)
+        w.start()
+        w.run(max_jobs=args.max_jobs, exit_when_empty=not args.wait)
+        print(f'[Work Queue] {w.worker_id}: {len(w.completed)} done, {len(w.failed)} failed')
+        return 0
+    queue = open_queue(args.queue)
+    print(json.dumps(queue.counts()))
+    if args.failed:
+        for job in queue.jobs(FAILED):
+            print(f'{job.job_id}: {job.error}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,7 +24,7 @@ def run_baseline() -> None:
     embedder = create_simple_embedder()
     entities = create_agents(model, embedder)
 
-    builder = SceneBuilder(model=model, embedder_model=embedder)
+    builder = SceneBuilder(model=model, embedder_model=embedder, model_name=model_config.model_name)
 
     initializer = builder.build_initializer_game_master(
         name='initial setup rules',
@@ -108,19 +108,14 @@ def run_baseline() -> None:
         scene_lib.SceneSpec(scene_type=afterschool_type, participants=['Lily', 'Emma'], num_rounds=3),
     ]
 
-    dialogic_gm = builder.build_dialogic_and_dramaturgic_game_master(
-        name='conversation rules',
-        entities=entities,
-        scenes=scenes_for_dialogic,
-    )
 
     log: list[dict] = []
     total_rounds = sum(s.num_rounds for s in scenes_for_dialogic)
-    builder.run_with_sequential_engine(
-        game_masters=[initializer, dialogic_gm],
+    scene_windows = builder.run_scenes_with_early_termination(
+        scenes=scenes_for_dialogic,
         entities=entities,
-        premise='',
-        max_steps=total_rounds,
+        leading_game_masters=[initializer],
+        game_master_name='conversation rules',
         verbose=True,
         log=log,
     )
@@ -129,13 +124,6 @@ def run_baseline() -> None:
     out_dir = os.path.join('results', 'friendship_formation_and_dissolution', f'run_{ts}', 'condition_baseline')
     os.makedirs(out_dir, exist_ok=True)
     out_file = os.path.join(out_dir, 'simulation_events.jsonl')
-    scene_windows = []
-    current = 1
-    for s in scenes_for_dialogic:
-        start = current
-        end = current + s.num_rounds - 1
-        scene_windows.append((start, end, s.scene_type.name, list(s.participants)))
-        current = end + 1
     with open(out_file, 'w', encoding='utf-8') as f:
         if log:
             step_idx = 1
@@ -209,7 +197,7 @@ def run_interventions() -> None:
     embedder = create_simple_embedder()
     entities = create_agents(model, embedder)
 
-    builder = SceneBuilder(model=model, embedder_model=embedder)
+    builder = SceneBuilder(model=model, embedder_model=embedder, model_name=model_config.model_name)
 
     initializer_params = {
         'next_game_master_name': 'conversation rules',
@@ -346,28 +334,16 @@ def run_interventions() -> None:
             entities=entities,
             params=initializer_params,
         )
-        gm = builder.build_dialogic_and_dramaturgic_game_master(
-            name='conversation rules',
-            entities=entities,
-            scenes=scenes,
-        )
         log: list[dict] = []
         total_rounds = sum(s.num_rounds for s in scenes)
-        builder.run_with_sequential_engine(
-            game_masters=[initializer, gm],
+        windows = builder.run_scenes_with_early_termination(
+            scenes=scenes,
             entities=entities,
-            premise='',
-            max_steps=total_rounds,
+            leading_game_masters=[initializer],
+            game_master_name='conversation rules',
             verbose=True,
             log=log,
         )
-        windows: list[tuple[int,int,str,list[str]]] = []
-        current = 1
-        for s in scenes:
-            start = current
-            end = current + s.num_rounds - 1
-            windows.append((start, end, s.scene_type.name, list(s.participants)))
-            current = end + 1
         os.makedirs(out_dir, exist_ok=True)
         out_file = os.path.join(out_dir, 'simulation_events.jsonl')
         with open(out_file, 'w', encoding='utf-8') as f:
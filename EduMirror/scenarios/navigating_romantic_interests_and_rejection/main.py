@@ -35,28 +35,16 @@ def run_branch(scenes: list[scene_lib.SceneSpec], entities: list[Any], builder:
             'player_specific_memories': AGENT_MEMORIES,
         },
     )
-    gm = builder.build_dialogic_and_dramaturgic_game_master(
-        name='romance_simulation_rules',
-        entities=entities,
-        scenes=scenes,
-    )
     log: list[dict] = []
     total_rounds = sum(s.num_rounds for s in scenes)
-    builder.run_with_sequential_engine(
-        game_masters=[initializer, gm],
+    windows = builder.run_scenes_with_early_termination(
+        scenes=scenes,
         entities=entities,
-        premise='',
-        max_steps=total_rounds,
+        leading_game_masters=[initializer],
+        game_master_name='romance_simulation_rules',
         verbose=True,
         log=log,
     )
-    windows: list[tuple[int,int,str,list[str]]] = []
-    current = 1
-    for s in scenes:
-        start = current
-        end = current + s.num_rounds - 1
-        windows.append((start, end, s.scene_type.name, list(s.participants)))
-        current = end + 1
     os.makedirs(out_dir, exist_ok=True)
     out_file = os.path.join(out_dir, 'simulation_events.jsonl')
     with open(out_file, 'w', encoding='utf-8') as f:
@@ -132,7 +120,7 @@ def run_baseline() -> None:
     embedder = create_simple_embedder()
     entities = create_agents(model, embedder)
 
-    builder = SceneBuilder(model=model, embedder_model=embedder)
+    builder = SceneBuilder(model=model, embedder_model=embedder, model_name=model_config.model_name)
 
     cafeteria_type = scene_lib.SceneTypeSpec(
         name='cafeteria_confession',
@@ -211,7 +199,7 @@ def run_interventions() -> None:
     embedder = create_simple_embedder()
     entities = create_agents(model, embedder)
 
-    builder = SceneBuilder(model=model, embedder_model=embedder)
+    builder = SceneBuilder(model=model, embedder_model=embedder, model_name=model_config.model_name)
 
     cafeteria_type = scene_lib.SceneTypeSpec(
         name='cafeteria_confession',
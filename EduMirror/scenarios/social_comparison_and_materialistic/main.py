@@ -24,7 +24,7 @@ def run_baseline() -> None:
     embedder = create_simple_embedder()
     entities = create_agents(model, embedder)
 
-    builder = SceneBuilder(model=model, embedder_model=embedder)
+    builder = SceneBuilder(model=model, embedder_model=embedder, model_name=model_config.model_name)
 
     initializer = builder.build_initializer_game_master(
         name='initial setup rules',
@@ -112,19 +112,14 @@ def run_baseline() -> None:
         scene_lib.SceneSpec(scene_type=next_day_type, participants=['Alex', 'Ben', 'Chloe'], num_rounds=3),
     ]
 
-    dialogic_gm = builder.build_dialogic_and_dramaturgic_game_master(
-        name='conversation rules',
-        entities=entities,
-        scenes=scenes_for_dialogic,
-    )
 
     log = []
     total_rounds = sum(s.num_rounds for s in scenes_for_dialogic)
-    builder.run_with_sequential_engine(
-        game_masters=[initializer, dialogic_gm],
+    scene_windows = builder.run_scenes_with_early_termination(
+        scenes=scenes_for_dialogic,
         entities=entities,
-        premise='',
-        max_steps=total_rounds,
+        leading_game_masters=[initializer],
+        game_master_name='conversation rules',
         verbose=True,
         log=log,
     )
@@ -133,15 +128,6 @@ def run_baseline() -> None:
     out_dir = os.path.join('results', 'social_comparison_and_materialistic', f'run_{ts}', 'condition_baseline')
     os.makedirs(out_dir, exist_ok=True)
     out_file = os.path.join(out_dir, 'simulation_events.jsonl')
-    scene_windows = [
-        (1, scenes_for_dialogic[0].num_rounds, 'breakroom_showoff', ['Alex','Chloe','Ben']),
-        (scenes_for_dialogic[0].num_rounds + 1,
-         scenes_for_dialogic[0].num_rounds + scenes_for_dialogic[1].num_rounds,
-         'family_dinner_request', ['Alex','Jordan']),
-        (scenes_for_dialogic[0].num_rounds + scenes_for_dialogic[1].num_rounds + 1,
-         scenes_for_dialogic[0].num_rounds + scenes_for_dialogic[1].num_rounds + scenes_for_dialogic[2].num_rounds,
-         'next_day_aftermath', ['Alex','Ben','Chloe']),
-    ]
     with open(out_file, 'w', encoding='utf-8') as f:
         if log:
             for entry in log:
@@ -215,7 +201,7 @@ def run_interventions() -> None:
     embedder = create_simple_embedder()
     entities = create_agents(model, embedder)
 
-    builder = SceneBuilder(model=model, embedder_model=embedder)
+    builder = SceneBuilder(model=model, embedder_model=embedder, model_name=model_config.model_name)
 
     initializer_params = {
         'next_game_master_name': 'conversation rules',
@@ -376,28 +362,16 @@ def run_interventions() -> None:
             entities=entities,
             params=initializer_params,
         )
-        gm = builder.build_dialogic_and_dramaturgic_game_master(
-            name='conversation rules',
-            entities=entities,
-            scenes=scenes,
-        )
         log: list[dict] = []
         total_rounds = sum(s.num_rounds for s in scenes)
-        builder.run_with_sequential_engine(
-            game_masters=[initializer, gm],
+        windows = builder.run_scenes_with_early_termination(
+            scenes=scenes,
             entities=entities,
-            premise='',
-            max_steps=total_rounds,
+            leading_game_masters=[initializer],
+            game_master_name='conversation rules',
             verbose=True,
             log=log,
         )
-        windows: list[tuple[int,int,str,list[str]]] = []
-        current = 1
-        for s in scenes:
-            start = current
-            end = current + s.num_rounds - 1
-            windows.append((start, end, s.scene_type.name, list(s.participants)))
-            current = end + 1
         os.makedirs(out_dir, exist_ok=True)
         out_file = os.path.join(out_dir, 'simulation_events.jsonl')
         with open(out_file, 'w', encoding='utf-8') as f: